@@ -1,81 +1,422 @@
 """
 Este módulo contiene el agente responsable de proponer una clasificación
-arancelaria (HS Code) para un producto basándose en datos estructurados.
+arancelaria (HS Code) para cada ítem de línea de un documento basándose en datos estructurados.
 """
+import hashlib
 import json
-import google.generativeai as genai
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_EXCEPTION, wait
+from typing import Optional
+from sqlalchemy.orm import Session
 from core.config import settings
-from agents.knowledge_agent import search_tariff_schedule
+from core.llm_client import LLMUnavailableError, get_llm_client, llm_model_id
+from core.llm_providers import TASK_TARIFF_CLASSIFICATION
+from db import repository
+from agents.knowledge_agent import (
+    get_knowledge_base,
+    get_knowledge_base_version,
+    lookup_tariff_by_hs_code,
+    search_tariff_schedule_batch,
+)
+from knowledge.build_lock import KnowledgeBaseUnavailableError
+from knowledge.context_builder import build_context, estimate_tokens
+from knowledge.hs_index import find_hs_codes, normalize_hs_code
+from knowledge.query_cache import normalize_description
 
-# Configurar la API de Google al inicio del módulo
-genai.configure(api_key=settings.google_api_key)
+# Confianza asignada cuando el código declarado existe tal cual en el arancel.
+DECLARED_CODE_CONFIDENCE = 0.97
 
-def propose_tariff_classification(structured_data: dict) -> dict:
+# Modelo del LLM. El proveedor y el modelo, junto con la versión del prompt, forman parte de
+# la clave de la caché de clasificaciones. Cambiar el prompt exige subir PROMPT_VERSION para no
+# reutilizar resultados anteriores.
+LLM_MODEL_NAME = 'gemini-pro'
+PROMPT_VERSION = 'line-items-v2'
+
+# Contadores del proceso para medir cuántas llamadas al LLM cuesta cada factura.
+_stats_lock = threading.Lock()
+_stats = {
+    "invoices": 0, "items": 0, "llm_calls": 0, "declared_code_items": 0, "cache_hits": 0, "cache_misses": 0,
+    "prompt_tokens": 0, "context_tokens_retrieved": 0, "context_tokens_sent": 0,
+}
+
+# Aciertos de la caché de clasificaciones pendientes de guardar. Se escriben en bloque cada
+# CACHE_HITS_FLUSH_EVERY aciertos o CACHE_HITS_FLUSH_SECONDS segundos, no en cada lectura.
+CACHE_HITS_FLUSH_EVERY = 100
+CACHE_HITS_FLUSH_SECONDS = 60.0
+_pending_cache_hits: Counter = Counter()
+_last_cache_hits_flush = time.monotonic()
+
+
+def _declared_hs_code(item: dict):
     """
-    Analiza datos, consulta el arancel vía KnowledgeAgent y usa un LLM para proponer
-    una clasificación arancelaria estructurada.
+    Devuelve el código HS declarado de un ítem de línea (campo `hs_code` o código presente
+    en la descripción), o None si no trae ninguno.
+    """
+    code = normalize_hs_code(item.get("hs_code"))
+    if not code:
+        found = find_hs_codes(item.get("item_description") or "")
+        code = found[0] if found else None
+    return code
 
-    Args:
-        structured_data: Un diccionario con la información del producto.
 
-    Returns:
-        Un diccionario con la clasificación propuesta o un diccionario de error.
+def _items_to_classify(structured_data: dict) -> list:
     """
-    print("[+] (Agent: TariffClassifier) Starting tariff classification...")
+    Devuelve la lista de (descripción, código declarado) a clasificar, una por ítem de línea.
+    Los documentos sin ítems se clasifican como un único producto descrito con todos sus campos.
+    """
+    line_items = structured_data.get("line_items") or []
+    if line_items:
+        return [((item.get("item_description") or "").strip(), _declared_hs_code(item)) for item in line_items]
+    product_description = " ".join(str(v) for v in structured_data.values() if v)
+    return [(product_description, None)] if product_description else []
+
 
+def _classification_from_declared_code(hs_code: str, tariff_context: list) -> dict:
+    """
+    Construye la clasificación para un código declarado que se encontró exacto en el arancel,
+    sin consultar al LLM.
+    """
+    source_text = tariff_context[0]
+    return {
+        "hs_code": hs_code,
+        "description": source_text.strip().splitlines()[0],
+        "confidence_score": DECLARED_CODE_CONFIDENCE,
+        "reasoning": "El código HS fue declarado en la factura y se verificó por búsqueda exacta en el arancel.",
+        "source_text": source_text,
+    }
+
+
+def _record_cache_hits(db: Session, cache_keys: list) -> None:
+    """
+    Acumula los aciertos de la caché y los guarda en bloque cuando toca. Un fallo al guardarlos
+    solo se registra: los contadores son informativos y no deben interrumpir la clasificación.
+    """
+    global _last_cache_hits_flush
+    with _stats_lock:
+        _pending_cache_hits.update(cache_keys)
+        if (
+            sum(_pending_cache_hits.values()) < CACHE_HITS_FLUSH_EVERY
+            and time.monotonic() - _last_cache_hits_flush < CACHE_HITS_FLUSH_SECONDS
+        ):
+            return
+        hits = dict(_pending_cache_hits)
+        _pending_cache_hits.clear()
+        _last_cache_hits_flush = time.monotonic()
     try:
-        # Paso 1: Crear una descripción rica del producto.
-        product_description = " ".join(str(v) for v in structured_data.values() if v)
-        if not product_description:
-            raise ValueError("No se pudo crear una descripción del producto a partir de los datos estructurados.")
+        repository.add_classification_cache_hits(db, hits)
+    except Exception as e:
+        db.rollback()
+        print(f"[-] (Agent: TariffClassifier) Could not save {sum(hits.values())} classification cache hits: {e}")
 
-        # Paso 2: Consultar al KnowledgeAgent para obtener el contexto normativo.
-        print(f"[+] (Agent: TariffClassifier) Consulting Knowledge Agent for: '{product_description}'")
-        tariff_context = search_tariff_schedule(product_description)
-        if not tariff_context:
-            raise ValueError("El Knowledge Agent no devolvió ningún contexto del arancel.")
 
-        # Paso 3: Usar el LLM para analizar el contexto y proponer una clasificación.
-        print("[+] (Agent: TariffClassifier) Calling Google Gemini for analysis...")
+def classification_cache_key(description: str, declared_code: Optional[str], kb_version: str, model_id: str) -> str:
+    """
+    Clave de la caché de clasificaciones: descripción normalizada, código declarado (cambia el
+    contexto que recibe el LLM), versión de la base de conocimiento, modelo y versión del prompt.
+    """
+    raw = "\0".join([normalize_description(description), declared_code or "", kb_version, model_id, PROMPT_VERSION])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
-        # Construcción del prompt para el LLM
-        prompt = f"""
-        Actúa como un experto clasificador de aduanas. Tu tarea es analizar la descripción de un producto
-        y, basándote EXCLUSIVAMENTE en los fragmentos del arancel de aduanas proporcionados, proponer
-        la clasificación arancelaria (HS Code) más adecuada.
 
-        **Descripción del Producto:**
-        {product_description}
+def _unclassified_item(reason: str) -> dict:
+    """Clasificación vacía (confianza 0) para un ítem que no se pudo clasificar; fuerza la revisión humana."""
+    return {
+        "hs_code": None,
+        "description": None,
+        "confidence_score": 0.0,
+        "reasoning": reason,
+        "source_text": None,
+    }
 
-        **Fragmentos del Arancel de Aduanas para tu Análisis:**
-        ---
-        {"\n---\n".join(tariff_context)}
----
-".join(tariff_context)
-        ---
+
+def _build_batch_prompt(batch: list) -> str:
+    """
+    Construye un prompt que clasifica varios productos a la vez, cada uno con su propio contexto.
+
+    Args:
+        batch: Lista de tuplas (índice del ítem en el lote, descripción, fragmentos del arancel).
+    """
+    items_text = "\n\n".join(
+        f"### Ítem {item_index}\n"
+        f"Descripción: {description}\n"
+        "Fragmentos del arancel:\n---\n" + "\n---\n".join(context) + "\n---"
+        for item_index, description, context in batch
+    )
+    return f"""
+        Actúa como un experto clasificador de aduanas. Tu tarea es analizar la descripción de varios
+        productos y, basándote EXCLUSIVAMENTE en los fragmentos del arancel de aduanas proporcionados
+        para cada uno, proponer la clasificación arancelaria (HS Code) más adecuada para cada producto.
+
+        **Productos a clasificar:**
+
+{items_text}
 
         **Instrucciones de Salida:**
-        Devuelve tu análisis en un único objeto JSON. El JSON debe tener la siguiente estructura y campos:
+        Devuelve tu análisis en un único array JSON con un objeto por producto. Cada objeto debe tener
+        la siguiente estructura y campos:
+        - \"item_index\": (integer) El número del ítem, tal como aparece en su encabezado.
         - \"hs_code\": (string) El código HS que consideres más apropiado.
         - \"description\": (string) La descripción oficial que corresponde a ese código HS, extraída del contexto.
         - \"confidence_score\": (float) Tu nivel de confianza en la clasificación, entre 0.0 y 1.0.
         - \"reasoning\": (string) Una explicación concisa de por qué elegiste ese código, citando la lógica del arancel.
         - \"source_text\": (string) El fragmento de texto exacto del arancel que usaste como evidencia principal.
 
-        Asegúrate de que la salida sea únicamente el objeto JSON, sin ningún texto o formato adicional.
+        Asegúrate de que la salida sea únicamente el array JSON, sin ningún texto o formato adicional.
         """
 
-        # Llamada a la API de Gemini
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
 
-        # Limpieza y parseo de la respuesta
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "").strip()
-        classification_output = json.loads(cleaned_response)
+def _parse_batch_response(response_text: str) -> dict:
+    """
+    Parsea la respuesta del LLM a un lote.
+
+    Returns:
+        Un diccionario índice del ítem -> clasificación.
+    """
+    cleaned_response = response_text.strip().replace("```json", "").replace("```", "").strip()
+    parsed = json.loads(cleaned_response)
+    if isinstance(parsed, dict):
+        # Tolerar un único objeto o un objeto que envuelve el array.
+        parsed = parsed.get("items", [parsed])
+    if not isinstance(parsed, list):
+        raise ValueError("La respuesta del LLM no es un array JSON.")
+
+    classifications = {}
+    for entry in parsed:
+        if isinstance(entry, dict) and isinstance(entry.get("item_index"), int):
+            item_index = entry.pop("item_index")
+            classifications[item_index] = entry
+    return classifications
+
+
+def get_classification_counters() -> dict:
+    """Devuelve los contadores de clasificación del proceso, sin las métricas derivadas."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def summarize_classification_stats(counters: dict) -> dict:
+    """
+    Añade a unos contadores de clasificación (de un proceso o sumados entre workers) las
+    llamadas al LLM por factura, los tokens por llamada y la tasa de aciertos de la caché.
+    """
+    stats = {**dict.fromkeys(_stats, 0), **counters}
+    stats["llm_calls_per_invoice"] = round(stats["llm_calls"] / stats["invoices"], 3) if stats["invoices"] else 0.0
+    stats["prompt_tokens_per_call"] = round(stats["prompt_tokens"] / stats["llm_calls"], 1) if stats["llm_calls"] else 0.0
+    lookups = stats["cache_hits"] + stats["cache_misses"]
+    stats["cache_hit_ratio"] = round(stats["cache_hits"] / lookups, 3) if lookups else 0.0
+    return stats
+
+
+def get_classification_stats() -> dict:
+    """
+    Devuelve los contadores de clasificación del proceso, incluidas las llamadas al LLM por factura.
+    """
+    return summarize_classification_stats(get_classification_counters())
+
 
-        print("[+] (Agent: TariffClassifier) Successfully received and parsed classification from Gemini.")
-        return classification_output
+def invalidate_stale_classifications(db: Session) -> int:
+    """
+    Elimina de la caché las clasificaciones de otra versión del arancel, del modelo o del
+    prompt, y las caducadas. Lee la versión publicada del arancel y el modelo configurado sin
+    cargar la base de conocimiento ni crear el cliente del LLM (se usa desde la API).
+
+    Returns:
+        El número de entradas eliminadas.
 
+    Raises:
+        KnowledgeBaseUnavailableError: Si todavía no se publicó ninguna versión del arancel.
+    """
+    return repository.invalidate_classification_cache(
+        db, kb_version=get_knowledge_base_version(), model_id=llm_model_id(LLM_MODEL_NAME), prompt_version=PROMPT_VERSION
+    )
+
+
+def propose_tariff_classification(structured_data: dict, db: Optional[Session] = None) -> dict:
+    """
+    Analiza datos, consulta el arancel vía KnowledgeAgent y usa un LLM para proponer
+    una clasificación arancelaria estructurada para cada ítem de línea.
+
+    Los ítems cuyo código declarado existe tal cual en el arancel se resuelven sin LLM. El resto
+    se recupera en una sola búsqueda por lotes y se clasifica en prompts de hasta
+    `classification_batch_size` productos; las descripciones repetidas se clasifican una sola vez.
+    El contexto de cada ítem se compacta a `classification_context_token_budget` tokens.
+
+    Si se pasa una sesión de base de datos, antes se consulta la caché de clasificaciones: los
+    ítems ya clasificados con la misma versión del arancel, modelo y prompt no pasan por el
+    Knowledge Agent ni por el LLM.
+
+    Args:
+        structured_data: Un diccionario con la información del documento.
+        db: Sesión de la base de datos para la caché de clasificaciones (opcional).
+
+    Returns:
+        Un diccionario con la clasificación de cada ítem en "items" (en el orden de
+        `line_items`), la confianza mínima en "confidence_score" y el número de llamadas al
+        LLM en "llm_calls" con los tokens estimados de sus prompts en "prompt_tokens"; o un
+        diccionario de error.
+    """
+    print("[+] (Agent: TariffClassifier) Starting tariff classification...")
+
+    try:
+        # Paso 1: Obtener la descripción (y el código declarado, si lo hay) de cada ítem.
+        items = _items_to_classify(structured_data)
+        if not items:
+            raise ValueError("No se pudo crear una descripción del producto a partir de los datos estructurados.")
+
+        classifications = [None] * len(items)
+        contexts = {}
+        declared_code_items = 0
+        llm_client = get_llm_client(LLM_MODEL_NAME)
+
+        # Paso 2: Reutilizar las clasificaciones ya calculadas para estas descripciones.
+        cache_keys = {}
+        cached_positions = set()
+        if db is not None and settings.classification_cache_enabled:
+            # La versión con la que busca este proceso, para que la clave corresponda al contexto.
+            kb_version = get_knowledge_base().version
+            cache_keys = {
+                position: classification_cache_key(description, code, kb_version, llm_client.model_id)
+                for position, (description, code) in enumerate(items) if description or code
+            }
+            cached = repository.get_cached_classifications(db, list(set(cache_keys.values())))
+            cached_positions = {position for position, key in cache_keys.items() if key in cached}
+            for position in cached_positions:
+                classifications[position] = dict(cached[cache_keys[position]])
+            cache_hits = len(cached_positions)
+            if cache_hits:
+                _record_cache_hits(db, list(cached))
+            with _stats_lock:
+                _stats["cache_hits"] += cache_hits
+                _stats["cache_misses"] += len(cache_keys) - cache_hits
+            if cache_hits:
+                print(f"[+] (Agent: TariffClassifier) {cache_hits} items resolved from the classification cache.")
+
+        # Paso 3: Los ítems con código HS declarado se resuelven por búsqueda exacta en el índice
+        # de códigos, sin embeddings ni LLM, si el código existe tal cual en el arancel.
+        for position, (description, code) in enumerate(items):
+            if classifications[position] is not None:
+                continue
+            context = []
+            if code:
+                chunks, matched_prefix = lookup_tariff_by_hs_code(code)
+                if chunks and matched_prefix == code:
+                    print(f"[+] (Agent: TariffClassifier) Declared HS code {code} verified in the tariff. Skipping LLM.")
+                    classifications[position] = _classification_from_declared_code(code, chunks)
+                    declared_code_items += 1
+                    continue
+                # Los fragmentos de búsqueda exacta tienen la máxima relevancia (distancia 0).
+                context.extend((chunk, 0.0) for chunk in chunks)
+            if not description:
+                classifications[position] = _unclassified_item("El ítem no tiene descripción ni un código HS verificable.")
+                continue
+            contexts[position] = context
+
+        # Paso 4: Completar el contexto del resto de ítems con una única búsqueda vectorial por lotes.
+        unique_descriptions = list(dict.fromkeys(items[position][0] for position in contexts))
+        if unique_descriptions:
+            print(f"[+] (Agent: TariffClassifier) Consulting Knowledge Agent for {len(unique_descriptions)} item descriptions.")
+            search_results = dict(zip(unique_descriptions, search_tariff_schedule_batch(unique_descriptions)))
+            for position, context in contexts.items():
+                context.extend(search_results[items[position][0]])
+
+        # Paso 5: Compactar el contexto de cada ítem dentro del presupuesto de tokens y agrupar
+        # los ítems pendientes (una sola vez por descripción y contexto) para el LLM.
+        groups = {}
+        context_tokens_retrieved = context_tokens_sent = 0
+        for position, context in contexts.items():
+            compact = build_context(items[position][0], context, settings.classification_context_token_budget)
+            if not compact.chunks:
+                classifications[position] = _unclassified_item("El Knowledge Agent no devolvió ningún contexto del arancel.")
+                continue
+            key = (items[position][0], tuple(compact.chunks))
+            if key not in groups:
+                context_tokens_retrieved += compact.tokens_before
+                context_tokens_sent += compact.tokens_after
+            groups.setdefault(key, []).append(position)
+
+        # Los lotes se envían a la vez; el cliente del LLM limita la concurrencia y la tasa.
+        pending = list(groups.items())
+        batch_size = max(1, settings.classification_batch_size)
+        batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+        responses = []
+        prompt_tokens = 0
+        for batch in batches:
+            prompt = _build_batch_prompt(
+                [(item_index, description, list(context)) for item_index, ((description, context), _) in enumerate(batch)]
+            )
+            prompt_tokens += estimate_tokens(prompt)
+            print(f"[+] (Agent: TariffClassifier) Calling Google Gemini for {len(batch)} items (~{estimate_tokens(prompt)} prompt tokens)...")
+            responses.append(llm_client.submit(prompt, task=TASK_TARIFF_CLASSIFICATION))
+        llm_calls = len(batches)
+
+        # Si un lote falla, se cancelan los que siguen pendientes en vez de dejarlos consumiendo
+        # cuota del LLM, y se propaga su error (LLMUnavailableError sigue siendo reintentable).
+        done, not_done = wait(responses, return_when=FIRST_EXCEPTION)
+        failed = next((response for response in responses if response in done and response.exception()), None)
+        if failed is not None:
+            for response in not_done:
+                response.cancel()
+            raise failed.exception()
+
+        for batch, response in zip(batches, responses):
+            batch_classifications = _parse_batch_response(response.result())
+            for item_index, (_, positions) in enumerate(batch):
+                classification = batch_classifications.get(item_index) or _unclassified_item(
+                    "El LLM no devolvió una clasificación para este ítem."
+                )
+                for position in positions:
+                    classifications[position] = dict(classification)
+
+        # Paso 6: Guardar en la caché las clasificaciones nuevas (no las de ítems sin clasificar).
+        new_entries = {}
+        for position, key in cache_keys.items():
+            classification = classifications[position]
+            if position not in cached_positions and classification.get("hs_code") and key not in new_entries:
+                new_entries[key] = {
+                    "cache_key": key,
+                    "normalized_description": normalize_description(items[position][0]),
+                    "kb_version": kb_version,
+                    "model_id": llm_client.model_id,
+                    "prompt_version": PROMPT_VERSION,
+                    "classification": classification,
+                }
+        if new_entries:
+            repository.save_cached_classifications(
+                db, list(new_entries.values()), ttl_seconds=settings.classification_cache_ttl_seconds
+            )
+
+        result_items = []
+        for position, ((description, _), classification) in enumerate(zip(items, classifications)):
+            result_items.append({"line_index": position, "item_description": description, **classification})
+
+        with _stats_lock:
+            _stats["invoices"] += 1
+            _stats["items"] += len(items)
+            _stats["llm_calls"] += llm_calls
+            _stats["declared_code_items"] += declared_code_items
+            _stats["prompt_tokens"] += prompt_tokens
+            _stats["context_tokens_retrieved"] += context_tokens_retrieved
+            _stats["context_tokens_sent"] += context_tokens_sent
+
+        print(f"[+] (Agent: TariffClassifier) Classified {len(items)} items with {llm_calls} LLM calls.")
+        return {
+            "items": result_items,
+            "confidence_score": min(float(item.get("confidence_score") or 0.0) for item in result_items),
+            "llm_calls": llm_calls,
+            "prompt_tokens": prompt_tokens,
+        }
+
+    except (KnowledgeBaseUnavailableError, LLMUnavailableError) as e:
+        # Respuesta degradada: la base de conocimiento se está construyendo en otro proceso, o el
+        # LLM sigue devolviendo errores transitorios tras los reintentos.
+        print(f"[-] (Agent: TariffClassifier) Classification temporarily unavailable: {e}")
+        return {
+            "error": True,
+            "retryable": True,
+            "message": str(e)
+        }
     except Exception as e:
         # Captura cualquier error (de red, de parseo, etc.) y lo reporta.
         print(f"[-] (Agent: TariffClassifier) An error occurred: {e}")
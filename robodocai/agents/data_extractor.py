@@ -1,6 +1,76 @@
-import fitz  # PyMuPDF
+import json
+import threading
 import pydantic
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from agents import template_extractor
+from core.config import settings
+from core.llm_client import LLMClient, LLMUnavailableError, get_llm_client
+from core.llm_providers import TASK_INVOICE_EXTRACTION, TASK_INVOICE_HEADER, TASK_INVOICE_LINE_ITEMS
+from processing.pdf_text import PAGE_SEPARATOR, DocumentTooLargeError, iter_pdf_pages
+
+# Modelo del LLM usado para la extracción; el proveedor se elige con `llm_provider`.
+EXTRACTION_MODEL_NAME = 'gemini-pro'
+# Versión del extractor (prompt + esquema). Forma parte de la clave de la caché de extracciones:
+# cambiar el prompt o CommercialInvoiceData exige subirla.
+EXTRACTOR_VERSION = 'invoice-v2'
+
+# Campos que se piden al LLM (compartidos por el prompt completo y los de la extracción por ventanas).
+_HEADER_FIELDS_PROMPT = """        - **invoice_id**: (string) El número de la factura.
+        - **issue_date**: (string) La fecha de emisión en formato YYYY-MM-DD.
+        - **seller_name**: (string) El nombre del vendedor.
+        - **seller_address**: (string) La dirección del vendedor.
+        - **seller_tax_id**: (string) El ID fiscal del vendedor.
+        - **buyer_name**: (string) El nombre del comprador.
+        - **buyer_address**: (string) La dirección del comprador.
+        - **buyer_tax_id**: (string) El ID fiscal del comprador.
+        - **incoterm**: (string) El Incoterm (ej. FOB, CIF).
+        - **currency**: (string) La moneda (ej. USD).
+        - **subtotal_amount**: (float) El subtotal antes de impuestos.
+        - **total_amount**: (float) El total final.
+        - **country_of_origin**: (string) El país de origen."""
+_LINE_ITEM_FIELDS_PROMPT = """          - **item_description**: (string) La descripción del producto.
+          - **quantity**: (float) La cantidad.
+          - **unit_price**: (float) El precio por unidad.
+          - **total_price**: (float) El precio total del ítem.
+          - **hs_code**: (string) El código arancelario (HS Code) si aparece en la línea."""
+
+# Origen de cada extracción: caché por huella del archivo, plantilla del vendedor o LLM.
+EXTRACTION_SOURCES = ("cache", "template", "llm")
+_stats_lock = threading.Lock()
+_stats = {source: 0 for source in EXTRACTION_SOURCES}
+
+
+def record_extraction_source(source: str) -> None:
+    """Cuenta una extracción según su origen (uno de EXTRACTION_SOURCES)."""
+    with _stats_lock:
+        _stats[source] += 1
+
+
+def get_extraction_counters() -> dict:
+    """Devuelve las extracciones de este worker por origen."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def summarize_extraction_stats(counters: dict) -> dict:
+    """
+    Añade a unos contadores de extracción por origen (de un proceso o sumados entre workers)
+    la fracción que no necesitó el LLM.
+    """
+    stats = {source: counters.get(source, 0) for source in EXTRACTION_SOURCES}
+    total = sum(stats.values())
+    stats["llm_bypass_ratio"] = round((total - stats["llm"]) / total, 3) if total else None
+    return stats
+
+
+def get_extraction_stats() -> dict:
+    """
+    Devuelve las extracciones de este worker por origen y la fracción que no necesitó el LLM.
+    """
+    return summarize_extraction_stats(get_extraction_counters())
 
 # --- Modelos de Datos Pydantic para la Factura Comercial ---
 
@@ -53,20 +123,61 @@ class CommercialInvoiceData(pydantic.BaseModel):
     )
 
 
+def split_page_windows(pages: List[str], window_pages: int, overlap_pages: int) -> List[str]:
+    """
+    Divide las páginas de un documento en ventanas de `window_pages` páginas que se solapan en
+    `overlap_pages`, de modo que un ítem cortado entre dos páginas aparezca completo en alguna.
+
+    Returns:
+        El texto de cada ventana, en orden.
+    """
+    step = max(1, window_pages - overlap_pages)
+    windows = []
+    for start in range(0, len(pages), step):
+        windows.append(PAGE_SEPARATOR.join(pages[start:start + window_pages]))
+        if start + window_pages >= len(pages):
+            break
+    return windows
+
+
+def _line_item_key(item: LineItemData) -> tuple:
+    description = " ".join((item.item_description or "").lower().split())
+    return description, item.quantity, item.unit_price
+
+
+def merge_line_items(windows_items: List[List[LineItemData]]) -> List[LineItemData]:
+    """
+    Une los ítems extraídos de ventanas consecutivas. Los ítems de las páginas solapadas aparecen
+    al final de una ventana y al principio de la siguiente: se descarta el prefijo de cada
+    ventana que coincide con el final de lo ya unido (por descripción, cantidad y precio), sin
+    tocar los ítems repetidos legítimamente dentro de una misma ventana.
+    """
+    merged: List[LineItemData] = []
+    for items in windows_items:
+        keys = [_line_item_key(item) for item in items]
+        merged_keys = [_line_item_key(item) for item in merged]
+        overlap = 0
+        for size in range(min(len(keys), len(merged_keys)), 0, -1):
+            if merged_keys[-size:] == keys[:size]:
+                overlap = size
+                break
+        merged.extend(items[overlap:])
+    return merged
+
+
 class DataExtractorAgent:
     """
     Agente responsable de extraer texto de un documento y usar un LLM
     para estructurarlo en un modelo Pydantic validado.
     """
-    def __init__(self, model_llm=None):
+    def __init__(self, model_llm: Optional[LLMClient] = None):
         """
         Inicializa el agente.
         Args:
-            model_llm: Una instancia de un modelo de lenguaje generativo (como Gemini).
-                       Se pasa como argumento para facilitar las pruebas y la flexibilidad.
+            model_llm: El cliente del LLM a usar. Por defecto, el cliente compartido del proceso
+                       para el proveedor configurado (Gemini o el sustituto local).
         """
-        # self.llm = model_llm # <-- Descomentaremos esto cuando integremos el LLM real
-        pass
+        self.llm = model_llm or get_llm_client(EXTRACTION_MODEL_NAME)
 
     def _get_extraction_prompt(self, raw_text: str) -> str:
         """
@@ -83,100 +194,216 @@ class DataExtractorAgent:
 
         **Instrucciones de Salida:**
         Devuelve un único objeto JSON que se ajuste a la siguiente estructura. Si un campo no se encuentra en el texto, omítelo del JSON (no uses valores nulos o "N/A").
-        - **invoice_id**: (string) El número de la factura.
-        - **issue_date**: (string) La fecha de emisión en formato YYYY-MM-DD.
-        - **seller_name**: (string) El nombre del vendedor.
-        - **seller_address**: (string) La dirección del vendedor.
-        - **seller_tax_id**: (string) El ID fiscal del vendedor.
-        - **buyer_name**: (string) El nombre del comprador.
-        - **buyer_address**: (string) La dirección del comprador.
-        - **buyer_tax_id**: (string) El ID fiscal del comprador.
-        - **incoterm**: (string) El Incoterm (ej. FOB, CIF).
-        - **currency**: (string) La moneda (ej. USD).
-        - **subtotal_amount**: (float) El subtotal antes de impuestos.
-        - **total_amount**: (float) El total final.
-        - **country_of_origin**: (string) El país de origen.
+{_HEADER_FIELDS_PROMPT}
         - **line_items**: (array de objetos) Una lista de los productos, donde cada objeto tiene:
-          - **item_description**: (string) La descripción del producto.
-          - **quantity**: (float) La cantidad.
-          - **unit_price**: (float) El precio por unidad.
-          - **total_price**: (float) El precio total del ítem.
+{_LINE_ITEM_FIELDS_PROMPT}
 
         Asegúrate de que la salida sea únicamente el objeto JSON, sin texto o formato adicional.
         """
         return prompt
 
-    def extract_from_commercial_invoice(self, file_path: str) -> Optional[CommercialInvoiceData]:
+    def _get_header_prompt(self, text: str) -> str:
         """
-        Orquesta la extracción de datos de una factura comercial en PDF.
+        Genera el prompt para extraer solo los campos de encabezado de una factura larga.
+        """
+        prompt = f"""
+        Actúa como un sistema experto en extracción de datos de documentos de comercio exterior.
+        El siguiente texto contiene las primeras y la última página de una factura comercial larga.
+        Extrae únicamente los datos de encabezado y totales; no incluyas los ítems de línea.
+
+        **Texto Crudo del Documento:**
+        ---
+        {text}
+        ---
+
+        **Instrucciones de Salida:**
+        Devuelve un único objeto JSON que se ajuste a la siguiente estructura. Si un campo no se encuentra en el texto, omítelo del JSON (no uses valores nulos o "N/A").
+{_HEADER_FIELDS_PROMPT}
+
+        Asegúrate de que la salida sea únicamente el objeto JSON, sin texto o formato adicional.
+        """
+        return prompt
+
+    def _get_line_items_prompt(self, window_text: str, window_number: int, window_count: int) -> str:
+        """
+        Genera el prompt para extraer los ítems de línea de una ventana de páginas.
+        """
+        prompt = f"""
+        Actúa como un sistema experto en extracción de datos de documentos de comercio exterior.
+        El siguiente texto es el fragmento {window_number} de {window_count} de una factura comercial larga.
+        Extrae únicamente los ítems de línea que aparecen en este fragmento, en el orden del documento.
+        Si un ítem aparece cortado al principio o al final del fragmento, omítelo: los fragmentos se
+        solapan y aparecerá completo en el fragmento vecino.
+
+        **Fragmento del Documento:**
+        ---
+        {window_text}
+        ---
+
+        **Instrucciones de Salida:**
+        Devuelve un único objeto JSON con la clave **line_items**: (array de objetos), donde cada objeto tiene:
+{_LINE_ITEM_FIELDS_PROMPT}
+
+        Asegúrate de que la salida sea únicamente el objeto JSON, sin texto o formato adicional.
+        """
+        return prompt
+
+    @staticmethod
+    def _parse_json_response(response_text: str) -> dict:
+        cleaned_response = response_text.strip().replace("```json", "").replace("```", "").strip()
+        return json.loads(cleaned_response)
+
+    def _extract_windowed(self, pages: List[str]) -> CommercialInvoiceData:
+        """
+        Extrae una factura larga por ventanas: el encabezado con una llamada (primera ventana y
+        última página) y los ítems de cada ventana con llamadas concurrentes, que luego se unen.
+        """
+        window_pages = settings.extraction_window_pages
+        windows = split_page_windows(pages, window_pages, settings.extraction_window_overlap_pages)
+        header_text = PAGE_SEPARATOR.join(pages[:window_pages] + pages[-1:])
+        header_future = self.llm.submit(self._get_header_prompt(header_text), task=TASK_INVOICE_HEADER)
+        window_futures = [
+            self.llm.submit(
+                self._get_line_items_prompt(window_text, number, len(windows)), task=TASK_INVOICE_LINE_ITEMS
+            )
+            for number, window_text in enumerate(windows, start=1)
+        ]
+
+        header = self._parse_json_response(header_future.result())
+        header.pop("line_items", None)
+        windows_items = [
+            [LineItemData(**item) for item in self._parse_json_response(future.result()).get("line_items", [])]
+            for future in window_futures
+        ]
+        line_items = merge_line_items(windows_items)
+        print(
+            f"[+] (Agent: DataExtractor) Extracción por ventanas: {len(pages)} páginas, {len(windows)} ventanas, "
+            f"{sum(len(items) for items in windows_items)} ítems extraídos, {len(line_items)} tras unir."
+        )
+        return CommercialInvoiceData(**header, line_items=line_items)
+
+    @property
+    def version(self) -> str:
+        """Identifica el extractor (versión del prompt y modelo) para la caché de extracciones."""
+        return f"{EXTRACTOR_VERSION}:{self.llm.model_id}"
+
+    def extract_pages(self, file_path: str) -> List[str]:
+        """
+        Extrae el texto crudo de un PDF, página a página, usando PyMuPDF (en paralelo por rangos
+        de páginas para los documentos largos).
 
         Args:
             file_path: La ruta al archivo PDF.
 
+        Returns:
+            El texto de cada página, en orden, o una lista vacía si no se pudo leer.
+
+        Raises:
+            DocumentTooLargeError: Si el documento supera los límites de tamaño, páginas o texto.
+        """
+        try:
+            return list(iter_pdf_pages(file_path))
+        except DocumentTooLargeError:
+            raise
+        except Exception as e:
+            print(f"[-] (Agent: DataExtractor) Ocurrió un error al leer el PDF: {e}")
+            return []
+
+    def extract_from_pages(self, pages: List[str]) -> Optional[CommercialInvoiceData]:
+        """
+        Estructura el texto crudo de una factura comercial usando el LLM.
+
+        Args:
+            pages: El texto extraído de cada página del documento.
+
         Returns:
             Una instancia del modelo Pydantic CommercialInvoiceData con los datos extraídos,
             o None si ocurre un error.
+
+        Raises:
+            LLMUnavailableError: Si el LLM sigue fallando con errores transitorios tras los reintentos.
         """
-        print(f"[+] (Agent: DataExtractor) Procesando factura: {file_path}")
+        if not any(page.strip() for page in pages):
+            print("[-] (Agent: DataExtractor) Advertencia: No se extrajo texto del documento.")
+            return None
         try:
-            # 1. Extraer texto crudo del PDF usando PyMuPDF
-            doc = fitz.open(file_path)
-            raw_text = ""
-            for page in doc:
-                raw_text += page.get_text("text")
-            doc.close()
-
-            if not raw_text.strip():
-                print("[-] (Agent: DataExtractor) Advertencia: No se extrajo texto del documento.")
-                return None
-
-            # --- AQUI IRÁ LA LLAMADA AL LLM ---
-            # Por ahora, simularemos la respuesta del LLM para poder seguir desarrollando
-            
-            # 1. Generar el prompt
-            prompt = self._get_extraction_prompt(raw_text)
-            print("\n--- PROMPT PARA EL LLM (SIMULADO) ---")
-            print(prompt)
-            print("--------------------------------------\n")
-            
-            # 2. Simular la respuesta JSON del LLM
-            simulated_llm_json_response = {
-                "invoice_id": "FAC-2024-08-13",
-                "issue_date": "2024-08-13",
-                "seller_name": "Componentes Electrónicos de Colombia S.A.S.",
-                "seller_address": "Zona Franca, Bodega 5, Cartagena, Colombia",
-                "seller_tax_id": "900.123.456-7",
-                "buyer_name": "Tech Imports LLC",
-                "buyer_address": "123 Tech Way, Miami, FL 33101, USA",
-                "buyer_tax_id": "US-59-1234567",
-                "incoterm": "FOB Cartagena",
-                "currency": "USD",
-                "country_of_origin": "Colombia",
-                "line_items": [
-                    {
-                        "item_description": "Microcontrolador ATmega328P-PU",
-                        "quantity": 1500.0,
-                        "unit_price": 2.50,
-                        "total_price": 3750.0
-                    },
-                    {
-                        "item_description": "Sensor de Humedad y Temperatura DHT22",
-                        "quantity": 500.0,
-                        "unit_price": 4.15,
-                        "total_price": 2075.0
-                    }
-                ],
-                "subtotal_amount": 5825.0,
-                "total_amount": 5825.0
-            }
-
-            # 3. Validar y crear el objeto Pydantic a partir de la respuesta (real o simulada)
-            invoice_data = CommercialInvoiceData(**simulated_llm_json_response)
-            
+            if len(pages) > settings.extraction_windowed_min_pages:
+                # Factura larga: por ventanas de páginas en lugar de un único prompt enorme.
+                invoice_data = self._extract_windowed(pages)
+                print("[+] (Agent: DataExtractor) Datos estructurados y validados exitosamente.")
+                return invoice_data
+
+            # 1. Generar el prompt y llamar al LLM
+            prompt = self._get_extraction_prompt(PAGE_SEPARATOR.join(pages))
+            response_text = self.llm.generate(prompt, task=TASK_INVOICE_EXTRACTION)
+            llm_json_response = self._parse_json_response(response_text)
+
+            # 2. Validar y crear el objeto Pydantic a partir de la respuesta
+            invoice_data = CommercialInvoiceData(**llm_json_response)
+
             print("[+] (Agent: DataExtractor) Datos estructurados y validados exitosamente.")
             return invoice_data
 
+        except LLMUnavailableError:
+            # Transitorio: el llamador puede reintentar más tarde.
+            raise
         except Exception as e:
             print(f"[-] (Agent: DataExtractor) Ocurrió un error al extraer datos: {e}")
             return None
 
+    def extract_from_document(
+        self, file_path: str, pages: List[str], db: Session
+    ) -> Tuple[Optional[CommercialInvoiceData], str]:
+        """
+        Estructura una factura comercial: primero con la plantilla de su vendedor, si su diseño
+        coincide con una aprendida, y si no con el LLM.
+
+        Args:
+            file_path: La ruta al archivo PDF.
+            pages: El texto extraído de cada página del documento.
+            db: La sesión de la base de datos (plantillas aprendidas).
+
+        Returns:
+            Los datos extraídos (o None si ocurre un error) y su origen ("template" o "llm").
+        """
+        if settings.templates_enabled:
+            try:
+                data = template_extractor.extract_with_template(db, file_path, settings.template_min_similarity)
+                if data is not None:
+                    invoice_data = CommercialInvoiceData(**data)
+                    record_extraction_source("template")
+                    return invoice_data, "template"
+            except Exception as e:
+                print(f"[-] (Agent: DataExtractor) La extracción por plantilla falló, se usará el LLM: {e}")
+        record_extraction_source("llm")
+        return self.extract_from_pages(pages), "llm"
+
+    def learn_template(self, file_path: str, validated_data: dict, db: Session) -> Optional[int]:
+        """
+        Aprende la plantilla del diseño de una factura a partir de sus datos ya validados, para
+        extraer sin LLM las siguientes facturas del mismo vendedor.
+
+        Returns:
+            El id de la plantilla guardada, o None si no se pudo aprender.
+        """
+        if not settings.templates_enabled:
+            return None
+        try:
+            return template_extractor.learn_template(db, file_path, validated_data, settings.template_min_similarity)
+        except Exception as e:
+            print(f"[-] (Agent: DataExtractor) No se pudo aprender la plantilla de {file_path}: {e}")
+            return None
+
+    def extract_from_commercial_invoice(self, file_path: str) -> Optional[CommercialInvoiceData]:
+        """
+        Orquesta la extracción de datos de una factura comercial en PDF.
+
+        Args:
+            file_path: La ruta al archivo PDF.
+
+        Returns:
+            Una instancia del modelo Pydantic CommercialInvoiceData con los datos extraídos,
+            o None si ocurre un error.
+        """
+        print(f"[+] (Agent: DataExtractor) Procesando factura: {file_path}")
+        return self.extract_from_pages(self.extract_pages(file_path))
@@ -1,10 +1,31 @@
+import hashlib
+import json
 import os
+import shutil
+import threading
+import time
+from collections import deque
 import faiss
 import numpy as np
-import pickle
-from pypdf import PdfReader
-from sentence_transformers import SentenceTransformer
-from typing import List
+from typing import List, NamedTuple, Optional, Tuple
+
+from core.config import settings
+from knowledge.build_pipeline import BuildProgress, ParallelEncoder, batched, extract_pages, iter_paragraph_chunks
+from knowledge.build_lock import BuildLock, KnowledgeBaseUnavailableError, cleanup_old_builds, publish_build
+from knowledge.chunk_store import ChunkStore, ChunkStoreWriter, offsets_path_for
+from knowledge.embedding_cache import EmbeddingCache, chunk_key
+from knowledge.encoders import create_encoder
+from knowledge.hs_index import HSCodeIndex
+from knowledge.query_cache import TariffQueryCache
+from knowledge.retrieval_server import RetrievalClient
+from knowledge.index_factory import (
+    apply_search_params,
+    build_index_streaming,
+    index_params_from_settings,
+    load_index_metadata,
+    read_index_shared,
+    save_index_metadata,
+)
 
 # --- Configuración de la Base de Conocimiento ---
 
@@ -12,57 +33,522 @@ from typing import List
 KB_DIR = os.path.join(os.path.dirname(__file__), '..', 'kb')
 os.makedirs(KB_DIR, exist_ok=True)
 
+# Cada construcción se escribe en `kb/builds/<id>/` y se publica apuntando a ella el enlace
+# `kb/current`; los lectores siempre abren los artefactos a través de ese enlace.
+BUILDS_DIR = os.path.join(KB_DIR, 'builds')
+CURRENT_KB_DIR = os.path.join(KB_DIR, 'current')
+BUILD_LOCK_FILE = os.path.join(KB_DIR, 'build.lock')
+
 # Archivos clave
 ARANCEL_PDF_FILE = os.path.join(os.path.dirname(__file__), '..', 'arancel_aduanas.pdf')
-INDEX_FILE = os.path.join(KB_DIR, 'faiss_index.bin')
-CHUNKS_FILE = os.path.join(KB_DIR, 'text_chunks.pkl')
+INDEX_FILENAME = 'faiss_index.bin'
+CHUNKS_FILENAME = 'text_chunks.bin'
+HS_INDEX_FILENAME = 'hs_index.json'
+# Las cachés se comparten entre versiones de la base de conocimiento.
+EMBEDDING_CACHE_FILE = os.path.join(KB_DIR, 'embedding_cache.sqlite3')
+QUERY_CACHE_FILE = os.path.join(KB_DIR, 'query_cache.sqlite3')
+# Exportaciones ONNX del modelo de embedding (backends "onnx" y "onnx_int8").
+ENCODERS_DIR = os.path.join(KB_DIR, 'encoders')
 
 # Modelo de embedding
 MODEL_NAME = 'all-MiniLM-L6-v2'
 
+# Cada cuántos segundos, como máximo, se comprueba si se publicó una nueva versión en `kb/current`.
+RELOAD_CHECK_INTERVAL_SECONDS = 5.0
+
+
+def _source_pdf_files() -> List[str]:
+    """
+    Devuelve los PDFs que forman la base de conocimiento: el arancel y las fuentes
+    adicionales configuradas (reglamentos, resoluciones, etc.).
+    """
+    return [ARANCEL_PDF_FILE] + list(settings.kb_extra_source_pdfs)
+
+
+def _build_knowledge_base_into(output_dir: str) -> dict:
+    """
+    Construye la base de conocimiento vectorial a partir de los PDFs fuente en `output_dir`.
+
+    No coordina con otros procesos ni publica el resultado: eso lo hace `build_knowledge_base`.
+
+    La construcción es un pipeline en flujo: las páginas se extraen en un pool de procesos y
+    se dividen en fragmentos a medida que llegan; los fragmentos se agrupan en lotes de
+    `kb_build_batch_size`, se vectorizan (en uno o varios procesos) y se añaden al índice de
+    forma incremental. La memoria máxima no depende del tamaño de los PDFs.
+
+    Los embeddings se guardan en una caché persistente indexada por el hash del texto de cada
+    fragmento y el nombre del modelo, así que una reconstrucción solo vectoriza los fragmentos
+    nuevos o modificados y descarta los que ya no existen.
+
+    Returns:
+        Un diccionario con el número de fragmentos totales, reutilizados, recalculados y eliminados,
+        además de páginas procesadas y duración.
+    """
+    print("[+] (KnowledgeAgent) Construyendo la base de conocimiento...")
+
+    # 1. Validar que los PDFs existan
+    source_files = _source_pdf_files()
+    for pdf_file in source_files:
+        if not os.path.exists(pdf_file):
+            raise FileNotFoundError(
+                f"El archivo fuente ('{os.path.basename(pdf_file)}') no se encontró. "
+                "Por favor, añádelo para poder crear la base de conocimiento."
+            )
+
+    progress = BuildProgress()
+    stats = {"total_chunks": 0, "reused": 0, "recomputed": 0, "removed": 0}
+    keys: List[str] = []
+    hs_entries = set()
+    index_file = os.path.join(output_dir, INDEX_FILENAME)
+    chunks_file = os.path.join(output_dir, CHUNKS_FILENAME)
+    chunk_writer = ChunkStoreWriter(chunks_file)
+    cache = EmbeddingCache(EMBEDDING_CACHE_FILE)
+    encoder = ParallelEncoder(MODEL_NAME, workers=settings.kb_embedding_workers)
+
+    # 2. Flujo de fragmentos: páginas extraídas en paralelo y divididas en párrafos.
+    def chunk_stream():
+        for pdf_file in source_files:
+            print(f"[+] (KnowledgeAgent) Leyendo texto de '{os.path.basename(pdf_file)}'...")
+            pages = extract_pages(pdf_file, workers=settings.kb_pdf_workers, pages_per_task=settings.kb_pages_per_task)
+            yield from iter_paragraph_chunks(progress.count_pages(pages))
+
+    # 3. Lotes de embeddings: se reutiliza la caché y solo se vectoriza lo que falta. Hay como
+    # máximo `2 * kb_embedding_workers` lotes en vuelo.
+    def embedding_batches():
+        in_flight: deque = deque()
+        max_in_flight = max(1, 2 * settings.kb_embedding_workers)
+        seen = set()
+
+        def resolve(entry):
+            batch_keys, found, missing_keys, future = entry
+            if missing_keys:
+                new_embeddings = future.result()
+                cache.put_many(missing_keys, new_embeddings)
+                found.update(zip(missing_keys, new_embeddings))
+                progress.embedded += len(missing_keys)
+            # Fragmentos repetidos que se vectorizaron en un lote anterior (ya resuelto y en caché).
+            repeated = [key for key in batch_keys if key not in found]
+            if repeated:
+                found.update(cache.get_many(repeated))
+            progress.log()
+            return np.vstack([found[key] for key in batch_keys])
+
+        for batch_texts in batched(chunk_stream(), settings.kb_build_batch_size):
+            batch_keys = []
+            for text in batch_texts:
+                chunk_id = chunk_writer.append(text)
+                hs_entries.update(HSCodeIndex.entries_for_chunk(chunk_id, text))
+                batch_keys.append(chunk_key(text, MODEL_NAME))
+            keys.extend(batch_keys)
+            progress.chunks += len(batch_texts)
+
+            found = cache.get_many(batch_keys)
+            missing = {key: text for key, text in zip(batch_keys, batch_texts) if key not in found and key not in seen}
+            new_keys = set(batch_keys) - seen
+            seen.update(new_keys)
+            stats["recomputed"] += len(missing)
+            stats["reused"] += len(new_keys) - len(missing)
+
+            future = encoder.submit(list(missing.values())) if missing else None
+            in_flight.append((batch_keys, found, list(missing), future))
+            if len(in_flight) >= max_in_flight:
+                yield resolve(in_flight.popleft())
+
+        while in_flight:
+            yield resolve(in_flight.popleft())
+
+    # El tipo de índice (flat, IVF, HNSW) y la codificación de los vectores se eligen en la
+    # configuración; sus metadatos se guardan junto al índice para que las consultas usen
+    # los mismos parámetros.
+    index_params = index_params_from_settings()
+    print(
+        f"[+] (KnowledgeAgent) Creando el índice FAISS "
+        f"({index_params['index_type']}, {index_params['encoding']})..."
+    )
+    try:
+        index, index_metadata = build_index_streaming(embedding_batches(), **index_params)
+        stats["removed"] = cache.retain_only(keys)
+    except BaseException:
+        chunk_writer.abort()
+        raise
+    finally:
+        encoder.close()
+        cache.close()
+
+    stats["total_chunks"] = len(keys)
+    stats["pages"] = progress.pages
+    stats["seconds"] = round(time.perf_counter() - progress.started_at, 2)
+    print(f"[+] (KnowledgeAgent) El texto fue dividido en {len(keys)} fragmentos ({progress.pages} páginas).")
+    print(
+        f"[+] (KnowledgeAgent) Embeddings: {stats['reused']} reutilizados, "
+        f"{stats['recomputed']} recalculados, {stats['removed']} eliminados de la caché."
+    )
+
+    # 4. Guardar el índice exacto por código HS (partida/subpartida -> fragmento)
+    hs_index = HSCodeIndex.from_entries(hs_entries)
+    hs_index.save(os.path.join(output_dir, HS_INDEX_FILENAME))
+    print(f"[+] (KnowledgeAgent) Índice de códigos HS guardado con {len(hs_index)} entradas.")
+
+    # 5. Guardar el índice FAISS
+    index_metadata["model_name"] = MODEL_NAME
+    # La versión identifica el contenido del índice; las cachés de consultas dependen de ella.
+    index_metadata["kb_version"] = hashlib.sha256(
+        ("".join(keys) + json.dumps(index_metadata, sort_keys=True)).encode("utf-8")
+    ).hexdigest()[:16]
+    faiss.write_index(index, index_file)
+    index_metadata["bytes_per_vector"] = round(os.path.getsize(index_file) / max(index.ntotal, 1), 1)
+    save_index_metadata(index_file, index_metadata)
+    print(
+        f"[+] (KnowledgeAgent) Índice FAISS guardado en '{index_file}' "
+        f"({index_metadata['bytes_per_vector']} bytes por vector)."
+    )
+
+    # 6. Guardar los fragmentos de texto (blob UTF-8 + offsets, leídos luego con mmap)
+    chunk_writer.commit()
+    print(f"[+] (KnowledgeAgent) Fragmentos de texto guardados en '{chunks_file}'")
+    print(f"[+] (KnowledgeAgent) Base de conocimiento construida en {stats['seconds']} s.")
+
+    return stats
 
-def _create_knowledge_base():
+
+def knowledge_base_exists() -> bool:
+    """Indica si hay una versión de la base de conocimiento publicada."""
+    return all(os.path.exists(path) for path in (
+        os.path.join(CURRENT_KB_DIR, INDEX_FILENAME),
+        os.path.join(CURRENT_KB_DIR, CHUNKS_FILENAME),
+        offsets_path_for(os.path.join(CURRENT_KB_DIR, CHUNKS_FILENAME)),
+    ))
+
+
+def build_knowledge_base(force: bool = True, wait_seconds: Optional[float] = None) -> Optional[dict]:
+    """
+    Construye la base de conocimiento coordinando con el resto de procesos.
+
+    Solo un proceso construye a la vez (candado de archivo en `kb/build.lock`). La construcción
+    se escribe en un directorio temporal de `kb/builds/` y se publica de forma atómica
+    cambiando el enlace `kb/current`, así que los lectores nunca ven una versión a medias.
+
+    Args:
+        force: Si es False y ya hay una versión publicada, no se reconstruye (útil para
+            asegurar que la base exista). Si es True, siempre se reconstruye (de forma
+            incremental gracias a la caché de embeddings).
+        wait_seconds: Tiempo máximo de espera si otro proceso está construyendo.
+            None = esperar indefinidamente.
+
+    Returns:
+        Las estadísticas de la construcción, o None si no hizo falta construir.
+
+    Raises:
+        KnowledgeBaseUnavailableError: Si se agotó la espera y no hay ninguna versión publicada.
+    """
+    if not force and knowledge_base_exists():
+        return None
+
+    os.makedirs(BUILDS_DIR, exist_ok=True)
+    lock = BuildLock(BUILD_LOCK_FILE)
+    waited = False
+    if not lock.acquire(timeout=0):
+        print("[+] (KnowledgeAgent) Otro proceso está construyendo la base de conocimiento. Esperando...")
+        if not lock.acquire(timeout=wait_seconds):
+            if knowledge_base_exists():
+                return None
+            raise KnowledgeBaseUnavailableError(
+                "La base de conocimiento se está construyendo en otro proceso. Inténtalo más tarde."
+            )
+        waited = True
+
+    try:
+        # Comprobación repetida ya con el candado: si otro proceso acaba de publicar una
+        # versión mientras se esperaba, no se repite su trabajo.
+        if (waited or not force) and knowledge_base_exists():
+            return None
+        build_dir = os.path.join(BUILDS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        os.makedirs(build_dir)
+        try:
+            stats = _build_knowledge_base_into(build_dir)
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        publish_build(build_dir, CURRENT_KB_DIR)
+        cleanup_old_builds(BUILDS_DIR, CURRENT_KB_DIR)
+        print(f"[+] (KnowledgeAgent) Nueva versión de la base de conocimiento publicada en '{build_dir}'.")
+        return stats
+    finally:
+        lock.release()
+
+
+def _build_version(build_dir: str, index_metadata: Optional[dict]) -> str:
+    """Versión de una construcción: la de los metadatos del índice o, si no la tiene, la huella de su directorio."""
+    return (index_metadata or {}).get("kb_version") or hashlib.sha256(build_dir.encode()).hexdigest()[:16]
+
+
+class KnowledgeBaseState(NamedTuple):
+    """Versión publicada de la base de conocimiento: se reemplaza entera en cada recarga."""
+    index: faiss.Index
+    chunks: ChunkStore
+    signature: tuple
+    version: str
+    metadata: dict
+    hs_index: HSCodeIndex
+
+
+class KnowledgeBase:
     """
-    Crea y guarda una base de conocimiento vectorial a partir del PDF del arancel.
-    
-    Este proceso es intensivo y solo se ejecuta si no se encuentra un índice existente.
+    Base de conocimiento residente en el proceso.
+
+    Mantiene abiertos el índice FAISS y los fragmentos de texto (proyectados con mmap) y el
+    modelo de embedding cargado, para que cada búsqueda cueste solo la vectorización de la
+    consulta y la búsqueda en el índice. Es segura para compartir entre los hilos de las
+    tareas en segundo plano: el índice y los fragmentos se publican juntos en un único
+    KnowledgeBaseState inmutable, de modo que una recarga en caliente los reemplaza de forma atómica.
+
+    Los resultados se guardan en una caché de dos niveles (LRU en memoria + SQLite compartido)
+    indexada por la versión del índice, así que una reconstrucción la invalida automáticamente.
     """
-    print("[+] (KnowledgeAgent) Base de conocimiento no encontrada. Creando una nueva...")
+    def __init__(
+        self,
+        kb_dir: str = CURRENT_KB_DIR,
+        model_name: str = MODEL_NAME,
+        reload_check_interval: float = RELOAD_CHECK_INTERVAL_SECONDS,
+        encoder_backend: Optional[str] = None,
+    ):
+        self.kb_dir = kb_dir
+        self.model_name = model_name
+        self.encoder_backend = encoder_backend or settings.kb_encoder_backend
+        self.reload_check_interval = reload_check_interval
 
-    # 1. Validar que el PDF exista
-    if not os.path.exists(ARANCEL_PDF_FILE):
-        raise FileNotFoundError(
-            f"El archivo del arancel ('{os.path.basename(ARANCEL_PDF_FILE)}') no se encontró en el directorio principal. "
-            "Por favor, añádelo para poder crear la base de conocimiento."
+        self._lock = threading.Lock()
+        self._model = None
+        self._state: Optional[KnowledgeBaseState] = None
+        self._last_reload_check = 0.0
+        self.query_cache = TariffQueryCache(
+            max_size=settings.kb_query_cache_size,
+            ttl_seconds=settings.kb_query_cache_ttl_seconds,
+            persistent_path=QUERY_CACHE_FILE if settings.kb_query_cache_persistent else None,
+            persistent_max_rows=settings.kb_query_cache_persistent_max_rows,
         )
 
-    # 2. Leer texto del PDF
-    print(f"[+] (KnowledgeAgent) Leyendo texto de '{os.path.basename(ARANCEL_PDF_FILE)}'...")
-    reader = PdfReader(ARANCEL_PDF_FILE)
-    full_text = "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
+    def _files_signature(self) -> tuple:
+        """
+        Identifica la versión publicada: el directorio de construcción al que apunta `kb_dir`.
+        Cada construcción usa un directorio nuevo, así que basta con resolver el enlace.
+        """
+        return (os.path.realpath(self.kb_dir),)
+
+    def _read_state(self) -> KnowledgeBaseState:
+        """Lee el índice y los fragmentos desde disco y comprueba que sean coherentes entre sí."""
+        # El enlace se resuelve una sola vez: todos los archivos se leen de la misma versión
+        # aunque se publique otra mientras tanto.
+        signature = self._files_signature()
+        build_dir = signature[0]
+        index_file = os.path.join(build_dir, INDEX_FILENAME)
+        index_metadata = load_index_metadata(index_file)
+        # Los datos del índice se proyectan en memoria (mmap) cuando FAISS lo permite para su
+        # tipo, así los workers comparten las páginas de la caché del sistema operativo.
+        index = read_index_shared(index_file, index_metadata)
+        text_chunks = ChunkStore(os.path.join(build_dir, CHUNKS_FILENAME))
+        if index.ntotal != len(text_chunks):
+            raise RuntimeError(
+                f"El índice FAISS ({index.ntotal} vectores) y los fragmentos ({len(text_chunks)}) no coinciden."
+            )
+        if index_metadata and index_metadata.get("ntotal") != index.ntotal:
+            raise RuntimeError("Los metadatos del índice no corresponden al índice FAISS en disco.")
+        apply_search_params(index, index_metadata)
+        index_metadata = index_metadata or {}
+        version = _build_version(build_dir, index_metadata)
+        hs_index = HSCodeIndex.load(os.path.join(build_dir, HS_INDEX_FILENAME))
+        if hs_index.chunk_ids and max(hs_index.chunk_ids) >= len(text_chunks):
+            raise RuntimeError("El índice de códigos HS no corresponde a los fragmentos en disco.")
+        return KnowledgeBaseState(index, text_chunks, signature, version, index_metadata, hs_index)
+
+    def load(self, load_model: bool = True) -> None:
+        """
+        Carga el índice, los fragmentos y (si `load_model`) el modelo, si aún no están en memoria.
+
+        Si la base de conocimiento no existe en disco, se construye (o se espera a que otro
+        proceso termine de construirla, hasta `kb_build_wait_seconds`).
+
+        Raises:
+            KnowledgeBaseUnavailableError: Si otro proceso sigue construyendo la base al agotarse la espera.
+        """
+        with self._lock:
+            if load_model and self._model is None:
+                # Los backends importan sus dependencias al crearse: los procesos que delegan en el
+                # servicio de recuperación (o que solo hacen búsquedas por código HS) no cargan torch.
+                print(f"[+] (KnowledgeAgent) Cargando el modelo de embedding '{self.model_name}' (backend '{self.encoder_backend}')...")
+                self._model = create_encoder(self.encoder_backend, self.model_name, ENCODERS_DIR)
+
+            if self._state is None:
+                if not knowledge_base_exists():
+                    print("[+] (KnowledgeAgent) Base de conocimiento no encontrada. Creando una nueva...")
+                    build_knowledge_base(force=False, wait_seconds=settings.kb_build_wait_seconds)
+                print("[+] (KnowledgeAgent) Cargando la base de conocimiento existente...")
+                self._state = self._read_state()
+                self._last_reload_check = time.monotonic()
+
+    def reload_if_changed(self) -> bool:
+        """
+        Recarga el índice y los fragmentos si se publicó una nueva versión en `kb/current`.
+
+        La nueva versión se carga por completo antes de publicarse, así que las búsquedas
+        en curso siguen usando la versión anterior hasta que el reemplazo termina.
+
+        Returns:
+            True si se publicó una nueva versión, False en caso contrario.
+        """
+        with self._lock:
+            self._last_reload_check = time.monotonic()
+            try:
+                if self._state is not None and self._files_signature() == self._state.signature:
+                    return False
+                new_state = self._read_state()
+            except (OSError, RuntimeError) as e:
+                # La versión puede haberse borrado o estar incompleta; se reintenta en la próxima comprobación.
+                print(f"[-] (KnowledgeAgent) No se pudo recargar la base de conocimiento: {e}")
+                return False
+            self._state = new_state
+            print(f"[+] (KnowledgeAgent) Base de conocimiento recargada ({len(new_state.chunks)} fragmentos, versión {new_state.version}).")
+            return True
+
+    def _current_state(self) -> KnowledgeBaseState:
+        if self._state is None:
+            self.load(load_model=False)
+        elif time.monotonic() - self._last_reload_check >= self.reload_check_interval:
+            self.reload_if_changed()
+        return self._state
 
-    # 3. Dividir texto en fragmentos (chunks)
-    # Usamos párrafos como una forma simple de fragmentación.
-    text_chunks = [chunk.strip() for chunk in full_text.split('\n\n') if chunk.strip()]
-    print(f"[+] (KnowledgeAgent) El texto fue dividido en {len(text_chunks)} fragmentos.")
+    @property
+    def version(self) -> str:
+        """Versión de la base de conocimiento con la que busca este proceso (la carga si hace falta)."""
+        return self._current_state().version
 
-    # 4. Cargar modelo y generar embeddings
-    print(f"[+] (KnowledgeAgent) Cargando el modelo de embedding '{MODEL_NAME}'...")
-    model = SentenceTransformer(MODEL_NAME)
-    print("[+] (KnowledgeAgent) Generando embeddings para los fragmentos... (esto puede tardar)")
-    embeddings = model.encode(text_chunks, show_progress_bar=True)
+    def search_batch(self, product_descriptions: List[str], k: int = 5) -> List[List[Tuple[str, float]]]:
+        """
+        Busca los fragmentos más relevantes para varias descripciones de producto a la vez.
 
-    # 5. Crear y guardar el índice FAISS
-    print("[+] (KnowledgeAgent) Creando el índice FAISS...")
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
-    faiss.write_index(index, INDEX_FILE)
-    print(f"[+] (KnowledgeAgent) Índice FAISS guardado en '{INDEX_FILE}'")
+        Las descripciones que ya están en la caché de consultas se resuelven sin tocar el modelo;
+        el resto se vectoriza en una sola pasada y se resuelve con una única llamada a
+        `index.search` sobre la matriz N×d.
 
-    # 6. Guardar los fragmentos de texto
-    with open(CHUNKS_FILE, 'wb') as f:
-        pickle.dump(text_chunks, f)
-    print(f"[+] (KnowledgeAgent) Fragmentos de texto guardados en '{CHUNKS_FILE}'")
+        Args:
+            product_descriptions: Las descripciones de producto a buscar.
+            k: El número de resultados a devolver por descripción.
+
+        Returns:
+            Una lista (una entrada por descripción, en el mismo orden) de listas de tuplas
+            (fragmento, distancia L2) ordenadas de la más a la menos relevante.
+        """
+        if not product_descriptions:
+            return []
+
+        state = self._current_state()
+
+        results: List[Optional[List[Tuple[str, float]]]] = [
+            self.query_cache.get(description, k, state.version) for description in product_descriptions
+        ]
+        pending = [position for position, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        pending_descriptions = [product_descriptions[position] for position in pending]
+        if self._model is None:
+            self.load()
+        query_embeddings = self._model.encode(pending_descriptions)
+        distances, indices = state.index.search(query_embeddings, k)
+
+        for position, description, row_indices, row_distances in zip(pending, pending_descriptions, indices, distances):
+            # FAISS devuelve -1 cuando el índice tiene menos de k vectores.
+            result = [(state.chunks[i], float(d)) for i, d in zip(row_indices, row_distances) if i >= 0]
+            self.query_cache.put(description, k, state.version, result)
+            results[position] = result
+        return results
+
+    def search(self, product_description: str, k: int = 5) -> List[str]:
+        """
+        Busca los fragmentos del arancel más relevantes para una descripción de producto.
+
+        Args:
+            product_description: La descripción del producto a buscar.
+            k: El número de resultados a devolver.
+
+        Returns:
+            Una lista de cadenas de texto con los fragmentos más similares del arancel.
+        """
+        return [chunk for chunk, _ in self.search_batch([product_description], k=k)[0]]
+
+    def lookup_hs_code(self, hs_code: str, k: int = 5) -> Tuple[List[str], Optional[str]]:
+        """
+        Resuelve el contexto del arancel para un código HS por búsqueda exacta, sin embeddings.
+
+        Args:
+            hs_code: El código HS (con o sin puntos).
+            k: El número máximo de fragmentos a devolver.
+
+        Returns:
+            Una tupla (fragmentos, prefijo encontrado). El prefijo es el código completo si
+            existe tal cual en el arancel, o la partida/subpartida más específica que sí existe.
+        """
+        state = self._current_state()
+        chunk_ids, matched_prefix = state.hs_index.lookup(hs_code, k=k)
+        return state.chunks.get_many(chunk_ids), matched_prefix
+
+
+_knowledge_base: Optional[KnowledgeBase] = None
+_knowledge_base_lock = threading.Lock()
+
+
+def get_knowledge_base() -> KnowledgeBase:
+    """
+    Devuelve la instancia de KnowledgeBase compartida por todo el proceso, creándola si es necesario.
+    """
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _knowledge_base_lock:
+            if _knowledge_base is None:
+                _knowledge_base = KnowledgeBase()
+    return _knowledge_base
+
+
+_retrieval_client: Optional[RetrievalClient] = None
+
+
+def _get_retrieval_client() -> Optional[RetrievalClient]:
+    """
+    Devuelve el cliente del servicio de recuperación compartido si está configurado
+    (`kb_retrieval_socket`) y su socket existe; si no, None (modo en proceso).
+    """
+    global _retrieval_client
+    socket_path = settings.kb_retrieval_socket
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    if _retrieval_client is None or _retrieval_client.socket_path != socket_path:
+        _retrieval_client = RetrievalClient(socket_path)
+    return _retrieval_client
+
+
+def _search_batch(product_descriptions: List[str], k: int) -> List[List[Tuple[str, float]]]:
+    """
+    Resuelve una búsqueda por lotes en el servicio de recuperación compartido si está
+    disponible, o en el proceso actual en caso contrario.
+    """
+    client = _get_retrieval_client()
+    if client is not None:
+        try:
+            return client.search_batch(product_descriptions, k=k)
+        except (OSError, RuntimeError) as e:
+            print(f"[-] (KnowledgeAgent) Servicio de recuperación no disponible ({e}). Usando el modelo en proceso.")
+    return get_knowledge_base().search_batch(product_descriptions, k=k)
+
+
+def warm_up_knowledge_base() -> None:
+    """
+    Carga por adelantado el índice, los fragmentos y el modelo, p. ej. al arrancar la API,
+    para que la primera clasificación no pague el coste de inicialización.
+
+    Si hay un servicio de recuperación compartido, el modelo no se carga en este proceso.
+    """
+    get_knowledge_base().load(load_model=_get_retrieval_client() is None)
+    print("[+] (KnowledgeAgent) Base de conocimiento lista en memoria.")
 
 
 def search_tariff_schedule(product_description: str, k: int = 5) -> List[str]:
@@ -76,27 +562,65 @@ def search_tariff_schedule(product_description: str, k: int = 5) -> List[str]:
     Returns:
         Una lista de cadenas de texto con los fragmentos más similares del arancel.
     """
-    # 1. Verificar si la base de conocimiento existe, si no, crearla.
-    if not os.path.exists(INDEX_FILE) or not os.path.exists(CHUNKS_FILE):
-        _create_knowledge_base()
+    print(f"[+] (KnowledgeAgent) Buscando en el arancel para: '{product_description}'...")
+    results = [chunk for chunk, _ in _search_batch([product_description], k=k)[0]]
+    print("[+] (KnowledgeAgent) Búsqueda completada con éxito.")
 
-    # 2. Cargar los datos y el modelo
-    print("[+] (KnowledgeAgent) Cargando la base de conocimiento existente...")
-    index = faiss.read_index(INDEX_FILE)
-    with open(CHUNKS_FILE, 'rb') as f:
-        text_chunks = pickle.load(f)
-    
-    model = SentenceTransformer(MODEL_NAME)
+    return results
 
-    # 3. Vectorizar la consulta del usuario
-    print(f"[+] (KnowledgeAgent) Buscando en el arancel para: '{product_description}'...")
-    query_embedding = model.encode([product_description])
 
-    # 4. Realizar la búsqueda en el índice FAISS
-    distances, indices = index.search(query_embedding, k)
+def search_tariff_schedule_batch(product_descriptions: List[str], k: int = 5) -> List[List[Tuple[str, float]]]:
+    """
+    Busca en el arancel los fragmentos más relevantes para muchas descripciones de producto
+    en una sola llamada (p. ej. todos los ítems de una factura).
 
-    # 5. Devolver los fragmentos de texto correspondientes
-    results = [text_chunks[i] for i in indices[0]]
-    print("[+] (KnowledgeAgent) Búsqueda completada con éxito.")
-    
-    return results
\ No newline at end of file
+    Args:
+        product_descriptions: Las descripciones de producto a buscar.
+        k: El número de resultados a devolver por descripción.
+
+    Returns:
+        Una lista, alineada con `product_descriptions`, de listas de tuplas (fragmento, distancia)
+        ordenadas por relevancia.
+    """
+    print(f"[+] (KnowledgeAgent) Buscando en el arancel para {len(product_descriptions)} descripciones...")
+    results = _search_batch(product_descriptions, k=k) if product_descriptions else []
+    print("[+] (KnowledgeAgent) Búsqueda por lotes completada con éxito.")
+
+    return results
+
+
+def lookup_tariff_by_hs_code(hs_code: str, k: int = 5) -> Tuple[List[str], Optional[str]]:
+    """
+    Busca en el arancel los fragmentos de un código HS ya conocido (declarado en la factura o
+    presente en la descripción), sin vectorizar la consulta.
+
+    Args:
+        hs_code: El código HS a buscar.
+        k: El número máximo de fragmentos a devolver.
+
+    Returns:
+        Una tupla (fragmentos, prefijo del código que se encontró en el arancel o None).
+    """
+    print(f"[+] (KnowledgeAgent) Buscando en el arancel el código HS '{hs_code}'...")
+    return get_knowledge_base().lookup_hs_code(hs_code, k=k)
+
+
+def get_query_cache_stats() -> dict:
+    """
+    Devuelve los contadores de la caché de consultas (aciertos, fallos, desalojos) del proceso.
+    """
+    return get_knowledge_base().query_cache.stats()
+
+
+def get_knowledge_base_version() -> str:
+    """
+    Devuelve la versión publicada de la base de conocimiento (cambia con cada reconstrucción),
+    leída de los metadatos de `kb/current` sin cargar el índice ni el modelo.
+
+    Raises:
+        KnowledgeBaseUnavailableError: Si todavía no se publicó ninguna versión.
+    """
+    if not knowledge_base_exists():
+        raise KnowledgeBaseUnavailableError("La base de conocimiento todavía no se ha construido.")
+    build_dir = os.path.realpath(CURRENT_KB_DIR)
+    return _build_version(build_dir, load_index_metadata(os.path.join(build_dir, INDEX_FILENAME)))
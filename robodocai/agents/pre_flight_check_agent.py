@@ -4,14 +4,21 @@ validaciones de negocio sobre los datos antes de que comience el procesamiento p
 """
 from db import models
 
-def run_pre_flight_checks(structured_data: dict, classification_data: dict, document_type: models.DocumentType) -> dict:
+def run_pre_flight_checks(
+    structured_data: dict,
+    document_type: models.DocumentType,
+    classification_data: dict | None = None
+) -> dict:
     """
-    Ejecuta una serie de validaciones de negocio sobre los datos extraídos y clasificados.
+    Ejecuta una serie de validaciones de negocio sobre los datos extraídos.
+
+    Las reglas solo usan los datos extraídos, así que el orquestador las ejecuta antes de la
+    clasificación arancelaria (mucho más cara) para no pagarla en facturas que irán a revisión.
 
     Args:
         structured_data: El diccionario de datos extraído de la factura.
-        classification_data: El diccionario con la clasificación arancelaria propuesta.
         document_type: El tipo de documento que se está procesando.
+        classification_data: No se usa; se mantiene por compatibilidad con llamadas anteriores.
 
     Returns:
         Un diccionario con los resultados de las comprobaciones.
@@ -34,6 +34,13 @@ def review_final_output(structured_data: dict, classification_data: dict) -> dic
         )
         verdict["reasoning"] = "Se detectaron problemas de confianza en la clasificación."
         verdict["confidence_score"] = classification_confidence # Se podría ajustar la confianza general
+        # Con clasificación por ítem, se señalan los ítems concretos que requieren revisión.
+        for item in classification_data.get("items", []):
+            item_confidence = item.get("confidence_score") or 0.0
+            if item_confidence < 0.95:
+                verdict["warnings"].append(
+                    f"Ítem {item.get('line_index')} ('{item.get('item_description')}'): confianza {item_confidence:.2f}. {item.get('reasoning') or ''}".strip()
+                )
 
     if verdict["validation_status"] == "approved":
         print("[+] (Agent: Supervisor) Final review completed successfully. All checks passed.")
@@ -0,0 +1,422 @@
+"""
+Extracción determinista de facturas por plantillas de diseño (layout) de cada vendedor.
+
+Muchas facturas provienen de vendedores recurrentes con un diseño fijo. Para ellas:
+
+    1. La huella del diseño es el conjunto de palabras de la primera página con su posición
+       aproximada (rejilla de `GRID` puntos), obtenidas con PyMuPDF. La de una plantilla solo
+       incluye las palabras anteriores a la tabla de ítems, que no cambian entre facturas.
+    2. Las plantillas aprendidas se buscan en un índice invertido (término -> plantillas) y se
+       elige la que tenga mayor fracción de su huella presente en el documento, si supera
+       `template_min_similarity`.
+    3. Cada plantilla guarda, por campo, la etiqueta que precede al valor en su línea y la caja
+       donde apareció, y para la tabla de ítems la fila de encabezado, la fila de cierre y la
+       posición de las columnas numéricas.
+
+Las plantillas se aprenden de extracciones ya validadas: solo se guardan si, aplicadas al
+mismo documento, reproducen exactamente los datos validados.
+"""
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import fitz  # PyMuPDF
+from sqlalchemy.orm import Session
+
+from db import repository
+
+# Tamaño de la rejilla (en puntos) con la que se cuantizan las posiciones de la huella.
+GRID = 20
+# Páginas que se leen para aplicar una plantilla (la tabla de ítems puede continuar).
+MAX_TEMPLATE_PAGES = 20
+
+HEADER_FIELDS = (
+    "invoice_id", "issue_date", "seller_name", "seller_address", "seller_tax_id", "buyer_name",
+    "buyer_address", "buyer_tax_id", "incoterm", "currency", "subtotal_amount", "total_amount",
+    "country_of_origin",
+)
+NUMERIC_FIELDS = {"subtotal_amount", "total_amount"}
+NUMERIC_COLUMNS = ("quantity", "unit_price", "total_price")
+# Tolerancia horizontal (en puntos) para asignar un número a una columna aprendida.
+COLUMN_TOLERANCE = 30.0
+
+
+class Word(NamedTuple):
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    text: str
+
+
+class Line(NamedTuple):
+    page: int
+    words: List[Word]
+
+    @property
+    def text(self) -> str:
+        return " ".join(word.text for word in self.words)
+
+
+def read_layout(file_path: str, max_pages: int = MAX_TEMPLATE_PAGES) -> List[Line]:
+    """Lee las palabras con su posición y las agrupa en líneas, en orden de lectura."""
+    lines = []
+    with fitz.open(file_path) as doc:
+        for page_number, page in enumerate(doc):
+            if page_number >= max_pages:
+                break
+            grouped: Dict[tuple, List[Word]] = defaultdict(list)
+            for x0, y0, x1, y1, text, block_no, line_no, _ in page.get_text("words"):
+                grouped[(block_no, line_no)].append(Word(x0, y0, x1, y1, text))
+            page_lines = [sorted(words, key=lambda word: word.x0) for words in grouped.values()]
+            page_lines.sort(key=lambda words: (round(words[0].y0), words[0].x0))
+            lines.extend(Line(page_number, words) for words in page_lines)
+    return lines
+
+
+def layout_tokens(lines: List[Line]) -> set:
+    """Huella del diseño: palabras (solo letras) de la primera página con su celda de la rejilla."""
+    return {
+        f"{word.text.lower()}@{int(word.x0 // GRID)},{int(word.y0 // GRID)}"
+        for line in lines if line.page == 0
+        for word in line.words if len(word.text) >= 3 and word.text.isalpha()
+    }
+
+
+def _header_lines(lines: List[Line], table: dict) -> List[Line]:
+    """Las líneas anteriores al encabezado de la tabla de ítems (incluido)."""
+    for position, line in enumerate(lines):
+        if _normalize(line.text) == table["header"]:
+            return lines[:position + 1]
+    return lines
+
+
+def parse_number(text: str) -> Optional[float]:
+    """Convierte importes como "5,825.00", "5.825,00", "$2.50" o "1500" a float."""
+    cleaned = re.sub(r"[^\d.,\-]", "", text)
+    if not re.search(r"\d", cleaned):
+        return None
+    if "," in cleaned and "." in cleaned:
+        # El último separador es el decimal.
+        if cleaned.rfind(",") > cleaned.rfind("."):
+            cleaned = cleaned.replace(".", "").replace(",", ".")
+        else:
+            cleaned = cleaned.replace(",", "")
+    elif "," in cleaned:
+        integer, _, decimals = cleaned.rpartition(",")
+        cleaned = f"{integer.replace(',', '')}.{decimals}" if len(decimals) != 3 else cleaned.replace(",", "")
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().strip(":").strip().lower()
+
+
+def _same_number(a, b) -> bool:
+    return a is not None and b is not None and abs(float(a) - float(b)) < 0.005
+
+
+def _locate_value(lines: List[Line], value, numeric: bool) -> Optional[Tuple[Line, int, int]]:
+    """Busca el valor de un campo: (línea, índice de la primera palabra, índice tras la última)."""
+    if numeric:
+        for line in lines:
+            for i, word in enumerate(line.words):
+                if _same_number(parse_number(word.text), value):
+                    return line, i, i + 1
+        return None
+    target = [_normalize(token) for token in str(value).split()]
+    if not target:
+        return None
+    for line in lines:
+        words = [_normalize(word.text) for word in line.words]
+        for i in range(len(words) - len(target) + 1):
+            if words[i:i + len(target)] == target:
+                return line, i, i + len(target)
+    return None
+
+
+def _learn_field(lines: List[Line], value, numeric: bool) -> Optional[dict]:
+    located = _locate_value(lines, value, numeric)
+    if located is None:
+        return None
+    line, start, end = located
+    anchor = _normalize(" ".join(word.text for word in line.words[max(0, start - 3):start]))
+    value_words = line.words[start:end]
+    return {
+        "anchor": anchor if re.search(r"[a-z]", anchor) else None,
+        "page": line.page,
+        "bbox": [value_words[0].x0, value_words[0].y0, value_words[-1].x1, value_words[-1].y1],
+        "words": end - start,
+    }
+
+
+def _apply_field(lines: List[Line], rule: dict, numeric: bool):
+    x0, y0, x1, y1 = rule["bbox"]
+    if rule["anchor"]:
+        anchor_tokens = rule["anchor"].split()
+        for line in lines:
+            words = [_normalize(word.text) for word in line.words]
+            for i in range(len(words) - len(anchor_tokens) + 1):
+                if words[i:i + len(anchor_tokens)] == anchor_tokens:
+                    # Valor: las palabras que siguen a la etiqueta, hasta donde terminaba el valor aprendido.
+                    limit = x1 + max(40.0, (x1 - x0) * 0.5)
+                    value_words = [word for word in line.words[i + len(anchor_tokens):] if word.x0 <= limit]
+                    if numeric:
+                        value_words = value_words[:1]
+                    text = " ".join(word.text for word in value_words)
+                    return parse_number(text) if numeric else (text or None)
+    else:
+        value_words = [
+            word for line in lines if line.page == rule["page"] for word in line.words
+            if y0 - 3 <= (word.y0 + word.y1) / 2 <= y1 + 3 and x0 - 5 <= word.x0 <= x1 + 40
+        ]
+        if value_words:
+            if numeric:
+                return parse_number(value_words[0].text)
+            return " ".join(word.text for word in value_words)
+    return None
+
+
+def _learn_table(lines: List[Line], line_items: List[dict]) -> Optional[dict]:
+    """Aprende la tabla de ítems: encabezado, fila de cierre y posición de las columnas."""
+    rows = []
+    columns: Dict[str, List[float]] = defaultdict(list)
+    description_x = []
+    for item in line_items:
+        located = _locate_value(lines, item.get("item_description") or "", numeric=False)
+        if located is None:
+            return None
+        line, start, end = located
+        rows.append(lines.index(line))
+        description_x.append(line.words[start].x0)
+        for column in NUMERIC_COLUMNS:
+            for word in line.words[end:]:
+                if _same_number(parse_number(word.text), item.get(column)):
+                    columns[column].append((word.x0 + word.x1) / 2)
+                    break
+    if not rows or rows != sorted(rows) or rows[0] == 0 or not {"quantity", "unit_price"} <= set(columns):
+        return None
+    stop_line = lines[rows[-1] + 1] if rows[-1] + 1 < len(lines) else None
+    return {
+        "header": _normalize(lines[rows[0] - 1].text),
+        "stop": _normalize(stop_line.text).split()[0] if stop_line and stop_line.words else None,
+        "description_x": min(description_x),
+        "columns": {column: sum(centers) / len(centers) for column, centers in columns.items()},
+    }
+
+
+def _apply_table(lines: List[Line], table: dict) -> List[dict]:
+    items: List[dict] = []
+    in_table = False
+    first_column_x = min(table["columns"].values())
+    for line in lines:
+        text = _normalize(line.text)
+        if not in_table:
+            in_table = text == table["header"]
+            continue
+        if text == table["header"]:
+            # El encabezado se repite al comienzo de cada página de la tabla.
+            continue
+        if table["stop"] and text.split()[:1] == [table["stop"]]:
+            break
+        row = {"item_description": None, "quantity": None, "unit_price": None, "total_price": None}
+        description_words = []
+        for word in line.words:
+            center = (word.x0 + word.x1) / 2
+            number = parse_number(word.text)
+            column = min(table["columns"], key=lambda name: abs(table["columns"][name] - center))
+            if number is not None and abs(table["columns"][column] - center) <= COLUMN_TOLERANCE:
+                row[column] = number
+            elif word.x0 >= table["description_x"] - 5 and word.x1 < first_column_x - COLUMN_TOLERANCE:
+                description_words.append(word.text)
+        if row["quantity"] is None and row["unit_price"] is None:
+            # Línea de continuación de la descripción del ítem anterior.
+            if items and description_words:
+                previous = items[-1]["item_description"]
+                continuation = " ".join(description_words)
+                items[-1]["item_description"] = f"{previous} {continuation}" if previous else continuation
+            continue
+        row["item_description"] = " ".join(description_words) or None
+        items.append(row)
+    return items
+
+
+def learn_rules(lines: List[Line], data: dict) -> Optional[dict]:
+    """
+    Aprende las reglas de extracción de un documento a partir de sus datos validados.
+
+    Returns:
+        Las reglas, o None si no se pudo localizar lo imprescindible (número de factura, total
+        e ítems de línea).
+    """
+    fields = {}
+    for field in HEADER_FIELDS:
+        if data.get(field) in (None, ""):
+            continue
+        rule = _learn_field(lines, data[field], numeric=field in NUMERIC_FIELDS)
+        if rule:
+            fields[field] = rule
+    table = _learn_table(lines, data.get("line_items") or [])
+    if table is None or "invoice_id" not in fields or "total_amount" not in fields:
+        return None
+    return {"fields": fields, "table": table}
+
+
+def apply_rules(lines: List[Line], rules: dict) -> dict:
+    """Extrae los datos de un documento con las reglas de una plantilla."""
+    data = {
+        field: _apply_field(lines, rule, numeric=field in NUMERIC_FIELDS)
+        for field, rule in rules["fields"].items()
+    }
+    data["line_items"] = _apply_table(lines, rules["table"])
+    return data
+
+
+def _matches(extracted: dict, expected: dict) -> bool:
+    """Comprueba que una extracción por plantilla reproduce los datos validados."""
+    for field in extracted:
+        if field == "line_items":
+            continue
+        a, b = extracted[field], expected.get(field)
+        if field in NUMERIC_FIELDS:
+            if not _same_number(a, b):
+                return False
+        elif _normalize(str(a or "")) != _normalize(str(b or "")):
+            return False
+    expected_items = expected.get("line_items") or []
+    if len(extracted["line_items"]) != len(expected_items):
+        return False
+    for got, want in zip(extracted["line_items"], expected_items):
+        if _normalize(got["item_description"] or "") != _normalize(want.get("item_description") or ""):
+            return False
+        if not all(_same_number(got[column], want.get(column)) for column in ("quantity", "unit_price")):
+            return False
+    return True
+
+
+def is_complete(data: dict) -> bool:
+    """
+    Una extracción por plantilla solo se acepta si tiene número de factura, total e ítems, y
+    los ítems suman el subtotal (o el total, si la plantilla no extrae el subtotal: impuestos,
+    fletes o descuentos quedan entre ambos); si no, se recurre al LLM.
+    """
+    items = data.get("line_items") or []
+    if not data.get("invoice_id") or data.get("total_amount") is None or not items:
+        return False
+    if any(item["quantity"] is None or item["unit_price"] is None or not item["item_description"] for item in items):
+        return False
+    expected_sum = data["subtotal_amount"] if data.get("subtotal_amount") is not None else data["total_amount"]
+    return abs(sum(item["quantity"] * item["unit_price"] for item in items) - expected_sum) <= 0.01
+
+
+class TemplateIndex:
+    """
+    Índice invertido en memoria de las plantillas: término de la huella -> ids de plantilla.
+    Se carga de la base de datos de forma incremental (solo las plantillas nuevas o actualizadas).
+    """
+    def __init__(self):
+        self._templates: Dict[int, Tuple[set, dict]] = {}
+        self._postings: Dict[str, set] = defaultdict(set)
+        # `_lock` protege el índice (añadir y buscar); `_refresh_lock` serializa las recargas
+        # desde la base de datos y `_loaded_until`, sin bloquear las búsquedas durante la consulta.
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded_until = None
+
+    def add(self, template_id: int, tokens: set, rules: dict) -> None:
+        with self._lock:
+            previous = self._templates.get(template_id)
+            if previous:
+                for token in previous[0]:
+                    self._postings[token].discard(template_id)
+            self._templates[template_id] = (tokens, rules)
+            for token in tokens:
+                self._postings[token].add(template_id)
+
+    def refresh(self, db: Session) -> None:
+        with self._refresh_lock:
+            for template in repository.list_invoice_templates(db, updated_after=self._loaded_until):
+                self.add(template.id, set(template.layout_tokens), template.rules)
+                if self._loaded_until is None or template.updated_at > self._loaded_until:
+                    self._loaded_until = template.updated_at
+
+    def best_match(self, tokens: set, min_similarity: float) -> Optional[Tuple[int, dict, float]]:
+        """
+        Devuelve (id, reglas, similitud) de la plantilla más parecida, o None. La similitud es la
+        fracción de la huella de la plantilla presente en la del documento.
+        """
+        with self._lock:
+            shared = Counter(template_id for token in tokens for template_id in self._postings.get(token, ()))
+            best = None
+            for template_id, count in shared.most_common(5):
+                template_tokens, rules = self._templates[template_id]
+                similarity = count / len(template_tokens)
+                if similarity >= min_similarity and (best is None or similarity > best[2]):
+                    best = (template_id, rules, similarity)
+            return best
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._templates)
+
+
+_index = TemplateIndex()
+
+
+def extract_with_template(db: Session, file_path: str, min_similarity: float) -> Optional[dict]:
+    """
+    Extrae una factura con la plantilla de su vendedor, si hay una que coincida con su diseño.
+
+    Returns:
+        Los datos extraídos (sin validar contra el esquema) o None si no hay plantilla o la
+        extracción no es completa.
+    """
+    _index.refresh(db)
+    if not len(_index):
+        return None
+    lines = read_layout(file_path)
+    match = _index.best_match(layout_tokens(lines), min_similarity)
+    if match is None:
+        return None
+    template_id, rules, similarity = match
+    data = apply_rules(lines, rules)
+    if not is_complete(data):
+        print(f"[-] (Agent: TemplateExtractor) La plantilla {template_id} coincide ({similarity:.2f}) pero la extracción es incompleta.")
+        return None
+    print(f"[+] (Agent: TemplateExtractor) Factura extraída con la plantilla {template_id} (similitud {similarity:.2f}).")
+    return data
+
+
+def learn_template(db: Session, file_path: str, validated_data: dict, min_similarity: float) -> Optional[int]:
+    """
+    Aprende (o actualiza) la plantilla del diseño de un documento a partir de sus datos validados.
+
+    Returns:
+        El id de la plantilla guardada, o None si no se pudieron aprender reglas fiables.
+    """
+    lines = read_layout(file_path)
+    rules = learn_rules(lines, validated_data)
+    if rules is None:
+        return None
+    extracted = apply_rules(lines, rules)
+    if not _matches(extracted, validated_data) or not is_complete(extracted):
+        return None
+    tokens = layout_tokens(_header_lines(lines, rules["table"]))
+    if not tokens:
+        return None
+    _index.refresh(db)
+    match = _index.best_match(layout_tokens(lines), min_similarity)
+    template = repository.save_invoice_template(
+        db,
+        template_id=match[0] if match else None,
+        seller_name=validated_data.get("seller_name"),
+        layout_tokens=sorted(tokens),
+        rules=rules,
+    )
+    _index.add(template.id, tokens, rules)
+    print(f"[+] (Agent: TemplateExtractor) Plantilla {template.id} aprendida para '{validated_data.get('seller_name')}'.")
+    return template.id
@@ -0,0 +1,89 @@
+"""
+Benchmark de índices aproximados para la base de conocimiento del arancel.
+
+Construye cada tipo de índice sobre un corpus sintético (mezcla de gaussianas normalizadas,
+de la misma dimensión que all-MiniLM-L6-v2) y reporta recall@k frente al índice flat,
+latencia p50/p99 por consulta y tiempo de construcción.
+
+Uso (desde el directorio `robodocai/`):
+    python -m benchmarks.bench_ann_index --vectors 100000 --queries 1000 --k 5
+"""
+import argparse
+import time
+import faiss
+import numpy as np
+
+from knowledge.index_factory import build_index
+
+CONFIGURATIONS = [
+    ("flat", {}),
+    ("ivf_flat", {"nlist": 1024, "nprobe": 8}),
+    ("ivf_flat", {"nlist": 1024, "nprobe": 32}),
+    ("ivf_pq", {"nlist": 1024, "nprobe": 16, "pq_m": 48, "pq_nbits": 8}),
+    ("ivf_pq", {"nlist": 1024, "nprobe": 64, "pq_m": 48, "pq_nbits": 8}),
+    ("hnsw", {"hnsw_m": 32, "ef_construction": 200, "ef_search": 32}),
+    ("hnsw", {"hnsw_m": 32, "ef_construction": 200, "ef_search": 128}),
+]
+
+
+def synthetic_corpus(num_vectors: int, num_queries: int, dim: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Genera vectores agrupados en clústeres, parecidos a embeddings de texto normalizados."""
+    rng = np.random.default_rng(seed)
+    num_clusters = max(1, num_vectors // 200)
+    centers = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+
+    def sample(n):
+        vectors = centers[rng.integers(0, num_clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    return sample(num_vectors), sample(num_queries)
+
+
+def recall_at_k(ground_truth: np.ndarray, retrieved: np.ndarray) -> float:
+    """Fracción de los k vecinos exactos que aparecen entre los k recuperados."""
+    k = ground_truth.shape[1]
+    hits = sum(len(set(gt) & set(rt)) for gt, rt in zip(ground_truth, retrieved))
+    return hits / (len(ground_truth) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100_000, help="Tamaño del corpus sintético.")
+    parser.add_argument("--queries", type=int, default=1_000, help="Número de consultas.")
+    parser.add_argument("--dim", type=int, default=384, help="Dimensión de los embeddings.")
+    parser.add_argument("--k", type=int, default=5, help="Vecinos por consulta.")
+    args = parser.parse_args()
+
+    corpus, queries = synthetic_corpus(args.vectors, args.queries, args.dim)
+    faiss.omp_set_num_threads(1)  # Latencia por consulta, como en el servicio.
+
+    ground_truth = None
+    print(f"Corpus: {args.vectors} vectores de dimensión {args.dim}, {args.queries} consultas, k={args.k}")
+    print(f"{'índice':<10} {'parámetros':<48} {'build (s)':>9} {'recall@k':>9} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    for index_type, params in CONFIGURATIONS:
+        start = time.perf_counter()
+        index, metadata = build_index(corpus, index_type, **params)
+        build_seconds = time.perf_counter() - start
+
+        latencies = np.empty(args.queries)
+        retrieved = np.empty((args.queries, args.k), dtype=np.int64)
+        for i in range(args.queries):
+            start = time.perf_counter()
+            _, indices = index.search(queries[i:i + 1], args.k)
+            latencies[i] = (time.perf_counter() - start) * 1000
+            retrieved[i] = indices[0]
+
+        if ground_truth is None:
+            # La primera configuración es flat: sirve de referencia exacta.
+            ground_truth = retrieved.copy()
+
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(
+            f"{index_type:<10} {str(metadata['params']):<48} {build_seconds:>9.2f} "
+            f"{recall_at_k(ground_truth, retrieved):>9.3f} {p50:>9.3f} {p99:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
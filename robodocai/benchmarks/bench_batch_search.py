@@ -0,0 +1,64 @@
+"""
+Benchmark de throughput: búsqueda en el arancel una descripción a la vez frente a la
+búsqueda por lotes (`search_tariff_schedule_batch`).
+
+Uso (desde el directorio `robodocai/`):
+    python -m benchmarks.bench_batch_search --queries 64 --k 5
+"""
+import argparse
+import random
+import time
+
+from agents.knowledge_agent import get_knowledge_base
+
+PRODUCT_TERMS = [
+    "Microcontrolador", "Sensor de humedad", "Café tostado", "Tornillos de acero",
+    "Camisetas de algodón", "Baterías de litio", "Aceite de palma", "Neumáticos",
+    "Tubos de PVC", "Flores frescas", "Teléfonos móviles", "Calzado deportivo",
+]
+PRODUCT_QUALIFIERS = [
+    "para uso industrial", "en empaque de 500 g", "de 12 V", "sin ensamblar",
+    "de origen vegetal", "con certificado de origen", "a granel", "para vehículos",
+]
+
+
+def _synthetic_descriptions(n: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [f"{rng.choice(PRODUCT_TERMS)} {rng.choice(PRODUCT_QUALIFIERS)}" for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=64, help="Número de descripciones por ronda.")
+    parser.add_argument("--k", type=int, default=5, help="Resultados por descripción.")
+    parser.add_argument("--rounds", type=int, default=3, help="Rondas a promediar.")
+    args = parser.parse_args()
+
+    kb = get_knowledge_base()
+    kb.load()
+    descriptions = _synthetic_descriptions(args.queries)
+
+    # Calentamiento para no medir la primera inicialización de torch/FAISS.
+    kb.search_batch(descriptions[:4], k=args.k)
+
+    single_times, batch_times = [], []
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        for description in descriptions:
+            kb.search(description, k=args.k)
+        single_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        kb.search_batch(descriptions, k=args.k)
+        batch_times.append(time.perf_counter() - start)
+
+    single = min(single_times)
+    batch = min(batch_times)
+    print(f"Consultas por ronda: {args.queries} (k={args.k}, mejor de {args.rounds} rondas)")
+    print(f"  Una a una : {single:8.3f} s  ->  {args.queries / single:8.1f} consultas/s")
+    print(f"  Por lotes : {batch:8.3f} s  ->  {args.queries / batch:8.1f} consultas/s")
+    print(f"  Aceleración: x{single / batch:.1f}")
+
+
+if __name__ == "__main__":
+    main()
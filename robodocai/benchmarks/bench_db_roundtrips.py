@@ -0,0 +1,117 @@
+"""
+Viajes a la base de datos por documento: escritura campo a campo frente a unidad de trabajo.
+
+Reproduce las escrituras de un procesamiento exitoso sobre una base SQLite temporal:
+
+    - "por campo": las funciones `update_*` del repositorio, como hacía el orquestador
+      (cada una consulta el documento, hace commit y refresh);
+    - "unidad de trabajo": `DocumentUnitOfWork`, como el orquestador actual (carga una vez y
+      un commit por frontera de etapa).
+
+También compara actualizar el estado de todos los documentos uno a uno frente a
+`update_documents_status`. Cuenta sentencias SQL y commits con los eventos del engine.
+
+Uso (desde el directorio `robodocai/`):
+    python -m benchmarks.bench_db_roundtrips --documents 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from db import models, repository
+
+STRUCTURED_DATA = {"invoice_id": "BENCH-1", "total_amount": 100.0, "line_items": [{"item_description": "x", "quantity": 1.0, "unit_price": 100.0}]}
+CLASSIFICATION = {"items": [{"line_index": 0, "hs_code": "8542.31"}], "confidence_score": 0.97}
+PRE_FLIGHT = {"checks_passed": True, "results": []}
+VERDICT = {"validation_status": "approved", "warnings": []}
+
+
+def per_field(db, document_id):
+    repository.update_document_status(db, document_id, "processing")
+    repository.get_document_by_id(db, document_id)
+    repository.update_document_content(db, document_id, "texto crudo")
+    repository.update_document_structured_data(db, document_id, STRUCTURED_DATA)
+    repository.update_document_classification_data(db, document_id, CLASSIFICATION)
+    repository.update_pre_flight_check_results(db, document_id, PRE_FLIGHT)
+    repository.update_supervisor_verdict(db, document_id, VERDICT)
+    repository.update_document_status(db, document_id, "completed")
+
+
+def unit_of_work(db, document_id):
+    uow = repository.DocumentUnitOfWork(db, document_id)
+    uow.set_status("processing")
+    uow.flush()
+    uow.set_content("texto crudo")
+    uow.set_structured_data(STRUCTURED_DATA)
+    uow.flush()
+    uow.set_classification_data(CLASSIFICATION)
+    uow.flush()
+    uow.set_pre_flight_check_results(PRE_FLIGHT)
+    uow.set_supervisor_verdict(VERDICT)
+    uow.set_status("completed")
+    uow.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=200, help="Documentos procesados por escenario.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", connect_args={"check_same_thread": False})
+        models.Base.metadata.create_all(bind=engine)
+        counters = {"statements": 0, "commits": 0}
+        event.listen(engine, "before_cursor_execute", lambda *_: counters.__setitem__("statements", counters["statements"] + 1))
+        event.listen(engine, "commit", lambda *_: counters.__setitem__("commits", counters["commits"] + 1))
+
+        def create_documents(count):
+            db = sessionmaker(bind=engine)()
+            shipment = repository.create_shipment(db, user_id="bench", name="bench")
+            ids = [
+                repository.create_document(db, shipment.id, f"doc-{i}.pdf", models.DocumentType.FACTURA_COMERCIAL).id
+                for i in range(count)
+            ]
+            db.close()
+            return ids
+
+        def run(name, session_factory, write):
+            ids = create_documents(args.documents)
+            counters.update(statements=0, commits=0)
+            start = time.perf_counter()
+            for document_id in ids:
+                db = session_factory()
+                try:
+                    write(db, document_id)
+                finally:
+                    db.close()
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:<20} {counters['statements'] / len(ids):6.1f} sentencias/doc  "
+                f"{counters['commits'] / len(ids):5.1f} commits/doc  {elapsed / len(ids) * 1000:6.2f} ms/doc"
+            )
+            return ids
+
+        print(f"Documentos: {args.documents}\n")
+        run("Por campo", sessionmaker(bind=engine), per_field)
+        ids = run("Unidad de trabajo", sessionmaker(bind=engine, expire_on_commit=False), unit_of_work)
+
+        for name, write in (
+            ("Estado uno a uno", lambda db: [repository.update_document_status(db, document_id, "archived") for document_id in ids]),
+            ("Estado en bloque", lambda db: repository.update_documents_status(db, ids, "archived")),
+        ):
+            db = sessionmaker(bind=engine)()
+            counters.update(statements=0, commits=0)
+            start = time.perf_counter()
+            write(db)
+            elapsed = time.perf_counter() - start
+            db.close()
+            print(f"{name:<20} {counters['statements']:6d} sentencias      {counters['commits']:5d} commits      {elapsed * 1000:8.1f} ms")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
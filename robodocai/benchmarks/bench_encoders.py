@@ -0,0 +1,99 @@
+"""
+Benchmark y comprobación de paridad de los backends de vectorización de consultas.
+
+Para cada backend (torch, onnx, onnx_int8) mide la latencia por consulta individual (p50/p95)
+y el throughput en lotes, y compara sus embeddings con los del modelo de referencia en PyTorch
+mediante la similitud coseno. Termina con código de salida 1 si algún backend queda por debajo
+de `--min-cosine`, así que puede usarse como comprobación antes de cambiar `kb_encoder_backend`.
+
+Uso (desde el directorio `robodocai/`):
+    python -m benchmarks.bench_encoders --queries 256 --batch-size 32 --min-cosine 0.99
+"""
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from agents.knowledge_agent import ENCODERS_DIR, MODEL_NAME
+from knowledge.encoders import ENCODER_BACKENDS, create_encoder
+
+_PRODUCTS = [
+    "circuitos integrados monolíticos", "teléfonos móviles inteligentes", "tornillos de acero inoxidable",
+    "camisetas de punto de algodón", "neumáticos radiales para automóviles", "café tostado sin descafeinar",
+    "baterías de iones de litio", "juguetes de plástico para niños", "válvulas de retención de bronce",
+    "cables de fibra óptica", "paneles solares fotovoltaicos", "zapatillas deportivas con suela de caucho",
+]
+_QUALIFIERS = [
+    "", "para uso industrial", "en cajas de 12 unidades", "modelo 2024", "sin montar",
+    "con accesorios incluidos", "de uso doméstico", "importados de China", "para reventa",
+]
+
+
+def synthetic_descriptions(count: int, seed: int = 0) -> list:
+    """Descripciones de producto con el estilo de las líneas de una factura comercial."""
+    rng = random.Random(seed)
+    return [f"{rng.choice(_PRODUCTS)} {rng.choice(_QUALIFIERS)}".strip() for _ in range(count)]
+
+
+def measure(encoder, descriptions: list, batch_size: int) -> dict:
+    encoder.encode(descriptions[:batch_size])  # calentamiento
+
+    single_latencies = []
+    for description in descriptions:
+        start = time.perf_counter()
+        encoder.encode([description])
+        single_latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    embeddings = np.vstack([
+        encoder.encode(descriptions[i:i + batch_size]) for i in range(0, len(descriptions), batch_size)
+    ])
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "embeddings": embeddings,
+        "p50_ms": float(np.percentile(single_latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(single_latencies, 95) * 1000),
+        "throughput": len(descriptions) / batch_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=256, help="Número de descripciones a vectorizar.")
+    parser.add_argument("--batch-size", type=int, default=32, help="Tamaño de lote para medir el throughput.")
+    parser.add_argument("--backends", nargs="+", default=list(ENCODER_BACKENDS), choices=ENCODER_BACKENDS)
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Similitud coseno mínima frente a torch.")
+    args = parser.parse_args()
+
+    descriptions = synthetic_descriptions(args.queries)
+    reference = None
+    failed = []
+
+    print(f"Modelo: {MODEL_NAME}, {args.queries} consultas, lotes de {args.batch_size}")
+    print(f"{'backend':<10} {'p50 ms':>8} {'p95 ms':>8} {'consultas/s':>12} {'coseno min':>11} {'coseno medio':>13}")
+    # torch va siempre primero: es la referencia para la paridad.
+    for backend in ["torch"] + [b for b in args.backends if b != "torch"]:
+        result = measure(create_encoder(backend, MODEL_NAME, ENCODERS_DIR), descriptions, args.batch_size)
+        if reference is None:
+            reference = result["embeddings"]
+        # Los embeddings están normalizados, así que el producto escalar es la similitud coseno.
+        cosines = np.sum(reference * result["embeddings"], axis=1)
+        if cosines.min() < args.min_cosine:
+            failed.append(backend)
+        if backend not in args.backends:
+            continue
+        print(
+            f"{backend:<10} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['throughput']:>12.1f} "
+            f"{cosines.min():>11.4f} {cosines.mean():>13.4f}"
+        )
+
+    if failed:
+        print(f"[-] Paridad insuficiente (coseno < {args.min_cosine}): {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Prueba de carga de los agentes con el proveedor de LLM local (sin red).
+
+Procesa `--documents` facturas con `--concurrency` hilos: extracción (si se indica un PDF con
+`--pdf`) y clasificación por ítems contra la base de conocimiento real. El LLM es el sustituto
+local, con la latencia y la tasa de errores indicadas. Reporta el throughput, la latencia de
+extremo a extremo por documento (p50/p95/p99) y las métricas del cliente del LLM.
+
+Con `--orchestrator` (requiere `--pdf`) cada factura recorre el pipeline completo de
+`processing.orchestrator.process_document` (extracción, comprobaciones previas, clasificación y
+supervisor, con checkpoints y escrituras) sobre una base SQLite temporal, y se cuentan los
+estados finales. Las cachés de extracción y clasificación y las plantillas se desactivan para
+que cada documento pague todas sus llamadas al LLM, salvo con `--use-caches`.
+
+Uso (desde el directorio `robodocai/`):
+    python -m benchmarks.bench_llm_pipeline --documents 200 --concurrency 16 --latency-ms 800 --error-rate 0.05
+    python -m benchmarks.bench_llm_pipeline --orchestrator --pdf factura.pdf --documents 50
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from core.config import settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=200, help="Número de facturas a procesar.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Documentos procesados en paralelo.")
+    parser.add_argument("--items", type=int, default=5, help="Ítems de línea por factura sintética.")
+    parser.add_argument("--pdf", help="PDF de factura para medir también la extracción.")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="Mediana de la latencia simulada del LLM.")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Dispersión log-normal de la latencia.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de llamadas con error transitorio.")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla del proveedor local.")
+    parser.add_argument("--orchestrator", action="store_true", help="Procesar con el orquestador (pipeline completo).")
+    parser.add_argument("--use-caches", action="store_true", help="Con --orchestrator, mantener cachés y plantillas.")
+    args = parser.parse_args()
+    if args.orchestrator and not args.pdf:
+        parser.error("--orchestrator requiere --pdf.")
+
+    # Antes de crear cualquier cliente del LLM.
+    settings.llm_provider = "fake"
+    settings.llm_fake_latency_median_ms = args.latency_ms
+    settings.llm_fake_latency_sigma = args.sigma
+    settings.llm_fake_error_rate = args.error_rate
+    settings.llm_fake_seed = args.seed
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_llm_pipeline_")
+    if args.orchestrator:
+        # Antes de importar `db.database`, que crea el engine con esta URL.
+        settings.database_url = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        if not args.use_caches:
+            settings.templates_enabled = False
+            settings.classification_cache_enabled = False
+
+    from agents.classification_agent import propose_tariff_classification
+    from agents.data_extractor import DataExtractorAgent
+    from agents.knowledge_agent import warm_up_knowledge_base
+    from benchmarks.bench_encoders import synthetic_descriptions
+    from core.llm_client import get_llm_stats
+
+    warm_up_knowledge_base()
+    descriptions = synthetic_descriptions(args.documents * args.items)
+    rng = random.Random(args.seed)
+
+    if args.orchestrator:
+        from db import database, migrations, models, repository
+        from processing import orchestrator
+
+        migrations.upgrade(database.engine)
+        db = database.SessionLocal()
+        shipment = repository.create_shipment(db, user_id="bench", name="bench_llm_pipeline")
+        document_ids = [
+            repository.create_document(
+                db, shipment.id, f"bench-{i}.pdf", models.DocumentType.FACTURA_COMERCIAL,
+                # Una huella distinta por documento para no reutilizar la extracción entre ellos.
+                content_sha256=None if args.use_caches else uuid.uuid4().hex,
+            ).id
+            for i in range(args.documents)
+        ]
+        db.close()
+        final_statuses = []
+
+    def process_with_orchestrator(document_index: int) -> tuple:
+        # El orquestador borra el archivo al terminar: cada documento usa su propia copia.
+        file_path = shutil.copy(args.pdf, os.path.join(tmp_dir, f"{document_ids[document_index]}.pdf"))
+        start = time.perf_counter()
+        try:
+            orchestrator.process_document(doc_id=document_ids[document_index], file_path=file_path)
+        except Exception as e:
+            print(f"[-] Documento {document_ids[document_index]}: error transitorio {e!r}")
+        elapsed = time.perf_counter() - start
+        db = database.SessionLocal()
+        try:
+            status = repository.get_document_by_id(db, document_ids[document_index]).status
+        finally:
+            db.close()
+        final_statuses.append(status)
+        return elapsed, status == "completed"
+
+    def process(document_index: int) -> tuple:
+        start = time.perf_counter()
+        if args.pdf:
+            invoice = DataExtractorAgent().extract_from_commercial_invoice(args.pdf)
+            structured_data = invoice.model_dump() if invoice else None
+        else:
+            structured_data = {
+                "invoice_id": f"BENCH-{document_index}",
+                "line_items": [
+                    {"item_description": description, "quantity": rng.randint(1, 100), "unit_price": 1.0}
+                    for description in descriptions[document_index * args.items:(document_index + 1) * args.items]
+                ],
+            }
+        ok = structured_data is not None
+        if ok:
+            ok = "error" not in propose_tariff_classification(structured_data)
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(process_with_orchestrator if args.orchestrator else process, range(args.documents)))
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    failed = sum(1 for _, ok in results if not ok)
+    print(f"\nDocumentos: {args.documents}, concurrencia: {args.concurrency}, fallidos: {failed}")
+    print(f"Throughput: {args.documents / elapsed:.2f} documentos/s ({elapsed:.1f}s en total)")
+    print(
+        f"Latencia por documento: p50 {np.percentile(latencies, 50):.0f} ms, "
+        f"p95 {np.percentile(latencies, 95):.0f} ms, p99 {np.percentile(latencies, 99):.0f} ms"
+    )
+    if args.orchestrator:
+        print(f"Estados finales: {dict(Counter(final_statuses))}")
+    print(f"Cliente del LLM: {get_llm_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark de codificaciones compactas de vectores para la base de conocimiento.
+
+Para cada codificación (float32, float16, int8, PQ) construye un índice flat sobre el corpus
+sintético y reporta los bytes por vector del índice serializado y el recall@k frente a float32.
+
+Uso (desde el directorio `robodocai/`):
+    python -m benchmarks.bench_vector_encoding --vectors 50000 --queries 500 --k 5
+"""
+import argparse
+import faiss
+
+from benchmarks.bench_ann_index import recall_at_k, synthetic_corpus
+from knowledge.index_factory import build_index
+
+CONFIGURATIONS = [
+    ("float32", {}),
+    ("float16", {}),
+    ("int8", {}),
+    ("pq", {"pq_m": 96, "pq_nbits": 8}),
+    ("pq", {"pq_m": 48, "pq_nbits": 8}),
+    ("pq", {"pq_m": 24, "pq_nbits": 8}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50_000, help="Tamaño del corpus sintético.")
+    parser.add_argument("--queries", type=int, default=500, help="Número de consultas.")
+    parser.add_argument("--dim", type=int, default=384, help="Dimensión de los embeddings.")
+    parser.add_argument("--k", type=int, default=5, help="Vecinos por consulta.")
+    parser.add_argument("--index-type", default="flat", help="Tipo de índice sobre el que comparar.")
+    args = parser.parse_args()
+
+    corpus, queries = synthetic_corpus(args.vectors, args.queries, args.dim)
+
+    ground_truth = None
+    print(f"Corpus: {args.vectors} vectores de dimensión {args.dim}, {args.queries} consultas, k={args.k}")
+    print(f"{'codificación':<14} {'parámetros':<32} {'bytes/vector':>12} {'recall@k':>9}")
+    for encoding, params in CONFIGURATIONS:
+        index, metadata = build_index(corpus, args.index_type, encoding=encoding, **params)
+        bytes_per_vector = faiss.serialize_index(index).nbytes / index.ntotal
+        _, retrieved = index.search(queries, args.k)
+
+        if ground_truth is None:
+            # La primera configuración es float32: sirve de referencia.
+            ground_truth = retrieved
+
+        print(
+            f"{encoding:<14} {str(metadata['params']):<32} {bytes_per_vector:>12.1f} "
+            f"{recall_at_k(ground_truth, retrieved):>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
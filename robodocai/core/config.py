@@ -4,7 +4,122 @@ class Settings(BaseSettings):
     database_url: str
     google_api_key: str
 
+    # --- Base de conocimiento del arancel ---
+    # PDFs adicionales (reglamentos, resoluciones...) que se indexan junto al arancel.
+    kb_extra_source_pdfs: list[str] = []
+    # Tipo de índice FAISS: "flat", "ivf_flat", "ivf_pq" o "hnsw".
+    kb_index_type: str = "flat"
+    # Almacenamiento de cada vector: "float32", "float16", "int8" (cuantización escalar) o "pq".
+    kb_vector_encoding: str = "float32"
+    # Tamaño de los lotes de embeddings que se añaden al índice durante la construcción.
+    kb_build_batch_size: int = 1024
+    # Procesos para extraer páginas de los PDFs y páginas por tarea.
+    kb_pdf_workers: int = 4
+    kb_pages_per_task: int = 16
+    # Procesos de embedding durante la construcción (1 = en el proceso actual).
+    kb_embedding_workers: int = 1
+    # Segundos que un proceso espera a que otro termine de construir la base antes de
+    # responder de forma degradada.
+    kb_build_wait_seconds: float = 30.0
+    # Parámetros de los índices IVF (número de listas y listas visitadas por consulta).
+    kb_ivf_nlist: int = 256
+    kb_ivf_nprobe: int = 16
+    # Parámetros de IVF-PQ (subcuantizadores y bits por código).
+    kb_pq_m: int = 48
+    kb_pq_nbits: int = 8
+    # Parámetros de HNSW (vecinos por nodo y anchura de la búsqueda).
+    kb_hnsw_m: int = 32
+    kb_hnsw_ef_construction: int = 200
+    kb_hnsw_ef_search: int = 64
+    # Servicio de recuperación compartido (socket Unix). Si no se configura, o no responde,
+    # cada proceso carga su propio modelo.
+    kb_retrieval_socket: str | None = None
+    kb_retrieval_max_batch_size: int = 64
+    kb_retrieval_max_wait_ms: float = 5.0
+    # Caché de consultas al arancel: LRU en memoria + almacén SQLite compartido entre workers.
+    kb_query_cache_size: int = 4096
+    kb_query_cache_ttl_seconds: float = 24 * 3600
+    kb_query_cache_persistent: bool = True
+    # Máximo de filas del almacén SQLite; al superarlo se podan las entradas más antiguas.
+    kb_query_cache_persistent_max_rows: int = 100_000
+    # Backend para vectorizar las consultas: "torch", "onnx" u "onnx_int8" (ONNX con pesos int8).
+    # La construcción del índice siempre usa el modelo de referencia en PyTorch.
+    kb_encoder_backend: str = "torch"
+
+
+    # --- Cliente del LLM ---
+    # Proveedor: "gemini" o "fake" (sustituto local para pruebas de carga sin red).
+    llm_provider: str = "gemini"
+    # Llamadas simultáneas por proceso, timeout por llamada y reintentos de errores transitorios.
+    llm_max_concurrency: int = 8
+    llm_timeout_seconds: float = 60.0
+    llm_max_retries: int = 4
+    llm_backoff_base_seconds: float = 1.0
+    llm_backoff_max_seconds: float = 30.0
+    # Límite de tasa (token bucket) compartido por todos los workers a través de un archivo SQLite.
+    # 0 lo desactiva.
+    llm_rate_limit_per_second: float = 5.0
+    llm_rate_limit_burst: int = 10
+    llm_rate_limit_file: str = "llm_rate_limit.sqlite3"
+    # Sustituto local: latencia log-normal (mediana y dispersión), fracción de errores
+    # transitorios simulados y semilla opcional para que las ejecuciones sean reproducibles.
+    llm_fake_latency_median_ms: float = 800.0
+    llm_fake_latency_sigma: float = 0.5
+    llm_fake_error_rate: float = 0.0
+    llm_fake_seed: int | None = None
+
+    # --- Cola de trabajos (tabla jobs) y workers de procesamiento ---
+    # Procesos de `python -m processing.worker` (se puede cambiar con --processes).
+    job_worker_processes: int = 4
+    # Duración de la concesión (lease) de un trabajo; el worker la renueva mientras lo procesa.
+    # Si el worker muere, el trabajo vuelve a la cola cuando vence.
+    job_lease_seconds: float = 300.0
+    # Intentos máximos de un trabajo antes de marcarlo como fallido.
+    job_max_attempts: int = 3
+    # Espera antes de reintentar un trabajo fallido (se multiplica por el número de intentos).
+    job_retry_backoff_seconds: float = 30.0
+    # Espera de un worker cuando la cola está vacía.
+    job_poll_interval_seconds: float = 1.0
+    # Horas que se conservan los archivos subidos de documentos sin trabajo activo (p. ej. los
+    # que fallaron antes de la extracción, por si se reprocesan); después los workers los borran.
+    job_upload_retention_hours: float = 72.0
+    # Cada cuántos segundos publica un worker sus contadores (tabla worker_metrics) para
+    # `/metrics`, y cuántas horas se conservan los de los workers que dejaron de publicar.
+    worker_metrics_publish_seconds: float = 15.0
+    worker_metrics_retention_hours: float = 24.0
+
+    # --- Extracción de texto de los documentos subidos ---
+    # Procesos extractores y páginas por tarea para los PDFs largos.
+    pdf_extraction_workers: int = 4
+    pdf_pages_per_task: int = 8
+    # Límites por documento: páginas, tamaño del archivo y caracteres de texto extraído.
+    pdf_max_pages: int = 500
+    pdf_max_file_mb: int = 50
+    pdf_max_text_chars: int = 2_000_000
+
+    # --- Extracción por ventanas de las facturas largas ---
+    # Las facturas con más de `extraction_windowed_min_pages` páginas se extraen por ventanas de
+    # `extraction_window_pages` páginas (solapadas `extraction_window_overlap_pages`) en paralelo.
+    extraction_windowed_min_pages: int = 6
+    extraction_window_pages: int = 4
+    extraction_window_overlap_pages: int = 1
+
+    # --- Plantillas de diseño por vendedor ---
+    # Extracción determinista (sin LLM) de las facturas cuyo diseño coincide con una plantilla aprendida.
+    templates_enabled: bool = True
+    # Fracción mínima de la huella de la plantilla (palabras y posiciones) presente en el documento.
+    template_min_similarity: float = 0.6
+
+    # --- Clasificación arancelaria ---
+    # Número máximo de ítems de línea que se clasifican en un mismo prompt al LLM.
+    classification_batch_size: int = 8
+    # Presupuesto de tokens (estimados) del contexto del arancel que se envía por cada ítem.
+    classification_context_token_budget: int = 600
+    # Caché persistente (tabla classification_cache) de clasificaciones por descripción normalizada.
+    classification_cache_enabled: bool = True
+    classification_cache_ttl_seconds: float = 30 * 24 * 3600
+
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
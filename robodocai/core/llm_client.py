@@ -0,0 +1,264 @@
+"""
+Cliente compartido para las llamadas al LLM.
+
+    - Reutiliza un único proveedor (y sus conexiones) por modelo y proceso; el proveedor
+      (Gemini o el sustituto local) se elige con `llm_provider`.
+    - Ejecuta las llamadas de forma asíncrona en un bucle de eventos propio, con un semáforo
+      que limita las llamadas concurrentes.
+    - Reintenta los errores transitorios (429, 5xx, timeouts) con backoff exponencial y jitter.
+    - Aplica un límite de tasa tipo token bucket cuyo estado vive en un archivo SQLite, de modo
+      que lo comparten todos los workers de la máquina.
+    - Registra la latencia y los reintentos de cada llamada.
+
+Los llamadores síncronos (tareas en segundo plano) usan `generate`/`submit`; el código asíncrono
+usa `agenerate`.
+"""
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional
+
+from core.config import settings
+from core.llm_providers import LLMProvider, TransientLLMError, create_provider
+
+
+class LLMUnavailableError(RuntimeError):
+    """El LLM siguió fallando con errores transitorios tras agotar los reintentos."""
+
+
+def llm_model_id(model_name: str, provider_name: Optional[str] = None) -> str:
+    """
+    Identificador de proveedor y modelo (p. ej. para claves de caché de resultados). Sin
+    proveedor se usa el configurado (`llm_provider`), sin crear ningún cliente.
+    """
+    return f"{provider_name or settings.llm_provider}:{model_name}"
+
+
+class TokenBucket:
+    """
+    Límite de tasa tipo token bucket compartido entre procesos a través de SQLite.
+
+    Cada llamada consume un token; los tokens se reponen a `rate` por segundo hasta `burst`.
+    La lectura y actualización del estado se hacen en una transacción `BEGIN IMMEDIATE`, que
+    serializa a todos los procesos que comparten el archivo.
+    """
+    def __init__(self, path: str, rate: float, burst: int, name: str = "llm"):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_bucket (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """
+        Intenta consumir un token.
+
+        Returns:
+            0 si se consumió, o los segundos que hay que esperar antes de volver a intentarlo.
+        """
+        with self._lock:
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM token_bucket WHERE name = ?", (self.name,)
+                ).fetchone()
+                tokens = float(self.burst) if row is None else min(self.burst, row[0] + max(0.0, now - row[1]) * self.rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+                if wait == 0.0:
+                    tokens -= 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO token_bucket (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    (self.name, tokens, now),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return wait
+
+    async def acquire(self) -> None:
+        """Espera hasta consumir un token. La transacción SQLite corre en un hilo aparte para no bloquear el bucle de eventos."""
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(wait)
+
+
+class LLMClient:
+    """
+    Cliente de un modelo generativo, compartido por todos los hilos del proceso.
+    """
+    def __init__(
+        self,
+        provider: LLMProvider,
+        max_concurrency: int = 8,
+        timeout_seconds: float = 60.0,
+        max_retries: int = 4,
+        backoff_base_seconds: float = 1.0,
+        backoff_max_seconds: float = 30.0,
+        rate_limiter: Optional[TokenBucket] = None,
+    ):
+        self.provider = provider
+        self.model_name = provider.model_name
+        # Identifica proveedor y modelo (p. ej. para claves de caché de resultados).
+        self.model_id = llm_model_id(provider.model_name, provider.name)
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.rate_limiter = rate_limiter
+
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._counters = {"calls": 0, "retries": 0, "failures": 0, "timeouts": 0}
+
+        # Bucle de eventos propio: el semáforo y las llamadas asíncronas viven siempre en él,
+        # sin importar desde qué hilo o bucle se invoque al cliente.
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._thread = threading.Thread(target=self._loop.run_forever, name=f"llm-{self.model_name}", daemon=True)
+        self._thread.start()
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Backoff exponencial con jitter completo."""
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+
+    def is_retryable_error(self, error: BaseException) -> bool:
+        """Indica si un error es transitorio (límite de tasa, error del servidor, timeout o conexión)."""
+        return isinstance(error, (asyncio.TimeoutError, ConnectionError, TransientLLMError)) or self.provider.is_retryable(error)
+
+    async def _generate(self, prompt: str, task: Optional[str]) -> str:
+        # Cada intento ocupa un hueco de concurrencia solo mientras dura la llamada: la espera del
+        # límite de tasa y la del reintento no bloquean a las demás llamadas.
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            async with self._semaphore:
+                start = time.perf_counter()
+                try:
+                    text = await asyncio.wait_for(self.provider.generate(prompt, task), timeout=self.timeout_seconds)
+                except Exception as e:
+                    self._record(time.perf_counter() - start, timeout=isinstance(e, asyncio.TimeoutError))
+                    error = e
+                else:
+                    self._record(time.perf_counter() - start)
+                    return text
+            if not self.is_retryable_error(error):
+                self._count("failures")
+                raise error
+            if attempt == self.max_retries:
+                self._count("failures")
+                raise LLMUnavailableError(
+                    f"El LLM '{self.model_id}' sigue fallando tras {self.max_retries} reintentos: {error!r}"
+                ) from error
+            delay = self._backoff_delay(attempt)
+            print(f"[-] (LLMClient) Error transitorio ({error!r}). Reintento {attempt + 1}/{self.max_retries} en {delay:.1f}s.")
+            self._count("retries")
+            await asyncio.sleep(delay)
+
+    def submit(self, prompt: str, task: Optional[str] = None) -> Future:
+        """
+        Agenda una llamada al LLM y devuelve un Future con el texto de la respuesta.
+
+        Args:
+            prompt: El prompt completo.
+            task: La tarea que se pide (TASK_* de `core.llm_providers`); el sustituto local la
+                usa para generar una respuesta con el esquema correcto.
+        """
+        return asyncio.run_coroutine_threadsafe(self._generate(prompt, task), self._loop)
+
+    def generate(self, prompt: str, task: Optional[str] = None) -> str:
+        """Llamada bloqueante al LLM; devuelve el texto de la respuesta."""
+        return self.submit(prompt, task).result()
+
+    async def agenerate(self, prompt: str, task: Optional[str] = None) -> str:
+        """Llamada asíncrona al LLM, utilizable desde cualquier bucle de eventos."""
+        return await asyncio.wrap_future(self.submit(prompt, task))
+
+    def _count(self, counter: str) -> None:
+        with self._stats_lock:
+            self._counters[counter] += 1
+
+    def _record(self, latency: float, timeout: bool = False) -> None:
+        with self._stats_lock:
+            self._counters["calls"] += 1
+            if timeout:
+                self._counters["timeouts"] += 1
+            self._latencies.append(latency)
+
+    def counters(self) -> dict:
+        """Contadores del cliente y latencias recientes (en segundos), sin las métricas derivadas."""
+        with self._stats_lock:
+            return {**self._counters, "latencies": list(self._latencies)}
+
+    def stats(self) -> dict:
+        return summarize_llm_stats(self.counters())
+
+
+def summarize_llm_stats(counters: dict) -> dict:
+    """
+    Sustituye las latencias de unos contadores del LLM (de un cliente o unidos entre workers)
+    por sus percentiles 50 y 95 en milisegundos.
+    """
+    stats = dict(counters)
+    latencies = sorted(stats.pop("latencies", []))
+    if latencies:
+        stats["latency_p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 1)
+        stats["latency_p95_ms"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1)
+    return stats
+
+
+_clients: dict = {}
+_clients_lock = threading.Lock()
+_rate_limiter: Optional[TokenBucket] = None
+
+
+def get_llm_client(model_name: str) -> LLMClient:
+    """
+    Devuelve el cliente del proceso para un modelo, creándolo la primera vez. Todos los
+    clientes comparten el mismo límite de tasa.
+    """
+    global _rate_limiter
+    with _clients_lock:
+        client = _clients.get(model_name)
+        if client is None:
+            if _rate_limiter is None and settings.llm_rate_limit_per_second > 0:
+                _rate_limiter = TokenBucket(
+                    settings.llm_rate_limit_file,
+                    rate=settings.llm_rate_limit_per_second,
+                    burst=settings.llm_rate_limit_burst,
+                )
+            client = LLMClient(
+                create_provider(settings.llm_provider, model_name, settings),
+                max_concurrency=settings.llm_max_concurrency,
+                timeout_seconds=settings.llm_timeout_seconds,
+                max_retries=settings.llm_max_retries,
+                backoff_base_seconds=settings.llm_backoff_base_seconds,
+                backoff_max_seconds=settings.llm_backoff_max_seconds,
+                rate_limiter=_rate_limiter,
+            )
+            _clients[model_name] = client
+        return client
+
+
+def get_llm_counters() -> dict:
+    """Devuelve los contadores y latencias recientes de cada cliente del proceso."""
+    with _clients_lock:
+        clients = dict(_clients)
+    return {client.model_id: client.counters() for client in clients.values()}
+
+
+def get_llm_stats() -> dict:
+    """Devuelve las métricas (llamadas, reintentos, latencia) de cada cliente del proceso."""
+    return {model_id: summarize_llm_stats(counters) for model_id, counters in get_llm_counters().items()}
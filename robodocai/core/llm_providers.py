@@ -0,0 +1,236 @@
+"""
+Proveedores de LLM intercambiables detrás de una misma interfaz.
+
+    - "gemini": Google Gemini a través de `google-generativeai`.
+    - "fake": un sustituto local y determinista que devuelve JSON válido para cada tarea, con
+      latencia (log-normal) y tasa de errores transitorios configurables. Permite medir el
+      throughput y la latencia de cola del pipeline completo sin acceso a la red.
+
+El proveedor se elige con `llm_provider` en la configuración; los agentes lo usan siempre a
+través de `core.llm_client`, que añade concurrencia acotada, reintentos y límite de tasa.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+from typing import Optional
+
+# Tareas que los agentes piden al LLM. El sustituto local genera una respuesta con el esquema
+# de cada una; los proveedores reales las ignoran.
+TASK_TARIFF_CLASSIFICATION = "tariff_classification"
+TASK_INVOICE_EXTRACTION = "invoice_extraction"
+# Extracción por ventanas de las facturas largas: encabezado una vez e ítems por ventana.
+TASK_INVOICE_HEADER = "invoice_header"
+TASK_INVOICE_LINE_ITEMS = "invoice_line_items"
+
+LLM_PROVIDERS = ("gemini", "fake")
+
+
+class TransientLLMError(RuntimeError):
+    """Error transitorio del proveedor (equivalente a un 429/503); el cliente lo reintenta."""
+
+
+class LLMProvider:
+    """
+    Interfaz de un proveedor de LLM.
+    """
+    name = "base"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    async def generate(self, prompt: str, task: Optional[str] = None) -> str:
+        """Genera la respuesta de texto para un prompt."""
+        raise NotImplementedError
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """Indica si un error propio del proveedor es transitorio."""
+        return isinstance(error, TransientLLMError)
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini. El objeto del modelo (y sus conexiones) se reutiliza entre llamadas."""
+    name = "gemini"
+
+    def __init__(self, model_name: str, api_key: str):
+        super().__init__(model_name)
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+
+        genai.configure(api_key=api_key)
+        self._model = genai.GenerativeModel(model_name)
+        self._retryable_exceptions = (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.InternalServerError,
+            google_exceptions.BadGateway,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.GatewayTimeout,
+            google_exceptions.DeadlineExceeded,
+        )
+
+    async def generate(self, prompt: str, task: Optional[str] = None) -> str:
+        response = await self._model.generate_content_async(prompt)
+        return response.text
+
+    def is_retryable(self, error: BaseException) -> bool:
+        return isinstance(error, self._retryable_exceptions)
+
+
+# --- Sustituto local ---
+
+_ITEM_HEADER = re.compile(r"^### Ítem (\d+)\s*$", re.MULTILINE)
+_TARIFF_CODE = re.compile(r"(?<![\d.])(\d{4}\.\d{2}(?:\.\d{2}){0,2})(?![\d.])")
+
+
+def _prompt_digest(prompt: str) -> int:
+    return int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "big")
+
+
+def _fake_tariff_classification(prompt: str) -> str:
+    """Un objeto por cada "### Ítem N" del prompt, con el primer código que aparezca en su contexto."""
+    headers = list(_ITEM_HEADER.finditer(prompt))
+    classifications = []
+    for header, next_header in zip(headers, headers[1:] + [None]):
+        section = prompt[header.end():next_header.start() if next_header else len(prompt)]
+        rng = random.Random(_prompt_digest(section))
+        match = _TARIFF_CODE.search(section)
+        if match:
+            hs_code = match.group(1)
+            source_text = section[match.start():].splitlines()[0].strip()
+        else:
+            hs_code = f"{rng.randint(100, 9799):04d}.{rng.randint(10, 99)}"
+            source_text = ""
+        classifications.append({
+            "item_index": int(header.group(1)),
+            "hs_code": hs_code,
+            "description": source_text or f"Partida {hs_code}",
+            "confidence_score": round(rng.uniform(0.80, 0.99), 2),
+            "reasoning": "Respuesta simulada por el proveedor local de pruebas.",
+            "source_text": source_text,
+        })
+    return json.dumps(classifications, ensure_ascii=False)
+
+
+def _fake_invoice_extraction(prompt: str) -> str:
+    """Una factura comercial válida; el número de factura depende del prompt."""
+    return json.dumps({
+        "invoice_id": f"FAC-{_prompt_digest(prompt) % 10**8:08d}",
+        "issue_date": "2024-08-13",
+        "seller_name": "Componentes Electrónicos de Colombia S.A.S.",
+        "seller_address": "Zona Franca, Bodega 5, Cartagena, Colombia",
+        "seller_tax_id": "900.123.456-7",
+        "buyer_name": "Tech Imports LLC",
+        "buyer_address": "123 Tech Way, Miami, FL 33101, USA",
+        "buyer_tax_id": "US-59-1234567",
+        "incoterm": "FOB",
+        "currency": "USD",
+        "country_of_origin": "Colombia",
+        "line_items": [
+            {
+                "item_description": "Microcontrolador ATmega328P-PU",
+                "quantity": 1500.0,
+                "unit_price": 2.50,
+                "total_price": 3750.0
+            },
+            {
+                "item_description": "Sensor de Humedad y Temperatura DHT22",
+                "quantity": 500.0,
+                "unit_price": 4.15,
+                "total_price": 2075.0
+            }
+        ],
+        "subtotal_amount": 5825.0,
+        "total_amount": 5825.0
+    }, ensure_ascii=False)
+
+
+def _fake_invoice_header(prompt: str) -> str:
+    """Los campos de encabezado de la factura simulada, sin ítems."""
+    header = json.loads(_fake_invoice_extraction(prompt))
+    del header["line_items"]
+    return json.dumps(header, ensure_ascii=False)
+
+
+_LINE_ITEM_ROW = re.compile(r"^\s*(\S.*?)\s+(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s*$", re.MULTILINE)
+
+
+def _fake_invoice_line_items(prompt: str) -> str:
+    """Un ítem por cada fila "descripción cantidad precio total" del fragmento del prompt."""
+    fragment = prompt.split("---")[1] if prompt.count("---") >= 2 else prompt
+    return json.dumps({"line_items": [
+        {
+            "item_description": row.group(1),
+            "quantity": float(row.group(2)),
+            "unit_price": float(row.group(3)),
+            "total_price": float(row.group(4)),
+        }
+        for row in _LINE_ITEM_ROW.finditer(fragment)
+    ]}, ensure_ascii=False)
+
+
+_FAKE_RESPONSES = {
+    TASK_TARIFF_CLASSIFICATION: _fake_tariff_classification,
+    TASK_INVOICE_EXTRACTION: _fake_invoice_extraction,
+    TASK_INVOICE_HEADER: _fake_invoice_header,
+    TASK_INVOICE_LINE_ITEMS: _fake_invoice_line_items,
+}
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Sustituto local del LLM para pruebas de carga.
+
+    El contenido de la respuesta depende solo del prompt. La latencia sigue una distribución
+    log-normal (mediana `latency_median_ms`, dispersión `latency_sigma`) y una fracción
+    `error_rate` de las llamadas falla con un error transitorio; ambas se generan con una
+    semilla fija si se indica, para que una ejecución sea reproducible.
+    """
+    name = "fake"
+
+    def __init__(
+        self,
+        model_name: str,
+        latency_median_ms: float = 800.0,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        super().__init__(model_name)
+        self.latency_median_ms = latency_median_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+
+    async def generate(self, prompt: str, task: Optional[str] = None) -> str:
+        if task not in _FAKE_RESPONSES:
+            raise ValueError(f"El proveedor local no sabe responder a la tarea '{task}'.")
+        latency = self.latency_median_ms / 1000 * self._rng.lognormvariate(0.0, self.latency_sigma)
+        failed = self._rng.random() < self.error_rate
+        await asyncio.sleep(latency)
+        if failed:
+            raise TransientLLMError("Error transitorio simulado (503).")
+        return _FAKE_RESPONSES[task](prompt)
+
+
+def create_provider(provider: str, model_name: str, settings) -> LLMProvider:
+    """
+    Crea el proveedor de LLM configurado.
+
+    Args:
+        provider: Uno de LLM_PROVIDERS.
+        model_name: El modelo a usar.
+        settings: La configuración de la aplicación.
+    """
+    if provider == "gemini":
+        return GeminiProvider(model_name, api_key=settings.google_api_key)
+    if provider == "fake":
+        return FakeLLMProvider(
+            model_name,
+            latency_median_ms=settings.llm_fake_latency_median_ms,
+            latency_sigma=settings.llm_fake_latency_sigma,
+            error_rate=settings.llm_fake_error_rate,
+            seed=settings.llm_fake_seed,
+        )
+    raise ValueError(f"Proveedor de LLM desconocido '{provider}'. Opciones válidas: {', '.join(LLM_PROVIDERS)}.")
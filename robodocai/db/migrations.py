@@ -0,0 +1,51 @@
+"""
+Migraciones del esquema al arrancar.
+
+`create_all` solo crea las tablas que faltan: no añade columnas nuevas a una tabla que ya
+existe. `upgrade` crea las tablas y después añade, con `ALTER TABLE ... ADD COLUMN`, las
+columnas de ADDED_COLUMNS que falten en bases de datos creadas con una versión anterior, junto
+con sus índices. Es idempotente: la API y los workers la llaman en cada arranque.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+
+from db import models
+
+# Columnas añadidas a tablas existentes, en orden: (tabla, columna). Deben ser anulables.
+ADDED_COLUMNS = [
+    ("documents", "content_sha256"),
+    ("documents", "pipeline_run"),
+]
+
+
+def _add_column(connection, table, column) -> None:
+    column_type = column.type.compile(dialect=connection.dialect)
+    connection.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+    for index in table.indexes:
+        if column.name in index.columns:
+            index.create(bind=connection, checkfirst=True)
+
+
+def upgrade(engine: Engine) -> list:
+    """
+    Crea las tablas que faltan y añade las columnas nuevas a las existentes.
+
+    Args:
+        engine: El motor de la base de datos.
+
+    Returns:
+        Las columnas añadidas, como "tabla.columna".
+    """
+    models.Base.metadata.create_all(bind=engine)
+    added = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table_name, column_name in ADDED_COLUMNS:
+            if column_name in {column["name"] for column in inspector.get_columns(table_name)}:
+                continue
+            table = models.Base.metadata.tables[table_name]
+            _add_column(connection, table, table.columns[column_name])
+            added.append(f"{table_name}.{column_name}")
+    for column in added:
+        print(f"[+] (Migrations) Columna {column} añadida.")
+    return added
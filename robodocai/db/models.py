@@ -1,6 +1,6 @@
 import uuid
 import enum
-from sqlalchemy import Column, String, JSON, DateTime, func, Text, Uuid, ForeignKey, Enum
+from sqlalchemy import Column, String, JSON, DateTime, func, Text, Uuid, ForeignKey, Enum, Integer, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -53,14 +53,125 @@ class Document(Base):
     document_type = Column(Enum(DocumentType), nullable=False, comment="Tipo de documento (e.g., FACTURA_COMERCIAL)")
     
     status = Column(String, nullable=False, default="received")
+    # Huella SHA-256 del archivo subido; identifica el mismo documento en distintas subidas.
+    content_sha256 = Column(String(64), nullable=True, index=True)
     structured_data = Column(JSON, nullable=True)
     raw_text_content = Column(Text, nullable=True)
     pre_flight_check_results = Column(JSON, nullable=True)
     classification_data = Column(JSON, nullable=True)
     supervisor_verdict = Column(JSON, nullable=True)
+    # Etapas ejecutadas (con su duración) y corte del pipeline, si una compuerta lo detuvo.
+    pipeline_run = Column(JSON, nullable=True)
     error_log = Column(Text, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now(), server_default=func.now())
 
     # Relación muchos-a-uno: Muchos documentos pertenecen a un envío.
-    shipment = relationship("Shipment", back_populates="documents")
\ No newline at end of file
+    shipment = relationship("Shipment", back_populates="documents")
+
+class ClassificationCacheEntry(Base):
+    """
+    Clasificación arancelaria ya calculada para una descripción de producto.
+
+    La clave combina la descripción normalizada (y el código declarado, si lo hay) con la
+    versión de la base de conocimiento, el modelo y la versión del prompt, así que un cambio
+    en cualquiera de ellos deja de encontrar las entradas anteriores.
+    """
+    __tablename__ = "classification_cache"
+
+    cache_key = Column(String(64), primary_key=True, comment="SHA-256 de la descripción normalizada y las versiones")
+    normalized_description = Column(Text, nullable=False)
+    kb_version = Column(String, nullable=False, index=True)
+    model_id = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=False)
+    classification = Column(JSON, nullable=False)
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class ExtractionCacheEntry(Base):
+    """
+    Texto crudo y datos validados ya extraídos de un archivo, por huella SHA-256 y versión del
+    extractor. Una nueva subida del mismo archivo los reutiliza sin leer el PDF ni llamar al LLM.
+    """
+    __tablename__ = "extraction_cache"
+
+    content_sha256 = Column(String(64), primary_key=True)
+    extractor_version = Column(String, primary_key=True)
+    raw_text = Column(Text, nullable=False)
+    structured_data = Column(JSON, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class InvoiceTemplate(Base):
+    """
+    Plantilla del diseño de las facturas de un vendedor, aprendida de una extracción validada.
+    Guarda la huella del diseño (palabras con su posición aproximada) y las reglas para extraer
+    los campos y la tabla de ítems sin LLM.
+    """
+    __tablename__ = "invoice_templates"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    seller_name = Column(String, nullable=True)
+    layout_tokens = Column(JSON, nullable=False, comment="Palabras de la primera página con su celda de la rejilla")
+    rules = Column(JSON, nullable=False, comment="Anclas y posiciones de los campos y columnas de la tabla de ítems")
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, nullable=False, index=True)
+
+
+class Job(Base):
+    """
+    Trabajo de la cola de procesamiento. Los workers (`processing.worker`) lo toman con una
+    concesión (lease) que vence en `lease_expires_at`: si el worker muere sin terminarlo, el
+    trabajo vuelve a la cola, hasta `max_attempts` intentos.
+    """
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_priority", "status", "priority", "available_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False, comment="Tipo de trabajo, ej: process_document")
+    document_id = Column(Uuid, ForeignKey("documents.id"), nullable=True, index=True)
+    payload = Column(JSON, nullable=False, default=dict)
+    status = Column(String, nullable=False, default="queued", comment="queued, leased, succeeded o failed")
+    priority = Column(Integer, nullable=False, default=0, comment="Mayor prioridad se procesa antes")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    available_at = Column(DateTime, nullable=False, comment="No se entrega antes de esta fecha (reintentos)")
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True, index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class StageCheckpoint(Base):
+    """
+    Checkpoint de una etapa del procesamiento de un documento: la huella de sus entradas, su
+    salida y sus intentos. Al reprocesar, las etapas completadas con las mismas entradas se
+    reutilizan en lugar de volver a ejecutarse.
+    """
+    __tablename__ = "document_stage_checkpoints"
+
+    document_id = Column(Uuid, ForeignKey("documents.id"), primary_key=True)
+    stage = Column(String, primary_key=True)
+    input_hash = Column(String(64), nullable=False, comment="SHA-256 de las entradas de la etapa")
+    status = Column(String, nullable=False, comment="running, completed, retryable o failed")
+    output = Column(JSON, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class WorkerMetrics(Base):
+    """
+    Últimos contadores publicados por cada proceso worker (clasificación, extracción, LLM y caché
+    de consultas). La API los agrega en `/metrics`, ya que el procesamiento no corre en ella.
+    """
+    __tablename__ = "worker_metrics"
+
+    owner = Column(String, primary_key=True, comment="Identificador del worker (host:pid:índice)")
+    snapshot = Column(JSON, nullable=False)
+    updated_at = Column(DateTime, nullable=False, index=True)
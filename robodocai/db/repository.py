@@ -1,7 +1,14 @@
+from datetime import datetime, timedelta, timezone
 from uuid import UUID
+from sqlalchemy import func, or_, update
 from sqlalchemy.orm import Session
 from . import models
 
+
+def _utcnow() -> datetime:
+    # Las columnas DateTime son "naive": se guardan en UTC sin zona horaria.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 def create_shipment(db: Session, user_id: str, name: str) -> models.Shipment:
     """
     Crea un nuevo registro de expediente (Shipment) en la base de datos.
@@ -20,7 +27,13 @@ def create_shipment(db: Session, user_id: str, name: str) -> models.Shipment:
     db.refresh(db_shipment)
     return db_shipment
 
-def create_document(db: Session, shipment_id: UUID, source_filename: str, document_type: models.DocumentType) -> models.Document:
+def create_document(
+    db: Session,
+    shipment_id: UUID,
+    source_filename: str,
+    document_type: models.DocumentType,
+    content_sha256: str | None = None,
+) -> models.Document:
     """
     Crea un nuevo registro de documento en la base de datos, asociado a un Shipment.
 
@@ -29,6 +42,7 @@ def create_document(db: Session, shipment_id: UUID, source_filename: str, docume
         shipment_id: El UUID del Shipment al que pertenece el documento.
         source_filename: El nombre del archivo original.
         document_type: El tipo de documento (usando el Enum DocumentType).
+        content_sha256: La huella SHA-256 del archivo subido.
 
     Returns:
         El objeto Document recién creado.
@@ -36,7 +50,8 @@ def create_document(db: Session, shipment_id: UUID, source_filename: str, docume
     db_document = models.Document(
         shipment_id=shipment_id,
         source_filename=source_filename,
-        document_type=document_type
+        document_type=document_type,
+        content_sha256=content_sha256
     )
     db.add(db_document)
     db.commit()
@@ -193,4 +208,539 @@ def log_document_failure(db: Session, document_id: UUID, error_message: str) ->
         db_document.error_log = error_message
         db.commit()
         db.refresh(db_document)
-    return db_document
\ No newline at end of file
+    return db_document
+
+
+def update_documents_status(db: Session, document_ids: list[UUID], new_status: str) -> int:
+    """
+    Actualiza el estado de varios documentos con una sola sentencia y un solo commit.
+
+    Args:
+        db: La sesión de la base de datos.
+        document_ids: Los UUID de los documentos a actualizar.
+        new_status: El nuevo estado a establecer.
+
+    Returns:
+        El número de documentos actualizados.
+    """
+    if not document_ids:
+        return 0
+    result = db.execute(
+        update(models.Document)
+        .where(models.Document.id.in_(document_ids))
+        .values(status=new_status, updated_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+class DocumentUnitOfWork:
+    """
+    Acumula los cambios de las etapas del procesamiento de un documento y los guarda juntos.
+
+    El documento se carga una sola vez; los `set_*` solo modifican el objeto en memoria y
+    `flush()` los escribe en una única transacción (un UPDATE y un commit) en cada frontera de
+    etapa, en lugar de una consulta, un commit y un refresh por campo.
+
+    La sesión debe crearse con `expire_on_commit=False` para que leer el documento después de
+    un `flush()` no vuelva a consultarlo.
+    """
+    def __init__(self, db: Session, document_id: UUID):
+        self.db = db
+        self.document_id = document_id
+        self.document = db.get(models.Document, document_id)
+
+    def set_status(self, new_status: str) -> None:
+        self.document.status = new_status
+
+    def set_content(self, text_content: str) -> None:
+        self.document.raw_text_content = text_content
+
+    def set_structured_data(self, data: dict) -> None:
+        self.document.structured_data = data
+
+    def set_classification_data(self, data: dict) -> None:
+        self.document.classification_data = data
+
+    def set_pre_flight_check_results(self, data: dict) -> None:
+        self.document.pre_flight_check_results = data
+
+    def set_supervisor_verdict(self, data: dict) -> None:
+        self.document.supervisor_verdict = data
+
+    def set_pipeline_run(self, data: dict) -> None:
+        self.document.pipeline_run = data
+
+    def fail(self, error_message: str) -> None:
+        """Marca el documento como fallido (como `log_document_failure`) y guarda los cambios."""
+        self.document.status = "error"
+        self.document.error_log = error_message
+        self.flush()
+
+    def flush(self) -> None:
+        """Escribe los cambios acumulados en una transacción."""
+        if self.db.dirty or self.db.new:
+            self.db.commit()
+
+
+def get_cached_classifications(db: Session, cache_keys: list[str]) -> dict:
+    """
+    Recupera las clasificaciones en caché que no han caducado. Es solo una lectura: los
+    aciertos se cuentan aparte, en bloque, con `add_classification_cache_hits`.
+
+    Args:
+        db: La sesión de la base de datos.
+        cache_keys: Las claves a buscar.
+
+    Returns:
+        Un diccionario clave -> clasificación con las entradas encontradas.
+    """
+    if not cache_keys:
+        return {}
+    entries = (
+        db.query(models.ClassificationCacheEntry)
+        .filter(
+            models.ClassificationCacheEntry.cache_key.in_(cache_keys),
+            models.ClassificationCacheEntry.expires_at > _utcnow(),
+        )
+        .all()
+    )
+    return {entry.cache_key: entry.classification for entry in entries}
+
+def add_classification_cache_hits(db: Session, hits: dict[str, int]) -> int:
+    """
+    Suma aciertos acumulados a las entradas de la caché de clasificaciones en una sola
+    transacción (una sentencia por cada número distinto de aciertos).
+
+    Args:
+        db: La sesión de la base de datos.
+        hits: Diccionario clave -> aciertos a sumar.
+
+    Returns:
+        El número de entradas actualizadas.
+    """
+    keys_by_count: dict[int, list[str]] = {}
+    for cache_key, count in hits.items():
+        if count > 0:
+            keys_by_count.setdefault(count, []).append(cache_key)
+    if not keys_by_count:
+        return 0
+    updated = 0
+    for count, cache_keys in keys_by_count.items():
+        updated += db.execute(
+            update(models.ClassificationCacheEntry)
+            .where(models.ClassificationCacheEntry.cache_key.in_(cache_keys))
+            .values(hit_count=func.coalesce(models.ClassificationCacheEntry.hit_count, 0) + count)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    db.commit()
+    return updated
+
+def save_cached_classifications(db: Session, entries: list[dict], ttl_seconds: float) -> int:
+    """
+    Guarda (o reemplaza) clasificaciones en la caché en una sola transacción.
+
+    Args:
+        db: La sesión de la base de datos.
+        entries: Diccionarios con cache_key, normalized_description, kb_version, model_id,
+            prompt_version y classification.
+        ttl_seconds: Segundos de validez de las entradas.
+
+    Returns:
+        El número de entradas guardadas.
+    """
+    expires_at = _utcnow() + timedelta(seconds=ttl_seconds)
+    for entry in entries:
+        db.merge(models.ClassificationCacheEntry(**entry, hit_count=0, expires_at=expires_at))
+    db.commit()
+    return len(entries)
+
+def invalidate_classification_cache(
+    db: Session,
+    kb_version: str | None = None,
+    model_id: str | None = None,
+    prompt_version: str | None = None,
+) -> int:
+    """
+    Elimina en bloque entradas de la caché de clasificaciones.
+
+    Sin argumentos vacía la caché. Con alguno de ellos, conserva solo las entradas que
+    coinciden con las versiones indicadas y sigan vigentes; el resto (de otra versión del
+    arancel, del modelo o del prompt, o caducadas) se elimina.
+
+    Returns:
+        El número de entradas eliminadas.
+    """
+    query = db.query(models.ClassificationCacheEntry)
+    conditions = [models.ClassificationCacheEntry.expires_at <= _utcnow()]
+    if kb_version is not None:
+        conditions.append(models.ClassificationCacheEntry.kb_version != kb_version)
+    if model_id is not None:
+        conditions.append(models.ClassificationCacheEntry.model_id != model_id)
+    if prompt_version is not None:
+        conditions.append(models.ClassificationCacheEntry.prompt_version != prompt_version)
+    if len(conditions) > 1:
+        query = query.filter(or_(*conditions))
+    deleted = query.delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def get_cached_extraction(db: Session, content_sha256: str, extractor_version: str) -> models.ExtractionCacheEntry | None:
+    """
+    Recupera la extracción guardada de un archivo para una versión del extractor.
+
+    Args:
+        db: La sesión de la base de datos.
+        content_sha256: La huella SHA-256 del archivo.
+        extractor_version: La versión del extractor.
+
+    Returns:
+        La entrada de la caché si existe, de lo contrario None.
+    """
+    return db.get(models.ExtractionCacheEntry, (content_sha256, extractor_version))
+
+def save_cached_extraction(
+    db: Session, content_sha256: str, extractor_version: str, raw_text: str, structured_data: dict
+) -> models.ExtractionCacheEntry:
+    """
+    Guarda (o reemplaza) el texto crudo y los datos validados extraídos de un archivo.
+
+    Returns:
+        La entrada de la caché guardada.
+    """
+    entry = db.merge(models.ExtractionCacheEntry(
+        content_sha256=content_sha256,
+        extractor_version=extractor_version,
+        raw_text=raw_text,
+        structured_data=structured_data,
+    ))
+    db.commit()
+    return entry
+
+
+def list_invoice_templates(db: Session, updated_after: datetime | None = None) -> list[models.InvoiceTemplate]:
+    """
+    Lista las plantillas de facturas, opcionalmente solo las actualizadas desde una fecha
+    (incluida, para no perder las guardadas en el mismo instante).
+
+    Returns:
+        Las plantillas ordenadas por fecha de actualización.
+    """
+    query = db.query(models.InvoiceTemplate)
+    if updated_after is not None:
+        query = query.filter(models.InvoiceTemplate.updated_at >= updated_after)
+    return query.order_by(models.InvoiceTemplate.updated_at).all()
+
+def save_invoice_template(
+    db: Session, template_id: int | None, seller_name: str | None, layout_tokens: list[str], rules: dict
+) -> models.InvoiceTemplate:
+    """
+    Crea una plantilla de factura o reemplaza la huella y las reglas de una existente.
+
+    Args:
+        db: La sesión de la base de datos.
+        template_id: El id de la plantilla a actualizar, o None para crear una nueva.
+        seller_name: El vendedor de las facturas con este diseño.
+        layout_tokens: La huella del diseño.
+        rules: Las reglas de extracción.
+
+    Returns:
+        La plantilla guardada.
+    """
+    template = db.get(models.InvoiceTemplate, template_id) if template_id is not None else None
+    if template is None:
+        template = models.InvoiceTemplate()
+        db.add(template)
+    template.seller_name = seller_name
+    template.layout_tokens = layout_tokens
+    template.rules = rules
+    template.updated_at = _utcnow()
+    db.commit()
+    db.refresh(template)
+    return template
+
+
+def enqueue_job(
+    db: Session,
+    kind: str,
+    payload: dict,
+    document_id: UUID | None = None,
+    priority: int = 0,
+    max_attempts: int = 3,
+) -> models.Job:
+    """
+    Encola un trabajo para los workers de procesamiento.
+
+    Args:
+        db: La sesión de la base de datos.
+        kind: El tipo de trabajo (ver `processing.worker.JOB_HANDLERS`).
+        payload: Los parámetros del trabajo (serializables a JSON).
+        document_id: El documento al que se refiere el trabajo, si lo hay.
+        priority: Los trabajos de mayor prioridad se entregan antes.
+        max_attempts: Intentos máximos antes de marcarlo como fallido.
+
+    Returns:
+        El trabajo encolado.
+    """
+    now = _utcnow()
+    job = models.Job(
+        kind=kind,
+        payload=payload,
+        document_id=document_id,
+        priority=priority,
+        max_attempts=max_attempts,
+        status="queued",
+        attempts=0,
+        available_at=now,
+        created_at=now,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def lease_next_job(db: Session, owner: str, lease_seconds: float, candidates: int = 10) -> models.Job | None:
+    """
+    Toma el siguiente trabajo disponible (mayor prioridad y más antiguo primero) con una
+    concesión de `lease_seconds`.
+
+    La toma es un UPDATE condicionado a que el trabajo siga en cola, así que si dos workers
+    eligen el mismo candidato solo uno lo consigue y el otro prueba con el siguiente.
+
+    Returns:
+        El trabajo concedido, o None si la cola está vacía.
+    """
+    now = _utcnow()
+    candidate_ids = [
+        job_id for (job_id,) in db.query(models.Job.id)
+        .filter(models.Job.status == "queued", models.Job.available_at <= now)
+        .order_by(models.Job.priority.desc(), models.Job.created_at, models.Job.id)
+        .limit(candidates)
+    ]
+    for job_id in candidate_ids:
+        result = db.execute(
+            update(models.Job)
+            .where(models.Job.id == job_id, models.Job.status == "queued")
+            .values(
+                status="leased",
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=models.Job.attempts + 1,
+            )
+        )
+        db.commit()
+        if result.rowcount == 1:
+            return db.get(models.Job, job_id, populate_existing=True)
+    return None
+
+def renew_job_lease(db: Session, job_id: int, owner: str, lease_seconds: float) -> bool:
+    """
+    Prolonga la concesión de un trabajo que el worker sigue procesando.
+
+    Returns:
+        False si el trabajo ya no pertenece a este worker (la concesión venció y se reasignó).
+    """
+    result = db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id, models.Job.status == "leased", models.Job.lease_owner == owner)
+        .values(lease_expires_at=_utcnow() + timedelta(seconds=lease_seconds))
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def complete_job(db: Session, job_id: int, owner: str) -> bool:
+    """Marca como terminado un trabajo concedido a `owner`."""
+    result = db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id, models.Job.status == "leased", models.Job.lease_owner == owner)
+        .values(status="succeeded", lease_owner=None, lease_expires_at=None, finished_at=_utcnow())
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def fail_job(db: Session, job_id: int, owner: str, error_message: str, retry_delay_seconds: float) -> str | None:
+    """
+    Registra el fallo de un intento. El trabajo vuelve a la cola tras `retry_delay_seconds`
+    si le quedan intentos, o queda como fallido.
+
+    Returns:
+        El nuevo estado del trabajo ("queued" o "failed"), o None si ya no pertenecía a `owner`.
+    """
+    job = db.get(models.Job, job_id, populate_existing=True)
+    if job is None or job.status != "leased" or job.lease_owner != owner:
+        return None
+    now = _utcnow()
+    job.last_error = error_message
+    job.lease_owner = None
+    job.lease_expires_at = None
+    if job.attempts < job.max_attempts:
+        job.status = "queued"
+        job.available_at = now + timedelta(seconds=retry_delay_seconds)
+    else:
+        job.status = "failed"
+        job.finished_at = now
+    db.commit()
+    return job.status
+
+def recover_expired_leases(db: Session) -> int:
+    """
+    Devuelve a la cola los trabajos cuya concesión venció (su worker murió o se colgó); los que
+    ya agotaron sus intentos quedan como fallidos.
+
+    Returns:
+        El número de trabajos recuperados o marcados como fallidos.
+    """
+    now = _utcnow()
+    expired = (models.Job.status == "leased", models.Job.lease_expires_at < now)
+    requeued = db.execute(
+        update(models.Job)
+        .where(*expired, models.Job.attempts < models.Job.max_attempts)
+        .values(status="queued", lease_owner=None, lease_expires_at=None, available_at=now,
+                last_error="La concesión del trabajo venció sin terminarlo.")
+    ).rowcount
+    failed = db.execute(
+        update(models.Job)
+        .where(*expired, models.Job.attempts >= models.Job.max_attempts)
+        .values(status="failed", lease_owner=None, lease_expires_at=None, finished_at=now,
+                last_error="La concesión del trabajo venció sin terminarlo y se agotaron los intentos.")
+    ).rowcount
+    db.commit()
+    return requeued + failed
+
+def get_job_queue_stats(db: Session) -> dict:
+    """
+    Profundidad y antigüedad de la cola de trabajos.
+
+    Returns:
+        El número de trabajos por estado, los listos para entregar (`ready`) y la antigüedad en
+        segundos del trabajo en cola más antiguo (`oldest_queued_age_seconds`).
+    """
+    now = _utcnow()
+    counts = dict(db.query(models.Job.status, func.count(models.Job.id)).group_by(models.Job.status).all())
+    ready = db.query(func.count(models.Job.id)).filter(
+        models.Job.status == "queued", models.Job.available_at <= now
+    ).scalar()
+    oldest = db.query(func.min(models.Job.created_at)).filter(models.Job.status == "queued").scalar()
+    return {
+        "by_status": {status: counts.get(status, 0) for status in ("queued", "leased", "succeeded", "failed")},
+        "ready": ready,
+        "oldest_queued_age_seconds": round((now - oldest).total_seconds(), 1) if oldest else None,
+    }
+
+
+def get_active_job(db: Session, kind: str) -> models.Job | None:
+    """Recupera el trabajo más antiguo de un tipo que está en cola o en proceso, si lo hay."""
+    return (
+        db.query(models.Job)
+        .filter(models.Job.kind == kind, models.Job.status.in_(("queued", "leased")))
+        .order_by(models.Job.id)
+        .first()
+    )
+
+def get_latest_document_job(db: Session, document_id: UUID) -> models.Job | None:
+    """Recupera el último trabajo encolado para un documento."""
+    return (
+        db.query(models.Job)
+        .filter(models.Job.document_id == document_id)
+        .order_by(models.Job.id.desc())
+        .first()
+    )
+
+def clear_stage_checkpoints(db: Session, document_id: UUID) -> int:
+    """
+    Elimina los checkpoints de un documento para reprocesarlo desde cero.
+
+    Returns:
+        El número de checkpoints eliminados.
+    """
+    deleted = db.query(models.StageCheckpoint).filter(
+        models.StageCheckpoint.document_id == document_id
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+class StageCheckpointStore:
+    """
+    Checkpoints por etapa de un documento en la tabla document_stage_checkpoints (implementa
+    `processing.pipeline.CheckpointStore`). Cada cambio se guarda con su propio commit para que
+    sobreviva a una caída del worker a mitad del pipeline.
+    """
+    def __init__(self, db: Session, document_id: UUID):
+        self.db = db
+        self.document_id = document_id
+
+    def _get(self, stage: str) -> models.StageCheckpoint | None:
+        return self.db.get(models.StageCheckpoint, (self.document_id, stage))
+
+    def load(self, stage: str, input_hash: str) -> tuple[bool, object]:
+        checkpoint = self._get(stage)
+        if checkpoint and checkpoint.status == "completed" and checkpoint.input_hash == input_hash:
+            return True, checkpoint.output
+        return False, None
+
+    def start(self, stage: str, input_hash: str) -> None:
+        checkpoint = self._get(stage)
+        if checkpoint is None:
+            checkpoint = models.StageCheckpoint(document_id=self.document_id, stage=stage, attempts=0)
+            self.db.add(checkpoint)
+        elif checkpoint.input_hash != input_hash:
+            # Entradas distintas: es otra ejecución de la etapa, los intentos anteriores no cuentan.
+            checkpoint.attempts = 0
+        checkpoint.input_hash = input_hash
+        checkpoint.status = "running"
+        checkpoint.output = None
+        checkpoint.attempts += 1
+        checkpoint.updated_at = _utcnow()
+        self.db.commit()
+
+    def complete(self, stage: str, input_hash: str, output: object) -> None:
+        checkpoint = self._get(stage)
+        checkpoint.status = "completed"
+        checkpoint.output = output
+        checkpoint.last_error = None
+        checkpoint.updated_at = _utcnow()
+        self.db.commit()
+
+    def fail(self, stage: str, input_hash: str, error: str, transient: bool) -> None:
+        if not self.db.is_active:
+            # El error de la etapa dejó la transacción inutilizable (p. ej. un error de la base de datos).
+            self.db.rollback()
+        checkpoint = self._get(stage)
+        checkpoint.status = "retryable" if transient else "failed"
+        checkpoint.last_error = error
+        checkpoint.updated_at = _utcnow()
+        self.db.commit()
+
+
+def save_worker_metrics(db: Session, owner: str, snapshot: dict) -> None:
+    """Guarda (o reemplaza) los contadores publicados por un worker."""
+    db.merge(models.WorkerMetrics(owner=owner, snapshot=snapshot, updated_at=_utcnow()))
+    db.commit()
+
+def list_worker_metrics(db: Session, max_age_seconds: float) -> list[models.WorkerMetrics]:
+    """Lista los contadores que los workers publicaron en los últimos `max_age_seconds`."""
+    return (
+        db.query(models.WorkerMetrics)
+        .filter(models.WorkerMetrics.updated_at >= _utcnow() - timedelta(seconds=max_age_seconds))
+        .order_by(models.WorkerMetrics.updated_at)
+        .all()
+    )
+
+def delete_stale_worker_metrics(db: Session, max_age_seconds: float) -> int:
+    """
+    Elimina los contadores de los workers que no publican desde hace `max_age_seconds`
+    (procesos terminados).
+
+    Returns:
+        El número de filas eliminadas.
+    """
+    deleted = (
+        db.query(models.WorkerMetrics)
+        .filter(models.WorkerMetrics.updated_at < _utcnow() - timedelta(seconds=max_age_seconds))
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
@@ -0,0 +1,61 @@
+"""
+Línea de comandos para la base de conocimiento del arancel.
+
+Permite construirla antes de que llegue tráfico (p. ej. en el despliegue):
+    python -m knowledge build             # reconstruye (incremental) y publica una nueva versión
+    python -m knowledge build --if-missing  # solo si aún no hay ninguna versión publicada
+
+Y arrancar el servicio de recuperación compartido por los workers:
+    python -m knowledge serve --socket /tmp/robodocai-kb.sock
+"""
+import argparse
+import json
+import sys
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m knowledge", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    build = subcommands.add_parser("build", help="Construye y publica la base de conocimiento.")
+    build.add_argument("--if-missing", action="store_true", help="No reconstruir si ya hay una versión publicada.")
+    build.add_argument("--wait", type=float, default=None,
+                       help="Segundos máximos de espera si otro proceso está construyendo (por defecto, sin límite).")
+    serve = subcommands.add_parser("serve", help="Atiende búsquedas de todos los workers en un socket Unix.")
+    serve.add_argument("--socket", default=None, help="Ruta del socket (por defecto, KB_RETRIEVAL_SOCKET).")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        from core.config import settings
+        from knowledge.retrieval_server import serve as serve_retrieval
+
+        socket_path = args.socket or settings.kb_retrieval_socket
+        if not socket_path:
+            print("[-] Indica --socket o configura KB_RETRIEVAL_SOCKET.", file=sys.stderr)
+            return 1
+        serve_retrieval(
+            socket_path,
+            max_batch_size=settings.kb_retrieval_max_batch_size,
+            max_wait_ms=settings.kb_retrieval_max_wait_ms,
+        )
+        return 0
+
+    # Importación diferida: cargar el agente inicializa la configuración de la aplicación.
+    from agents.knowledge_agent import build_knowledge_base
+    from knowledge.build_lock import KnowledgeBaseUnavailableError
+
+    try:
+        stats = build_knowledge_base(force=not args.if_missing, wait_seconds=args.wait)
+    except (FileNotFoundError, KnowledgeBaseUnavailableError) as e:
+        print(f"[-] {e}", file=sys.stderr)
+        return 1
+
+    if stats is None:
+        print("[+] La base de conocimiento ya estaba publicada; no se reconstruyó.")
+    else:
+        print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Coordinación entre procesos para la construcción de la base de conocimiento.
+
+Un candado de archivo (`flock`) garantiza que un solo proceso construya a la vez; el resto
+espera a que termine o, si se agota la espera, recibe KnowledgeBaseUnavailableError para
+responder de forma degradada. Cada construcción se escribe en un directorio propio que se
+publica cambiando de forma atómica el enlace simbólico `current`.
+"""
+import fcntl
+import os
+import shutil
+import time
+from typing import Optional
+
+
+class KnowledgeBaseUnavailableError(RuntimeError):
+    """La base de conocimiento no existe todavía y otro proceso la está construyendo."""
+
+
+class BuildLock:
+    """
+    Candado exclusivo entre procesos basado en `fcntl.flock` sobre un archivo.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self, timeout: Optional[float] = None, poll_interval: float = 0.5) -> bool:
+        """
+        Intenta adquirir el candado.
+
+        Args:
+            timeout: Segundos máximos de espera. 0 = no esperar; None = esperar indefinidamente.
+            poll_interval: Intervalo entre intentos mientras se espera.
+
+        Returns:
+            True si se adquirió el candado, False si se agotó la espera.
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._fd = fd
+                os.ftruncate(fd, 0)
+                os.write(fd, str(os.getpid()).encode())
+                return True
+            except BlockingIOError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    os.close(fd)
+                    return False
+                time.sleep(poll_interval)
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "BuildLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def publish_build(build_dir: str, current_link: str) -> None:
+    """
+    Publica un directorio de construcción apuntando a él el enlace `current`.
+
+    El enlace nuevo se crea con un nombre temporal y se renombra sobre el anterior, de modo
+    que los lectores ven siempre una versión completa: la anterior o la nueva.
+    """
+    tmp_link = f"{current_link}.{os.getpid()}.tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    # Enlace relativo para que el directorio `kb/` pueda moverse sin romperlo.
+    os.symlink(os.path.relpath(build_dir, os.path.dirname(current_link)), tmp_link)
+    os.replace(tmp_link, current_link)
+
+
+def cleanup_old_builds(builds_dir: str, current_link: str, keep: int = 2) -> None:
+    """
+    Elimina los directorios de construcción antiguos, conservando los `keep` más recientes
+    y siempre el publicado. Los procesos que aún tengan archivos abiertos (mmap) de una
+    versión borrada siguen leyéndolos sin problema hasta que los cierran.
+    """
+    if not os.path.isdir(builds_dir):
+        return
+    current = os.path.realpath(current_link) if os.path.lexists(current_link) else None
+    builds = sorted(
+        (os.path.join(builds_dir, name) for name in os.listdir(builds_dir)),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for path in builds[keep:]:
+        if os.path.realpath(path) != current:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,160 @@
+"""
+Etapas del pipeline de construcción de la base de conocimiento.
+
+    1. `extract_pages`: extrae el texto de un PDF por rangos de páginas en un pool de procesos
+       y entrega las páginas en orden, a medida que llegan.
+    2. `iter_paragraph_chunks`: divide ese flujo de páginas en párrafos sin reunir el texto completo.
+    3. `ParallelEncoder`: vectoriza lotes de fragmentos de tamaño fijo en uno o varios procesos.
+
+Cada etapa mantiene acotado el trabajo en vuelo, de modo que la memoria máxima no depende
+del número de páginas del documento.
+"""
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import numpy as np
+from pypdf import PdfReader
+
+from processing.page_ranges import iter_page_ranges
+
+
+def _extract_page_range(pdf_file: str, start: int, end: int) -> List[str]:
+    """Extrae el texto de las páginas [start, end) de un PDF (se ejecuta en un proceso del pool)."""
+    reader = PdfReader(pdf_file)
+    pages = []
+    for page in reader.pages[start:end]:
+        # `extract_text` se llama una sola vez por página.
+        pages.append(page.extract_text() or "")
+    return pages
+
+
+def extract_pages(pdf_file: str, workers: int = 4, pages_per_task: int = 16) -> Iterator[str]:
+    """
+    Extrae el texto de un PDF página a página, repartiendo rangos de páginas entre procesos.
+
+    Las páginas se entregan en orden. Como máximo hay `2 * workers` rangos en vuelo, así que
+    solo esa cantidad de páginas puede estar esperando en memoria.
+
+    Args:
+        pdf_file: Ruta del PDF.
+        workers: Número de procesos extractores (1 = en el proceso actual).
+        pages_per_task: Páginas por tarea enviada al pool.
+
+    Yields:
+        El texto de cada página (cadena vacía si la página no tiene texto).
+    """
+    num_pages = len(PdfReader(pdf_file).pages)
+    return iter_page_ranges(pdf_file, num_pages, workers, pages_per_task, _extract_page_range)
+
+
+def iter_paragraph_chunks(pages: Iterable[str]) -> Iterator[str]:
+    """
+    Divide un flujo de páginas en párrafos (bloques separados por una línea en blanco).
+
+    Equivale a unir las páginas con "\\n" y separar por "\\n\\n", pero solo retiene en memoria
+    el párrafo que aún no se ha cerrado.
+    """
+    buffer: Optional[str] = None
+    for page_text in pages:
+        if not page_text:
+            continue
+        buffer = page_text if buffer is None else buffer + "\n" + page_text
+        *complete, buffer = buffer.split("\n\n")
+        for chunk in complete:
+            if chunk.strip():
+                yield chunk.strip()
+    if buffer and buffer.strip():
+        yield buffer.strip()
+
+
+_worker_model = None
+
+
+def _init_encoder_worker(model_name: str, torch_threads: int) -> None:
+    """Carga el modelo una sola vez por proceso del pool y limita sus hilos de torch."""
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(torch_threads)
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return np.asarray(_worker_model.encode(texts, batch_size=64), dtype=np.float32)
+
+
+class ParallelEncoder:
+    """
+    Vectoriza lotes de textos con uno o varios procesos, cada uno con su propia copia del modelo.
+
+    Con `workers <= 1` el modelo se carga (de forma perezosa) en el proceso actual.
+    """
+    def __init__(self, model_name: str, workers: int = 1):
+        self.model_name = model_name
+        self.workers = workers
+        self._model = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def submit(self, texts: List[str]) -> Future:
+        """Programa la vectorización de un lote y devuelve un Future con la matriz float32."""
+        if self.workers <= 1:
+            future: Future = Future()
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                print(f"[+] (KnowledgeAgent) Cargando el modelo de embedding '{self.model_name}'...")
+                self._model = SentenceTransformer(self.model_name)
+            future.set_result(np.asarray(self._model.encode(texts, batch_size=64), dtype=np.float32))
+            return future
+
+        if self._executor is None:
+            torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+            print(f"[+] (KnowledgeAgent) Iniciando {self.workers} procesos de embedding ({torch_threads} hilos cada uno)...")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_encoder_worker,
+                initargs=(self.model_name, torch_threads),
+            )
+        return self._executor.submit(_encode_in_worker, texts)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Agrupa un iterable en listas de `size` elementos (la última puede ser más corta)."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BuildProgress:
+    """Contadores de progreso y throughput de una construcción."""
+    def __init__(self, report: Callable[[str], None] = print):
+        self.report = report
+        self.started_at = time.perf_counter()
+        self.pages = 0
+        self.chunks = 0
+        self.embedded = 0
+
+    def count_pages(self, pages: Iterable[str]) -> Iterator[str]:
+        for page in pages:
+            self.pages += 1
+            yield page
+
+    def log(self) -> None:
+        elapsed = max(time.perf_counter() - self.started_at, 1e-9)
+        self.report(
+            f"[+] (KnowledgeAgent) Progreso: {self.pages} páginas, {self.chunks} fragmentos, "
+            f"{self.embedded} embeddings nuevos en {elapsed:.1f} s "
+            f"({self.pages / elapsed:.1f} páginas/s, {self.chunks / elapsed:.1f} fragmentos/s)."
+        )
@@ -0,0 +1,115 @@
+"""
+Almacén de fragmentos de texto en disco, leído mediante `mmap`.
+
+El formato son dos archivos:
+    - un blob con todos los fragmentos concatenados en UTF-8;
+    - un array de offsets (int64, n + 1 entradas) en formato `.npy`, donde el fragmento i
+      ocupa los bytes [offsets[i], offsets[i + 1]) del blob.
+
+Varios procesos que abren el mismo almacén comparten las páginas de la caché del sistema
+operativo, y solo se decodifican a `str` los fragmentos que realmente se consultan.
+"""
+import mmap
+import os
+import numpy as np
+from typing import Iterable, List
+
+
+def offsets_path_for(blob_file: str) -> str:
+    """Ruta del archivo de offsets que acompaña a un blob de fragmentos."""
+    return os.path.splitext(blob_file)[0] + '.offsets.npy'
+
+
+class ChunkStoreWriter:
+    """
+    Escribe un almacén de fragmentos de forma incremental. Los datos van a archivos
+    temporales y solo se publican (con `os.replace`) al llamar a `commit`.
+    """
+    def __init__(self, blob_file: str):
+        self.blob_file = blob_file
+        self.offsets_file = offsets_path_for(blob_file)
+        self._blob = open(blob_file + '.tmp', 'wb')
+        self._offsets = [0]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def append(self, chunk: str) -> int:
+        """Añade un fragmento y devuelve su id."""
+        data = chunk.encode('utf-8')
+        self._blob.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        return len(self._offsets) - 2
+
+    def commit(self) -> int:
+        """
+        Publica el almacén de forma atómica.
+
+        Returns:
+            El número de fragmentos escritos.
+        """
+        self._blob.close()
+        # `np.save` añade la extensión si no está presente, por eso se abre el archivo explícitamente.
+        with open(self.offsets_file + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(self._offsets, dtype=np.int64))
+        os.replace(self.blob_file + '.tmp', self.blob_file)
+        os.replace(self.offsets_file + '.tmp', self.offsets_file)
+        return len(self)
+
+    def abort(self) -> None:
+        """Descarta los archivos temporales sin tocar el almacén publicado."""
+        self._blob.close()
+        for path in (self.blob_file + '.tmp', self.offsets_file + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def write_chunk_store(blob_file: str, text_chunks: Iterable[str]) -> int:
+    """
+    Escribe los fragmentos en formato blob + offsets de forma atómica.
+
+    Returns:
+        El número de fragmentos escritos.
+    """
+    writer = ChunkStoreWriter(blob_file)
+    try:
+        for chunk in text_chunks:
+            writer.append(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
+
+
+class ChunkStore:
+    """
+    Vista de solo lectura sobre un almacén de fragmentos. Se comporta como una secuencia de `str`.
+    """
+    def __init__(self, blob_file: str):
+        self.blob_file = blob_file
+        self._offsets = np.load(offsets_path_for(blob_file), mmap_mode='r')
+
+        with open(blob_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            # mmap no admite archivos vacíos.
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        if int(self._offsets[-1]) != size:
+            raise RuntimeError(
+                f"Los offsets de '{os.path.basename(blob_file)}' no corresponden al tamaño del blob en disco."
+            )
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._blob[start:end].decode('utf-8')
+
+    def get_many(self, ids: Iterable[int]) -> List[str]:
+        """Decodifica únicamente los fragmentos indicados."""
+        return [self[i] for i in ids]
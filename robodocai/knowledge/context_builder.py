@@ -0,0 +1,116 @@
+"""
+Construcción del contexto del arancel que se envía al LLM, acotado por un presupuesto de tokens.
+
+Los fragmentos recuperados son párrafos completos de longitud arbitraria y pueden solaparse
+(el mismo texto llega por la búsqueda por código y por la vectorial). Esta etapa:
+
+    1. ordena los fragmentos por distancia (los de búsqueda exacta por código van primero);
+    2. descarta los duplicados y los contenidos en otro fragmento ya elegido;
+    3. recorta cada fragmento a su encabezado y las frases que comparten términos con la
+       descripción del producto, sin repetir frases ya incluidas;
+    4. añade fragmentos en ese orden hasta agotar el presupuesto de tokens.
+
+Los tokens se estiman (≈4 caracteres por token) para no depender del tokenizador del proveedor.
+"""
+import re
+import unicodedata
+from typing import List, NamedTuple, Sequence, Tuple
+
+CHARS_PER_TOKEN = 4
+
+# Palabras vacías que no aportan relevancia al comparar descripciones con el arancel.
+_STOPWORDS = {
+    "con", "sin", "para", "por", "los", "las", "del", "que", "una", "uno", "unos", "unas",
+    "sus", "como", "demas", "otros", "otras", "incluso", "partes", "the", "and", "for", "with",
+}
+_SENTENCE_SPLIT = re.compile(r"(?<=[.;:])\s+")
+
+
+class CompactContext(NamedTuple):
+    chunks: List[str]
+    tokens_before: int
+    tokens_after: int
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación del número de tokens de un texto."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _terms(text: str) -> set:
+    """Términos comparables: sin tildes, en minúsculas y truncados a 5 letras (singular/plural, género)."""
+    ascii_text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode()
+    return {word[:5] for word in re.findall(r"[a-z]{3,}", ascii_text) if word not in _STOPWORDS}
+
+
+def _sentences(chunk: str) -> List[str]:
+    """Divide un fragmento en líneas y, las líneas largas, en frases."""
+    sentences = []
+    for line in chunk.splitlines():
+        sentences.extend(part.strip() for part in _SENTENCE_SPLIT.split(line) if part.strip())
+    return sentences
+
+
+def _normalize_sentence(sentence: str) -> str:
+    return re.sub(r"\s+", " ", sentence).strip().lower()
+
+
+def build_context(query: str, scored_chunks: Sequence[Tuple[str, float]], token_budget: int) -> CompactContext:
+    """
+    Compacta los fragmentos recuperados para una descripción de producto.
+
+    Args:
+        query: La descripción del producto.
+        scored_chunks: Tuplas (fragmento, distancia). Los fragmentos de búsqueda exacta por
+            código llevan distancia 0 y se conservan enteros (salvo frases repetidas).
+        token_budget: Máximo de tokens (estimados) del contexto resultante.
+
+    Returns:
+        Los fragmentos compactados, en orden de relevancia, y los tokens antes y después.
+    """
+    tokens_before = sum(estimate_tokens(chunk) for chunk, _ in scored_chunks)
+    query_terms = _terms(query)
+
+    ranked = sorted(scored_chunks, key=lambda scored: scored[1])
+    kept_chunks: List[str] = []
+    for chunk, distance in ranked:
+        normalized = _normalize_sentence(chunk)
+        if any(normalized in _normalize_sentence(kept) for kept in kept_chunks):
+            continue
+        kept_chunks.append(chunk)
+    distances = dict((chunk, distance) for chunk, distance in reversed(ranked))
+
+    compacted: List[str] = []
+    seen_sentences = set()
+    remaining = token_budget
+    for chunk in kept_chunks:
+        sentences = _sentences(chunk)
+        if not sentences:
+            continue
+        exact_match = distances[chunk] <= 0.0
+        # Se conserva el encabezado (primera línea) y las frases que comparten términos con la consulta.
+        selected = [
+            sentence for position, sentence in enumerate(sentences)
+            if exact_match or position == 0 or _terms(sentence) & query_terms
+        ]
+
+        text = ""
+        for sentence in selected:
+            key = _normalize_sentence(sentence)
+            if key in seen_sentences:
+                continue
+            candidate = f"{text}\n{sentence}" if text else sentence
+            if estimate_tokens(candidate) > remaining:
+                break
+            text = candidate
+            seen_sentences.add(key)
+        if not text and not compacted and selected:
+            # El fragmento más relevante siempre aporta algo, aunque haya que cortarlo.
+            text = selected[0][:remaining * CHARS_PER_TOKEN]
+        if text:
+            compacted.append(text)
+            remaining -= estimate_tokens(text)
+        if remaining <= 0:
+            break
+
+    return CompactContext(compacted, tokens_before, sum(estimate_tokens(chunk) for chunk in compacted))
@@ -0,0 +1,71 @@
+"""
+Caché persistente de embeddings para la base de conocimiento.
+
+Cada embedding se guarda con una clave derivada del texto del fragmento y del nombre del
+modelo, de modo que una reconstrucción solo vectoriza los fragmentos nuevos o modificados.
+"""
+import hashlib
+import sqlite3
+import numpy as np
+from typing import Dict, Iterable, List
+
+
+def chunk_key(text: str, model_name: str) -> str:
+    """Clave de caché de un fragmento: SHA-256 del nombre del modelo y del texto."""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Almacén clave -> embedding (float32) respaldado por un archivo SQLite local.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Devuelve los embeddings en caché para las claves dadas (las ausentes se omiten)."""
+        found: Dict[str, np.ndarray] = {}
+        keys = list(dict.fromkeys(keys))
+        # SQLite limita el número de parámetros por consulta.
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, keys: List[str], vectors: np.ndarray) -> None:
+        """Guarda (o reemplaza) los embeddings de las claves dadas."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)",
+            ((key, vector.shape[0], vector.tobytes()) for key, vector in zip(keys, vectors)),
+        )
+        self._conn.commit()
+
+    def retain_only(self, keys: Iterable[str]) -> int:
+        """
+        Elimina de la caché todas las entradas cuya clave no esté en `keys`.
+
+        Returns:
+            El número de entradas eliminadas.
+        """
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS live_keys (key TEXT PRIMARY KEY)")
+        self._conn.execute("DELETE FROM live_keys")
+        self._conn.executemany("INSERT OR IGNORE INTO live_keys (key) VALUES (?)", ((key,) for key in keys))
+        removed = self._conn.execute(
+            "DELETE FROM embeddings WHERE key NOT IN (SELECT key FROM live_keys)"
+        ).rowcount
+        self._conn.commit()
+        return removed
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,134 @@
+"""
+Backends para vectorizar las consultas al arancel.
+
+    - "torch": el SentenceTransformer de referencia en PyTorch.
+    - "onnx": el mismo transformer exportado a ONNX y ejecutado con onnxruntime.
+    - "onnx_int8": la exportación ONNX con cuantización dinámica int8 de los pesos.
+
+Todos devuelven embeddings float32 normalizados (pooling por media + L2), igual que
+all-MiniLM-L6-v2, así que son intercambiables frente al mismo índice. Las exportaciones se
+guardan en `kb/encoders/<modelo>/` y se generan la primera vez que se necesitan.
+"""
+import os
+from typing import List
+
+import numpy as np
+
+ENCODER_BACKENDS = ("torch", "onnx", "onnx_int8")
+
+ONNX_MODEL_FILENAME = "model.onnx"
+ONNX_INT8_MODEL_FILENAME = "model.int8.onnx"
+
+
+class TorchEncoder:
+    """Encoder de referencia: SentenceTransformer en PyTorch."""
+    backend = "torch"
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, batch_size=max(1, len(texts))), dtype=np.float32)
+
+
+def export_onnx(model_name: str, output_dir: str) -> str:
+    """
+    Exporta el transformer del modelo a ONNX (con ejes dinámicos de lote y secuencia) junto a
+    su tokenizador, y genera además la variante cuantizada int8.
+
+    Requiere `onnx` (lo usa `onnxruntime.quantization`) y `onnxscript` (lo importa
+    `torch.onnx.export` en las versiones actuales de torch).
+
+    Returns:
+        El directorio con los artefactos exportados.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    print(f"[+] (KnowledgeAgent) Exportando '{model_name}' a ONNX en '{output_dir}'...")
+    os.makedirs(output_dir, exist_ok=True)
+    sentence_model = SentenceTransformer(model_name, device="cpu")
+    transformer = sentence_model[0].auto_model
+    tokenizer = sentence_model.tokenizer
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["ejemplo de consulta"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    onnx_path = os.path.join(output_dir, ONNX_MODEL_FILENAME)
+    transformer.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            onnx_path + ".tmp",
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    os.replace(onnx_path + ".tmp", onnx_path)
+
+    int8_path = os.path.join(output_dir, ONNX_INT8_MODEL_FILENAME)
+    quantize_dynamic(onnx_path, int8_path + ".tmp", weight_type=QuantType.QInt8)
+    os.replace(int8_path + ".tmp", int8_path)
+    return output_dir
+
+
+class OnnxEncoder:
+    """
+    Encoder ONNX: tokenizador de Hugging Face + onnxruntime en CPU, con pooling por media y
+    normalización L2 en numpy.
+    """
+    def __init__(self, model_name: str, export_dir: str, quantized: bool = False, max_seq_length: int = 256):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.backend = "onnx_int8" if quantized else "onnx"
+        filename = ONNX_INT8_MODEL_FILENAME if quantized else ONNX_MODEL_FILENAME
+        model_path = os.path.join(export_dir, filename)
+        if not os.path.exists(model_path):
+            export_onnx(model_name, export_dir)
+
+        self.max_seq_length = max_seq_length
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+        )
+        inputs = {name: tokens[name].astype(np.int64) for name in self._input_names if name in tokens}
+        if "token_type_ids" in self._input_names and "token_type_ids" not in inputs:
+            inputs["token_type_ids"] = np.zeros_like(inputs["input_ids"])
+        (hidden_states,) = self.session.run(["last_hidden_state"], inputs)
+
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden_states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+def create_encoder(backend: str, model_name: str, encoders_dir: str):
+    """
+    Crea el encoder de consultas para el backend indicado.
+
+    Args:
+        backend: Uno de ENCODER_BACKENDS.
+        model_name: Nombre del modelo de sentence-transformers.
+        encoders_dir: Directorio donde se guardan (o se generan) las exportaciones ONNX.
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Backend de encoder desconocido '{backend}'. Opciones válidas: {', '.join(ENCODER_BACKENDS)}.")
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    export_dir = os.path.join(encoders_dir, model_name.replace("/", "__"))
+    return OnnxEncoder(model_name, export_dir, quantized=backend == "onnx_int8")
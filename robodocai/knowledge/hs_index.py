@@ -0,0 +1,116 @@
+"""
+Índice de búsqueda exacta por código arancelario (HS Code).
+
+Durante la construcción de la base de conocimiento se detectan las filas del arancel que
+empiezan por un código (capítulo.partida, subpartida...) y se guarda una lista ordenada
+código -> fragmento. Las consultas por código se resuelven con búsqueda binaria sobre esa
+lista, sin vectorizar nada.
+"""
+import bisect
+import json
+import os
+import re
+from typing import Iterable, List, Optional
+
+# Filas del arancel que comienzan por un código: "85.42", "8542.31", "8542.31.00.00".
+_TARIFF_ROW_CODE = re.compile(r"^\s*(\d{2}\.\d{2}|\d{4}(?:\.\d{2}){1,3})\b", re.MULTILINE)
+
+# Códigos dentro de texto libre: solo con puntos y al menos la subpartida ("8542.31",
+# "8542.31.00.00"). Los números sin puntos (referencias, modelos, SKU) y los importes como
+# "85.42" no se toman por códigos; un código sin puntos solo se acepta del campo `hs_code`.
+_TEXT_CODE = re.compile(r"(?<![\d.])(\d{4}\.\d{2}(?:\.\d{2}){0,2})(?![\d.])")
+
+# Longitudes válidas de un código normalizado: partida, subpartida y desdoblamientos nacionales.
+VALID_CODE_LENGTHS = (4, 6, 8, 10)
+
+
+def normalize_hs_code(code: Optional[str]) -> Optional[str]:
+    """
+    Deja solo los dígitos de un código HS. Devuelve None si no tiene una longitud válida.
+    """
+    if not code:
+        return None
+    digits = re.sub(r"\D", "", str(code))
+    return digits if len(digits) in VALID_CODE_LENGTHS else None
+
+
+def find_hs_codes(text: str) -> List[str]:
+    """Devuelve los códigos HS normalizados que aparecen con puntos en un texto libre."""
+    codes = (normalize_hs_code(match) for match in _TEXT_CODE.findall(text or ""))
+    return [code for code in codes if code]
+
+
+class HSCodeIndex:
+    """
+    Lista ordenada de (código, id de fragmento) con búsqueda por prefijo en O(log n).
+    """
+    def __init__(self, codes: List[str], chunk_ids: List[int]):
+        self.codes = codes
+        self.chunk_ids = chunk_ids
+
+    @staticmethod
+    def entries_for_chunk(chunk_id: int, chunk: str) -> set:
+        """Devuelve las entradas (código, id de fragmento) de las filas con código de un fragmento."""
+        entries = set()
+        for match in _TARIFF_ROW_CODE.findall(chunk):
+            code = normalize_hs_code(match)
+            if code:
+                entries.add((code, chunk_id))
+        return entries
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[tuple]) -> "HSCodeIndex":
+        ordered = sorted(set(entries))
+        return cls([code for code, _ in ordered], [chunk_id for _, chunk_id in ordered])
+
+    @classmethod
+    def from_chunks(cls, text_chunks: Iterable[str]) -> "HSCodeIndex":
+        entries = set()
+        for chunk_id, chunk in enumerate(text_chunks):
+            entries |= cls.entries_for_chunk(chunk_id, chunk)
+        return cls.from_entries(entries)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def _prefix_range(self, prefix: str) -> tuple[int, int]:
+        lo = bisect.bisect_left(self.codes, prefix)
+        # Los códigos solo contienen dígitos, así que ":" (siguiente a "9") acota el prefijo.
+        hi = bisect.bisect_left(self.codes, prefix + ":", lo)
+        return lo, hi
+
+    def lookup(self, code: str, k: int = 5) -> tuple[List[int], Optional[str]]:
+        """
+        Busca los fragmentos asociados a un código HS.
+
+        Si el código completo no existe en el arancel, se recorta de dos en dos dígitos
+        (subpartida -> partida) hasta encontrar coincidencias.
+
+        Returns:
+            Una tupla (ids de fragmentos, prefijo con el que se encontraron). Si no hay
+            coincidencias devuelve ([], None).
+        """
+        normalized = normalize_hs_code(code)
+        if not normalized:
+            return [], None
+        for length in range(len(normalized), 3, -2):
+            prefix = normalized[:length]
+            lo, hi = self._prefix_range(prefix)
+            if lo < hi:
+                chunk_ids = list(dict.fromkeys(self.chunk_ids[lo:hi]))
+                return chunk_ids[:k], prefix
+        return [], None
+
+    def save(self, path: str) -> None:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({"codes": self.codes, "chunk_ids": self.chunk_ids}, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> "HSCodeIndex":
+        """Carga el índice desde disco; si no existe devuelve un índice vacío."""
+        if not os.path.exists(path):
+            return cls([], [])
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data["codes"], data["chunk_ids"])
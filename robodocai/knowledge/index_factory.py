@@ -0,0 +1,277 @@
+"""
+Fábrica de índices FAISS para la base de conocimiento del arancel.
+
+Permite elegir entre búsqueda exacta (flat) y varios índices aproximados (IVF-Flat,
+IVF-PQ y HNSW), y cómo se almacena cada vector: float32, float16, int8 (cuantización
+escalar) o PQ (cuantización por producto). Los parámetros con los que se construyó el
+índice se guardan en un archivo JSON junto a él, para que las consultas usen los mismos
+valores (nprobe, efSearch).
+"""
+import json
+import os
+import faiss
+import numpy as np
+from typing import Iterable, Optional
+
+from core.config import settings
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+VECTOR_ENCODINGS = ("float32", "float16", "int8", "pq")
+
+_SCALAR_QUANTIZER_TYPES = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# FAISS recomienda al menos ~39 puntos de entrenamiento por centroide.
+MIN_TRAINING_POINTS_PER_CENTROID = 39
+# Muestra usada para calcular los rangos de la cuantización escalar int8.
+SCALAR_QUANTIZER_TRAINING_POINTS = 10_000
+# Tamaño supuesto del corpus cuando se construye a partir de un flujo de longitud desconocida.
+MAX_STREAMED_VECTORS = 2 ** 31 - 1
+
+
+def index_params_from_settings() -> dict:
+    """
+    Devuelve el tipo de índice y sus parámetros según la configuración de la aplicación.
+    """
+    return {
+        "index_type": settings.kb_index_type,
+        "encoding": settings.kb_vector_encoding,
+        "nlist": settings.kb_ivf_nlist,
+        "nprobe": settings.kb_ivf_nprobe,
+        "pq_m": settings.kb_pq_m,
+        "pq_nbits": settings.kb_pq_nbits,
+        "hnsw_m": settings.kb_hnsw_m,
+        "ef_construction": settings.kb_hnsw_ef_construction,
+        "ef_search": settings.kb_hnsw_ef_search,
+    }
+
+
+def _effective_nlist(requested_nlist: int, num_vectors: int) -> int:
+    """Reduce `nlist` si no hay suficientes vectores para entrenar todos los centroides."""
+    return max(1, min(requested_nlist, num_vectors // MIN_TRAINING_POINTS_PER_CENTROID))
+
+
+def new_index(dim: int, num_vectors: int, index_type: str = "flat", encoding: str = "float32", **params) -> tuple[faiss.Index, dict]:
+    """
+    Crea un índice FAISS vacío (sin entrenar) del tipo y codificación indicados.
+
+    Args:
+        dim: Dimensión de los embeddings.
+        num_vectors: Número total de vectores que se añadirán (para dimensionar IVF).
+        index_type: Uno de INDEX_TYPES.
+        encoding: Uno de VECTOR_ENCODINGS. IVF-PQ siempre usa "pq".
+        **params: Parámetros del índice (ver `index_params_from_settings`).
+
+    Returns:
+        Una tupla (índice, metadatos). Los metadatos describen el índice realmente construido
+        y deben guardarse con `save_index_metadata`.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido '{index_type}'. Opciones válidas: {', '.join(INDEX_TYPES)}.")
+    if index_type == "ivf_pq":
+        encoding = "pq"
+    if encoding not in VECTOR_ENCODINGS:
+        raise ValueError(f"Codificación desconocida '{encoding}'. Opciones válidas: {', '.join(VECTOR_ENCODINGS)}.")
+
+    metadata = {"index_type": index_type, "encoding": encoding, "dim": dim, "ntotal": num_vectors, "params": {}}
+
+    if encoding == "pq":
+        pq_m = params.get("pq_m", settings.kb_pq_m)
+        pq_nbits = params.get("pq_nbits", settings.kb_pq_nbits)
+        if dim % pq_m != 0:
+            raise ValueError(f"pq_m ({pq_m}) debe dividir la dimensión de los embeddings ({dim}).")
+        if num_vectors < 2 ** pq_nbits:
+            raise ValueError(
+                f"PQ con {pq_nbits} bits necesita al menos {2 ** pq_nbits} vectores de entrenamiento "
+                f"(hay {num_vectors})."
+            )
+        metadata["params"].update({"pq_m": pq_m, "pq_nbits": pq_nbits})
+
+    if index_type == "flat":
+        if encoding == "float32":
+            index = faiss.IndexFlatL2(dim)
+        elif encoding == "pq":
+            index = faiss.IndexPQ(dim, pq_m, pq_nbits)
+        else:
+            index = faiss.IndexScalarQuantizer(dim, _SCALAR_QUANTIZER_TYPES[encoding], faiss.METRIC_L2)
+
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _effective_nlist(params.get("nlist", settings.kb_ivf_nlist), num_vectors)
+        nprobe = min(params.get("nprobe", settings.kb_ivf_nprobe), nlist)
+        quantizer = faiss.IndexFlatL2(dim)
+        if encoding == "float32":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+        elif encoding == "pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dim, nlist, _SCALAR_QUANTIZER_TYPES[encoding], faiss.METRIC_L2
+            )
+        metadata["params"].update({"nlist": nlist, "nprobe": nprobe})
+
+    else:  # hnsw
+        hnsw_m = params.get("hnsw_m", settings.kb_hnsw_m)
+        if encoding == "float32":
+            index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        elif encoding == "pq":
+            index = faiss.IndexHNSWPQ(dim, pq_m, hnsw_m, pq_nbits)
+        else:
+            index = faiss.IndexHNSWSQ(dim, _SCALAR_QUANTIZER_TYPES[encoding], hnsw_m)
+        index.hnsw.efConstruction = params.get("ef_construction", settings.kb_hnsw_ef_construction)
+        metadata["params"].update({
+            "hnsw_m": hnsw_m,
+            "ef_construction": index.hnsw.efConstruction,
+            "ef_search": params.get("ef_search", settings.kb_hnsw_ef_search),
+        })
+
+    return index, metadata
+
+
+def training_sample_size(metadata: dict) -> int:
+    """
+    Número de vectores que conviene reunir antes de entrenar el índice (0 si no requiere entrenamiento).
+    """
+    params = metadata["params"]
+    needed = 0
+    if "nlist" in params:
+        needed = max(needed, params["nlist"] * MIN_TRAINING_POINTS_PER_CENTROID)
+    if metadata["encoding"] == "pq":
+        needed = max(needed, 2 ** params["pq_nbits"] * MIN_TRAINING_POINTS_PER_CENTROID)
+    elif metadata["encoding"] == "int8":
+        needed = max(needed, SCALAR_QUANTIZER_TRAINING_POINTS)
+    return min(needed, metadata["ntotal"])
+
+
+def build_index_streaming(batches: Iterable[np.ndarray], num_vectors: Optional[int] = None, index_type: str = "flat", **params) -> tuple[faiss.Index, dict]:
+    """
+    Construye un índice añadiendo los embeddings lote a lote, sin reunir la matriz completa.
+
+    Si el índice necesita entrenamiento, solo se acumulan en memoria los primeros lotes
+    hasta completar la muestra de entrenamiento (ver `training_sample_size`).
+
+    Args:
+        batches: Iterable de matrices float32 de forma (b, d).
+        num_vectors: Número total de vectores que producirá `batches`, o None si no se conoce
+            de antemano (flujo). En ese caso, si el flujo termina antes de completar la muestra
+            de entrenamiento, el índice se redimensiona con el número real de vectores.
+        index_type: Uno de INDEX_TYPES.
+        **params: Parámetros del índice, incluida la codificación (`encoding`).
+
+    Returns:
+        Una tupla (índice, metadatos).
+    """
+    index, metadata, needed = None, None, 0
+    pending: list[np.ndarray] = []
+    pending_count = 0
+
+    def train_and_flush():
+        nonlocal index, metadata, pending, pending_count
+        sample = np.vstack(pending)
+        if len(sample) < needed:
+            # Hay menos vectores de los previstos: se dimensiona el índice con el total real.
+            index, metadata = new_index(sample.shape[1], len(sample), index_type, **params)
+        print(f"[+] (KnowledgeAgent) Entrenando índice {metadata['index_type']}/{metadata['encoding']} con {len(sample)} vectores...")
+        index.train(sample)
+        index.add(sample)
+        pending, pending_count = [], 0
+
+    for batch in batches:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        if index is None:
+            index, metadata = new_index(batch.shape[1], num_vectors or MAX_STREAMED_VECTORS, index_type, **params)
+            needed = training_sample_size(metadata)
+        if index.is_trained:
+            index.add(batch)
+            continue
+        pending.append(batch)
+        pending_count += len(batch)
+        if pending_count >= needed:
+            train_and_flush()
+
+    if index is None:
+        raise ValueError("No se recibió ningún embedding para construir el índice.")
+    if pending:
+        train_and_flush()
+
+    metadata["ntotal"] = index.ntotal
+    apply_search_params(index, metadata)
+    return index, metadata
+
+
+def build_index(embeddings: np.ndarray, index_type: str = "flat", **params) -> tuple[faiss.Index, dict]:
+    """
+    Construye (y entrena, si hace falta) un índice FAISS con una matriz de embeddings ya en memoria.
+
+    Args:
+        embeddings: Matriz float32 de forma (n, d).
+        index_type: Uno de INDEX_TYPES.
+        **params: Parámetros del índice (ver `index_params_from_settings`).
+
+    Returns:
+        Una tupla (índice, metadatos).
+    """
+    return build_index_streaming([embeddings], len(embeddings), index_type, **params)
+
+
+def apply_search_params(index: faiss.Index, metadata: Optional[dict]) -> None:
+    """
+    Ajusta los parámetros de consulta del índice (nprobe, efSearch) según sus metadatos.
+    """
+    if not metadata:
+        return
+    params = metadata.get("params", {})
+    index_type = metadata.get("index_type")
+    if index_type in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+    elif index_type == "hnsw":
+        index.hnsw.efSearch = params["ef_search"]
+
+
+def read_index_shared(index_file: str, metadata: Optional[dict]) -> faiss.Index:
+    """
+    Lee un índice proyectando en memoria (mmap) sus datos cuando FAISS lo permite, para que los
+    workers compartan las páginas de la caché del sistema operativo en lugar de copiarlas.
+
+    - IVF: IO_FLAG_MMAP proyecta las listas invertidas (los vectores codificados).
+    - flat, HNSW y cuantización escalar: IO_FLAG_MMAP_IFC (FAISS >= 1.9) proyecta los códigos
+      de los vectores sin copiarlos. El grafo de HNSW se sigue leyendo en la memoria de cada
+      proceso. Con versiones de FAISS sin IO_FLAG_MMAP_IFC el índice se lee completo en cada
+      proceso.
+    """
+    index_type = (metadata or {}).get("index_type", "flat")
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        return faiss.read_index(index_file, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    print(
+        f"[-] (KnowledgeAgent) Esta versión de FAISS no admite IO_FLAG_MMAP_IFC: el índice "
+        f"{index_type} se lee completo en la memoria de cada proceso."
+    )
+    return faiss.read_index(index_file, faiss.IO_FLAG_READ_ONLY)
+
+
+def metadata_path_for(index_file: str) -> str:
+    """Ruta del archivo de metadatos que acompaña a un índice."""
+    return os.path.splitext(index_file)[0] + '.meta.json'
+
+
+def save_index_metadata(index_file: str, metadata: dict) -> None:
+    """Guarda los metadatos del índice de forma atómica junto al archivo del índice."""
+    meta_file = metadata_path_for(index_file)
+    with open(meta_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(meta_file + '.tmp', meta_file)
+
+
+def load_index_metadata(index_file: str) -> Optional[dict]:
+    """
+    Lee los metadatos de un índice. Devuelve None si no existen (índices creados
+    antes de que se guardaran metadatos, que siempre son flat).
+    """
+    meta_file = metadata_path_for(index_file)
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,230 @@
+"""
+Caché de dos niveles para las búsquedas en el arancel.
+
+    - Nivel 1: LRU acotado en memoria, con caducidad (TTL), propio de cada proceso.
+    - Nivel 2: almacén SQLite local compartido por todos los workers de la máquina, acotado a
+      un máximo de filas: cada cierto número de escrituras se borran las entradas caducadas y,
+      si aún sobran, las más antiguas.
+
+Las claves incluyen la descripción normalizada, k y la versión de la base de conocimiento,
+así que una reconstrucción del índice invalida automáticamente las entradas anteriores.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+SearchResult = List[Tuple[str, float]]
+
+
+def normalize_description(description: str) -> str:
+    """Normaliza una descripción para usarla como clave: minúsculas y espacios colapsados."""
+    return re.sub(r"\s+", " ", description).strip().lower()
+
+
+def query_key(description: str, k: int, kb_version: str) -> str:
+    """Clave de caché de una búsqueda."""
+    raw = f"{kb_version}\0{k}\0{normalize_description(description)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    Caché LRU en memoria con tamaño máximo y TTL, segura entre hilos.
+    """
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class PersistentQueryCache:
+    """
+    Almacén SQLite compartido entre procesos para los resultados de búsqueda.
+    """
+    # Cada cuántas escrituras se poda el almacén (contar las filas recorre la tabla entera).
+    PRUNE_EVERY_PUTS = 256
+
+    def __init__(self, path: str, ttl_seconds: float, max_rows: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        # WAL permite que varios workers lean mientras otro escribe.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache ("
+            " key TEXT PRIMARY KEY, kb_version TEXT NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_query_cache_created_at ON query_cache (created_at)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.pruned = 0
+        self._puts_since_prune = 0
+        self.prune()
+
+    def get(self, key: str) -> Optional[SearchResult]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM query_cache WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [tuple(item) for item in json.loads(row[0])]
+
+    def put(self, key: str, kb_version: str, result: SearchResult) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_cache (key, kb_version, result, created_at) VALUES (?, ?, ?, ?)",
+                (key, kb_version, json.dumps(result), time.time()),
+            )
+            self._conn.commit()
+            self._puts_since_prune += 1
+            if self._puts_since_prune < self.PRUNE_EVERY_PUTS:
+                return
+        self.prune()
+
+    def prune(self) -> int:
+        """
+        Borra las entradas caducadas y, si aún se supera `max_rows`, las más antiguas.
+
+        Returns:
+            El número de entradas borradas.
+        """
+        with self._lock:
+            self._puts_since_prune = 0
+            removed = self._conn.execute(
+                "DELETE FROM query_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            excess = self._conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0] - self.max_rows
+            if excess > 0:
+                removed += self._conn.execute(
+                    "DELETE FROM query_cache WHERE key IN (SELECT key FROM query_cache ORDER BY created_at LIMIT ?)",
+                    (excess,),
+                ).rowcount
+            self._conn.commit()
+            self.pruned += removed
+        return removed
+
+    def invalidate_other_versions(self, kb_version: str) -> int:
+        """Elimina las entradas de versiones anteriores de la base de conocimiento."""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM query_cache WHERE kb_version != ?", (kb_version,)
+            ).rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+            return {"size": size, "max_rows": self.max_rows, "hits": self.hits, "misses": self.misses, "pruned": self.pruned}
+
+
+class TariffQueryCache:
+    """
+    Combina el LRU en memoria y el almacén persistente. Un acierto en el nivel 2
+    se promueve al nivel 1.
+    """
+    def __init__(
+        self,
+        max_size: int,
+        ttl_seconds: float,
+        persistent_path: Optional[str] = None,
+        persistent_max_rows: int = 100_000,
+    ):
+        self.memory = LRUCache(max_size, ttl_seconds)
+        self.persistent = (
+            PersistentQueryCache(persistent_path, ttl_seconds, persistent_max_rows) if persistent_path else None
+        )
+        self._kb_version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, kb_version: str) -> None:
+        """Invalida ambos niveles la primera vez que se observa una nueva versión del índice."""
+        if kb_version == self._kb_version:
+            return
+        with self._lock:
+            if kb_version == self._kb_version:
+                return
+            self.memory.clear()
+            if self.persistent is not None:
+                self.persistent.invalidate_other_versions(kb_version)
+            self._kb_version = kb_version
+
+    def get(self, description: str, k: int, kb_version: str) -> Optional[SearchResult]:
+        self._check_version(kb_version)
+        key = query_key(description, k, kb_version)
+        result = self.memory.get(key)
+        if result is None and self.persistent is not None:
+            result = self.persistent.get(key)
+            if result is not None:
+                self.memory.put(key, result)
+        return result
+
+    def put(self, description: str, k: int, kb_version: str, result: SearchResult) -> None:
+        self._check_version(kb_version)
+        key = query_key(description, k, kb_version)
+        self.memory.put(key, result)
+        if self.persistent is not None:
+            self.persistent.put(key, kb_version, result)
+
+    def stats(self) -> dict:
+        return {
+            "kb_version": self._kb_version,
+            "memory": self.memory.stats(),
+            "persistent": self.persistent.stats() if self.persistent is not None else None,
+        }
@@ -0,0 +1,203 @@
+"""
+Servicio local de embeddings y recuperación sobre un socket Unix.
+
+Un único proceso carga el modelo de embedding y el índice FAISS; los workers de la API le
+envían sus búsquedas en lugar de tener cada uno su propia copia del modelo. Las peticiones
+concurrentes se agrupan en micro-lotes (hasta `max_batch_size` descripciones o
+`max_wait_ms` de espera) que se resuelven con una sola pasada del modelo.
+
+Protocolo: cada mensaje es un objeto JSON precedido por su longitud (4 bytes, big-endian).
+    petición:  {"op": "search", "queries": [...], "k": 5}  |  {"op": "stats"}
+    respuesta: {"results": [[[fragmento, distancia], ...], ...]}  |  {"stats": {...}}  |  {"error": "..."}
+"""
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple
+
+_HEADER = struct.Struct(">I")
+
+
+def send_message(sock: socket.socket, payload: dict) -> None:
+    data = json.dumps(payload).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        part = sock.recv(size - len(buffer))
+        if not part:
+            raise ConnectionError("La conexión se cerró antes de recibir el mensaje completo.")
+        buffer.extend(part)
+    return bytes(buffer)
+
+
+def recv_message(sock: socket.socket) -> dict:
+    (size,) = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return json.loads(_recv_exactly(sock, size))
+
+
+class MicroBatcher:
+    """
+    Agrupa búsquedas concurrentes y las resuelve en lotes con `search_batch`.
+    """
+    def __init__(self, knowledge_base, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.knowledge_base = knowledge_base
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self._queue: "queue.Queue[Tuple[List[str], int, Future]]" = queue.Queue()
+        self.batches = 0
+        self.queries = 0
+        self._thread = threading.Thread(target=self._run, name="retrieval-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, queries: List[str], k: int) -> Future:
+        future: Future = Future()
+        self._queue.put((queries, k, future))
+        return future
+
+    def _collect(self) -> list:
+        """
+        Espera la primera petición y añade las que lleguen durante la ventana de espera. La
+        ventana empieza con la primera petición: las siguientes no la alargan.
+        """
+        requests = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        pending = len(requests[0][0])
+        while pending < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            pending += len(request[0])
+        return requests
+
+    def _run(self) -> None:
+        while True:
+            requests = self._collect()
+            # Las peticiones con distinto k se resuelven en lotes separados.
+            by_k: dict = {}
+            for request in requests:
+                by_k.setdefault(request[1], []).append(request)
+            for k, group in by_k.items():
+                queries = [query for request_queries, _, _ in group for query in request_queries]
+                try:
+                    results = self.knowledge_base.search_batch(queries, k=k)
+                except Exception as e:
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+                self.batches += 1
+                self.queries += len(queries)
+                offset = 0
+                for request_queries, _, future in group:
+                    future.set_result(results[offset:offset + len(request_queries)])
+                    offset += len(request_queries)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        batcher: MicroBatcher = self.server.batcher
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                if request.get("op") == "search":
+                    results = batcher.submit(request["queries"], int(request.get("k", 5))).result()
+                    send_message(self.request, {"results": results})
+                elif request.get("op") == "stats":
+                    send_message(self.request, {"stats": batcher.stats()})
+                else:
+                    send_message(self.request, {"error": f"Operación desconocida: {request.get('op')}"})
+            except Exception as e:
+                send_message(self.request, {"error": str(e)})
+
+
+class RetrievalServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Todos los hilos de todos los workers pueden conectarse a la vez al arrancar.
+    request_queue_size = 256
+
+    def __init__(self, socket_path: str, batcher: MicroBatcher):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.batcher = batcher
+        super().__init__(socket_path, _RequestHandler)
+
+
+def serve(socket_path: str, max_batch_size: int = 64, max_wait_ms: float = 5.0) -> None:
+    """
+    Carga la base de conocimiento y atiende búsquedas en `socket_path` hasta que se detenga el proceso.
+    """
+    # Importación diferida para que los clientes no carguen el agente completo.
+    from agents.knowledge_agent import get_knowledge_base
+
+    knowledge_base = get_knowledge_base()
+    knowledge_base.load()
+    batcher = MicroBatcher(knowledge_base, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    with RetrievalServer(socket_path, batcher) as server:
+        print(f"[+] (RetrievalServer) Atendiendo búsquedas en '{socket_path}'...")
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+class RetrievalClient:
+    """
+    Cliente del servicio de recuperación. Mantiene una conexión persistente por hilo.
+    """
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _request(self, payload: dict) -> dict:
+        sock = self._connection()
+        try:
+            send_message(sock, payload)
+            response = recv_message(sock)
+        except (ConnectionError, OSError):
+            # La conexión quedó en un estado desconocido: se descarta para el próximo intento.
+            sock.close()
+            self._local.sock = None
+            raise
+        if "error" in response:
+            raise RuntimeError(f"Retrieval server error: {response['error']}")
+        return response
+
+    def search_batch(self, queries: List[str], k: int = 5) -> List[List[Tuple[str, float]]]:
+        results = self._request({"op": "search", "queries": queries, "k": k})["results"]
+        return [[(chunk, distance) for chunk, distance in result] for result in results]
+
+    def stats(self) -> dict:
+        return self._request({"op": "stats"})["stats"]
@@ -1,18 +1,22 @@
+import hashlib
 import uuid
 from pathlib import Path
 import shutil
 from typing import List
-from fastapi import FastAPI, Depends, UploadFile, status, BackgroundTasks, HTTPException, Form, File, APIRouter
+from fastapi import FastAPI, Depends, UploadFile, status, HTTPException, Form, File, APIRouter
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, field_serializer
 from datetime import datetime
 
-from db import database, models, repository
+from db import database, migrations, models, repository
 from db.database import get_db
-from processing import orchestrator
+from processing import metrics, reprocess
+from agents.classification_agent import invalidate_stale_classifications
+from core.config import settings
+from knowledge.build_lock import KnowledgeBaseUnavailableError
 
-# Crea las tablas de la base de datos si no existen.
-models.Base.metadata.create_all(bind=database.engine)
+# Crea las tablas de la base de datos si no existen y añade las columnas nuevas.
+migrations.upgrade(database.engine)
 
 app = FastAPI(
     title="RoboDocAI API",
@@ -28,11 +32,13 @@ class DocumentResponse(BaseModel):
     shipment_id: str
     source_filename: str
     status: str
+    content_sha256: str | None = None
     raw_text_content: str | None = None
     structured_data: dict | None = None
     classification_data: dict | None = None
     pre_flight_check_results: dict | None = None
     supervisor_verdict: dict | None = None
+    pipeline_run: dict | None = None
     error_log: str | None = None
     created_at: datetime
     updated_at: datetime | None = None
@@ -73,6 +79,45 @@ async def root():
     """Endpoint de verificación de estado."""
     return {"message": "RoboDocAI API is running."}
 
+@app.get("/metrics", tags=["Health Check"])
+def get_metrics(db: Session = Depends(get_db)):
+    """
+    Contadores de todos los workers de procesamiento (cachés, extracción, LLM), sumados a partir
+    de lo que cada uno publicó en las últimas `worker_metrics_retention_hours` horas.
+    """
+    return metrics.aggregate_worker_metrics(db, window_seconds=settings.worker_metrics_retention_hours * 3600)
+
+@app.get("/jobs/stats", tags=["Health Check"])
+def get_jobs_stats(db: Session = Depends(get_db)):
+    """Profundidad (trabajos por estado) y antigüedad de la cola de procesamiento."""
+    return repository.get_job_queue_stats(db)
+
+@app.post("/knowledge/build", status_code=status.HTTP_202_ACCEPTED, tags=["Knowledge Base"])
+def trigger_knowledge_base_build(db: Session = Depends(get_db)):
+    """
+    Encola la (re)construcción de la base de conocimiento del arancel para los workers; la API no
+    construye nada. Si ya hay una construcción en cola o en curso, devuelve esa. La nueva versión
+    se publica de forma atómica y los workers la recargan en caliente.
+    """
+    job = repository.get_active_job(db, "build_knowledge_base")
+    if job is None:
+        # Sin reintentos: una construcción fallida (p. ej. sin el PDF del arancel) se vuelve a pedir.
+        job = repository.enqueue_job(db=db, kind="build_knowledge_base", payload={"force": True}, max_attempts=1)
+    return {"message": "Knowledge base build queued.", "job_id": job.id, "status": job.status}
+
+@app.delete("/classification/cache", tags=["Classification"])
+def clear_classification_cache(stale_only: bool = True, db: Session = Depends(get_db)):
+    """
+    Invalida en bloque la caché de clasificaciones. Con `stale_only` (por defecto) solo elimina
+    las entradas de otra versión del arancel, del modelo o del prompt, y las caducadas.
+    """
+    if not stale_only:
+        return {"deleted": repository.invalidate_classification_cache(db)}
+    try:
+        return {"deleted": invalidate_stale_classifications(db)}
+    except KnowledgeBaseUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
 @router.post("/shipments/", response_model=ShipmentResponse, tags=["Shipments"])
 async def create_new_shipment(
     shipment: ShipmentCreate,
@@ -107,23 +152,32 @@ async def get_shipment_by_id(
 @router.post("/shipments/{shipment_id}/documents/", status_code=status.HTTP_201_CREATED, response_model=DocumentResponse, tags=["Documents"])
 async def upload_document_to_shipment(
     shipment_id: uuid.UUID, # Path parameter
-    tasks: BackgroundTasks,
     document_type: models.DocumentType = Form(...), # Form data
     file: UploadFile = File(...),
+    priority: int = Form(0),
     db: Session = Depends(get_db)
 ):
     """
-    Sube un documento, lo asocia a un expediente existente y agenda su procesamiento.
+    Sube un documento, lo asocia a un expediente existente y encola su procesamiento, que
+    ejecutan los workers (`python -m processing.worker`). Los documentos de mayor `priority`
+    se procesan antes.
     """
     db_shipment = db.query(models.Shipment).filter(models.Shipment.id == shipment_id).first()
     if not db_shipment:
         raise HTTPException(status_code=404, detail=f"Shipment with ID {shipment_id} not found.")
 
+    try:
+        contents = file.file.read()
+    finally:
+        file.file.close()
+
+    # La huella del contenido permite reutilizar la extracción de subidas anteriores del mismo archivo.
     new_document = repository.create_document(
         db=db,
         shipment_id=shipment_id,
         source_filename=file.filename,
-        document_type=document_type
+        document_type=document_type,
+        content_sha256=hashlib.sha256(contents).hexdigest()
     )
     doc_id = new_document.id
 
@@ -134,17 +188,21 @@ async def upload_document_to_shipment(
     temp_file_path = temp_dir / f"{doc_id}{file_extension}"
 
     try:
-        contents = file.file.read()
         with open(temp_file_path, 'wb') as f:
             f.write(contents)
         print(f"[+] File saved successfully to {temp_file_path}")
     except Exception as e:
         print(f"[-] Failed to save file: {e}")
         raise HTTPException(status_code=500, detail="Could not save uploaded file.")
-    finally:
-        file.file.close()
 
-    tasks.add_task(orchestrator.process_document, doc_id=doc_id, file_path=str(temp_file_path))
+    repository.enqueue_job(
+        db=db,
+        kind="process_document",
+        payload={"document_id": str(doc_id), "file_path": str(temp_file_path)},
+        document_id=doc_id,
+        priority=priority,
+        max_attempts=settings.job_max_attempts
+    )
 
     response_data = DocumentResponse.model_validate(new_document)
     return response_data
@@ -163,5 +221,19 @@ async def get_document_results(document_id: uuid.UUID, db: Session = Depends(get
     response_data = DocumentResponse.model_validate(db_document)
     return response_data
 
+@app.post("/documents/{document_id}/reprocess", status_code=status.HTTP_202_ACCEPTED, tags=["Documents"])
+def reprocess_document(document_id: uuid.UUID, force: bool = False, priority: int = 0, db: Session = Depends(get_db)):
+    """
+    Encola el reprocesamiento de un documento desde su primera etapa incompleta; las etapas ya
+    completadas (extracción, clasificación...) se reutilizan. Con `force` se repiten todas.
+    """
+    try:
+        job = reprocess.reprocess_document(db=db, document_id=document_id, force=force, priority=priority)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Document not found")
+    except reprocess.ReprocessConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"document_id": str(document_id), "job_id": job.id}
+
 # Register the router with the main app
 app.include_router(router)
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""
+Métricas del procesamiento compartidas entre los workers y la API.
+
+La clasificación, la extracción, el LLM y la caché de consultas al arancel corren en los procesos
+worker (ver `processing.worker`), así que sus contadores no existen en el proceso de la API. Cada
+worker publica periódicamente los suyos en la tabla `worker_metrics` y `/metrics` los suma:
+las tasas (aciertos de la caché, extracciones sin LLM) y los percentiles de latencia se calculan
+sobre los totales, no se promedian.
+"""
+from sqlalchemy.orm import Session
+
+from agents.classification_agent import get_classification_counters, summarize_classification_stats
+from agents.data_extractor import get_extraction_counters, summarize_extraction_stats
+from agents.knowledge_agent import get_query_cache_stats
+from core.llm_client import get_llm_counters, summarize_llm_stats
+from db import repository
+
+# Contadores que no se suman entre workers sino que se toma el mayor: el almacén persistente de
+# la caché de consultas es un único archivo compartido por los workers de cada máquina.
+NON_ADDITIVE_KEYS = {("persistent", "size"), ("persistent", "max_rows")}
+
+
+def collect_process_metrics() -> dict:
+    """Contadores de este proceso, sin métricas derivadas, para publicarlos."""
+    return {
+        "knowledge_query_cache": get_query_cache_stats(),
+        "classification": get_classification_counters(),
+        "extraction": get_extraction_counters(),
+        "llm": get_llm_counters(),
+    }
+
+
+def publish_process_metrics(db: Session, owner: str) -> None:
+    """Guarda los contadores de este proceso como los del worker `owner`."""
+    repository.save_worker_metrics(db, owner, collect_process_metrics())
+
+
+def _merge(total: dict, counters: dict, path: tuple = ()) -> dict:
+    """Suma `counters` sobre `total`: números sumados, listas unidas y el resto, el último valor."""
+    for key, value in counters.items():
+        current = total.get(key)
+        if isinstance(value, dict):
+            total[key] = _merge(current if isinstance(current, dict) else {}, value, path + (key,))
+        elif isinstance(value, list):
+            total[key] = (current or []) + value
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(current, (int, float)):
+            total[key] = max(current, value) if path[-1:] + (key,) in NON_ADDITIVE_KEYS else current + value
+        else:
+            total[key] = value
+    return total
+
+
+def aggregate_worker_metrics(db: Session, window_seconds: float) -> dict:
+    """
+    Suma los contadores publicados por los workers en los últimos `window_seconds`.
+
+    Args:
+        db: La sesión de la base de datos.
+        window_seconds: Antigüedad máxima de las publicaciones que se tienen en cuenta.
+
+    Returns:
+        El número de workers y sus métricas agregadas por componente.
+    """
+    rows = repository.list_worker_metrics(db, max_age_seconds=window_seconds)
+    total: dict = {}
+    for row in rows:
+        _merge(total, row.snapshot)
+    return {
+        "workers": len(rows),
+        "knowledge_query_cache": total.get("knowledge_query_cache"),
+        "classification": summarize_classification_stats(total.get("classification", {})),
+        "extraction": summarize_extraction_stats(total.get("extraction", {})),
+        "llm": {model_id: summarize_llm_stats(counters) for model_id, counters in total.get("llm", {}).items()},
+    }
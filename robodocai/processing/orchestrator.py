@@ -1,3 +1,4 @@
+import hashlib
 import uuid
 from pathlib import Path
 
@@ -6,113 +7,251 @@ from db.database import SessionLocal
 from db import repository, models
 
 # Importaciones de agentes
-from agents.data_extractor import DataExtractorAgent
+from agents.data_extractor import CommercialInvoiceData, DataExtractorAgent, record_extraction_source
 from agents.classification_agent import propose_tariff_classification
 from agents.pre_flight_check_agent import run_pre_flight_checks
 from agents.supervisor_agent import review_final_output
+from processing.pdf_text import PAGE_SEPARATOR, DocumentTooLargeError
+from processing.pipeline import Stage, StageFailed, TransientStageError, run_pipeline
+
+
+def _file_sha256(file_path: str) -> str:
+    """Calcula la huella SHA-256 de un archivo leyéndolo por bloques."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _remove_temp_file(file_path: str) -> None:
+    try:
+        Path(file_path).unlink(missing_ok=True)
+        print(f"[+] Cleaned up temporary file: {file_path}")
+    except OSError as e:
+        print(f"[-] Error cleaning up file {file_path}: {e}")
+
+
+def _extract_invoice(
+    db,
+    uow: repository.DocumentUnitOfWork,
+    extractor_agent: DataExtractorAgent,
+    file_path: str,
+    content_sha256: str
+) -> tuple:
+    """
+    Etapa de extracción de una factura comercial: caché por huella del archivo, plantilla del
+    vendedor o LLM.
+
+    Returns:
+        Los datos estructurados (dict) y su origen ("cache", "template" o "llm").
+
+    Raises:
+        StageFailed: Si el documento es demasiado grande, el archivo ya no existe o no se
+            pudieron extraer datos.
+    """
+    db_document = uow.document
+    print(f"[+] Documento identificado como {db_document.document_type.value}. Usando DataExtractorAgent...")
+    # Si este mismo archivo ya se extrajo con esta versión del extractor, se reutilizan
+    # su texto y sus datos validados sin leer el PDF ni llamar al LLM.
+    cached_extraction = repository.get_cached_extraction(
+        db=db, content_sha256=content_sha256, extractor_version=extractor_agent.version
+    )
+    structured_data = None
+    if cached_extraction:
+        print(f"[+] Extracción reutilizada para el documento {db_document.id} (sha256 {content_sha256[:12]}).")
+        raw_text = cached_extraction.raw_text
+        structured_data = CommercialInvoiceData(**cached_extraction.structured_data).model_dump()
+        extraction_source = "cache"
+        record_extraction_source(extraction_source)
+    else:
+        if not Path(file_path).exists():
+            raise StageFailed("El archivo subido ya no está disponible; hay que volver a subir el documento.")
+        print(f"[+] (Agent: DataExtractor) Procesando factura: {file_path}")
+        try:
+            pages = extractor_agent.extract_pages(file_path)
+        except DocumentTooLargeError as e:
+            raise StageFailed(f"Documento demasiado grande: {e}") from e
+        raw_text = PAGE_SEPARATOR.join(pages)
+        # Con la plantilla del vendedor si el diseño es conocido; si no, con el LLM.
+        structured_data_model, extraction_source = extractor_agent.extract_from_document(
+            file_path=file_path, pages=pages, db=db
+        )
+        if structured_data_model:
+            # Convertir el modelo Pydantic a un dict para el resto del pipeline
+            structured_data = structured_data_model.model_dump()
+            repository.save_cached_extraction(
+                db=db,
+                content_sha256=content_sha256,
+                extractor_version=extractor_agent.version,
+                raw_text=raw_text,
+                structured_data=structured_data,
+            )
+    if raw_text:
+        uow.set_content(raw_text)
+
+    #Validar que la extracción fue exitosa antes de continuar
+    if not structured_data:
+        error_details = "El agente de extracción no pudo procesar el documento o no devolvió datos."
+        raise StageFailed(f"Data Extraction Agent Error: {error_details}")
+    return structured_data, extraction_source
+
+
+def _pre_flight_gate(pre_flight_results: dict) -> str | None:
+    """Corta el pipeline si las comprobaciones previas fallan: el documento irá a revisión."""
+    if pre_flight_results.get("checks_passed", True):
+        return None
+    return "; ".join(pre_flight_results.get("errors", [])) or "pre-flight checks failed"
 
 
 def process_document(doc_id: uuid.UUID, file_path: str):
     """
-    Procesa un documento en segundo plano, ejecutando el pipeline completo de agentes.
+    Procesa un documento en segundo plano, ejecutando el pipeline de agentes como un grafo de
+    etapas (ver `processing.pipeline`):
+
+        extraction ──> pre_flight (compuerta, barata)
+                   └─> classification (cara) ──> supervisor
+
+    Las comprobaciones previas no usan la clasificación, así que se ejecutan antes que ella: una
+    factura que no las supera va a revisión sin pagar la recuperación ni la llamada al LLM, y el
+    corte queda registrado en `pipeline_run`.
+
+    Cada etapa guarda un checkpoint (huella de sus entradas, salida e intentos). Si el documento
+    se vuelve a procesar (reintento de la cola o `processing.reprocess`), las etapas ya
+    completadas se reutilizan y se continúa desde la primera incompleta.
+
+    Raises:
+        Exception: Los errores transitorios (LLM o base de conocimiento no disponibles...) se
+            propagan para que la cola reintente el trabajo; el archivo temporal se conserva.
+            Los errores permanentes marcan el documento como fallido y no se reintentan.
     """
     print(f"[+] Starting processing for document: {doc_id}")
     
-    db = SessionLocal()
+    # Sin expirar los objetos al hacer commit: el documento se carga una vez y se reutiliza.
+    db = SessionLocal(expire_on_commit=False)
+    # El archivo temporal se elimina al terminar, salvo si el documento se va a reintentar. Si
+    # se conserva y el trabajo termina fallido, lo borra el worker (ver `processing.worker`).
+    keep_file = False
     try:
-        # 1. Actualizar estado a "processing"
-        repository.update_document_status(db=db, document_id=doc_id, new_status="processing")
-        print(f"[+] Document {doc_id} status updated to 'processing'")
-
-        # Retrieve the document object to access its properties like document_type
-        db_document = repository.get_document_by_id(db=db, document_id=doc_id)
+        # 1. Cargar el documento y actualizar su estado a "processing"
+        uow = repository.DocumentUnitOfWork(db=db, document_id=doc_id)
+        db_document = uow.document
         if not db_document:
             print(f"[-] CRITICAL: Document {doc_id} not found in DB. Aborting task.")
-            repository.log_document_failure(db=db, document_id=doc_id, error_message="Document not found in DB during processing.")
             return
+        uow.set_status("processing")
+        uow.flush()
+        print(f"[+] Document {doc_id} status updated to 'processing'")
 
-        # 2. Extraer datos estructurados usando el agente apropiado
-        structured_data = None
-        if db_document.document_type == models.DocumentType.FACTURA_COMERCIAL:
-            print(f"[+] Documento identificado como {db_document.document_type.value}. Usando DataExtractorAgent...")
-            extractor_agent = DataExtractorAgent()
-            structured_data_model = extractor_agent.extract_from_commercial_invoice(file_path=file_path)
-            if structured_data_model:
-                # Convertir el modelo Pydantic a un dict para el resto del pipeline
-                structured_data = structured_data_model.model_dump()
-        else:
+        if db_document.document_type != models.DocumentType.FACTURA_COMERCIAL:
             # Lógica para otros tipos de documentos o para manejar tipos no soportados
             print(f"[-] Advertencia: No hay un agente de extracción definido para el tipo de documento: {db_document.document_type.value}")
-            # Por ahora, podemos registrar un error o simplemente continuar sin datos estructurados.
-            # Vamos a registrar un error para ser estrictos.
-            repository.log_document_failure(
-                db=db,
-                document_id=doc_id,
-                error_message=f"Tipo de documento '{db_document.document_type.value}' no soportado por ningún agente de extracción."
-            )
+            uow.fail(f"Tipo de documento '{db_document.document_type.value}' no soportado por ningún agente de extracción.")
             return # Detiene el procesamiento para este documento
 
-        #Validar que la extracción fue exitosa antes de continuar
-        if not structured_data:
-            error_details = "El agente de extracción no pudo procesar el documento o no devolvió datos."
-            full_error_message = f"Data Extraction Agent Error: {error_details}"
-            print(f"[-] Error procesando documento {doc_id}: {full_error_message}")
-            repository.log_document_failure(db=db, document_id=doc_id, error_message=full_error_message)
-            return
-
-        # 5. Guardar los datos estructurados en la base de datos
-        repository.update_document_structured_data(db=db, document_id=doc_id, data=structured_data)
-        print(f"[+] Structured data saved for document {doc_id}")
-
-        # 6. Proponer clasificación arancelaria
-        classification_result = propose_tariff_classification(structured_data=structured_data)
-        if "error" in classification_result:
-            error_details = classification_result.get("message", "No details provided.")
-            full_error_message = f"Classification Agent Error: {error_details}"
-            print(f"[-] Error processing document {doc_id}: {full_error_message}")
-            repository.log_document_failure(db=db, document_id=doc_id, error_message=full_error_message)
-            return
-        
-        # 7. Guardar el resultado de la clasificación
-        repository.update_document_classification_data(db=db, document_id=doc_id, data=classification_result)
-        print(f"[+] Classification data saved for document {doc_id}")
-
-        # 8. Ejecutar Pre-Flight Checks de negocio
-        pre_flight_results = run_pre_flight_checks(
-            structured_data=structured_data,
-            classification_data=classification_result,
-            document_type=db_document.document_type # Passed document_type
+        extractor_agent = DataExtractorAgent()
+        extraction_sources = {}
+        content_sha256 = db_document.content_sha256 or (
+            _file_sha256(file_path) if Path(file_path).exists() else ""
         )
-        repository.update_pre_flight_check_results(db=db, document_id=doc_id, data=pre_flight_results)
-        print(f"[+] Pre-flight check results saved for document {doc_id}")
-        
-        if not pre_flight_results.get("checks_passed", True):
-            print(f"[-] Document {doc_id} failed pre-flight checks. Sending for human review.")
-            repository.update_document_status(db=db, document_id=doc_id, new_status="needs_review")
-            return
 
-        # 9. Supervisar el resultado final
-        supervisor_verdict = review_final_output(structured_data=structured_data, classification_data=classification_result)
-        repository.update_supervisor_verdict(db=db, document_id=doc_id, data=supervisor_verdict)
-        print(f"[+] Supervisor verdict saved for document {doc_id}")
+        def extract(_inputs: dict) -> dict:
+            structured_data, extraction_sources["extraction"] = _extract_invoice(
+                db, uow, extractor_agent, file_path, content_sha256
+            )
+            return structured_data
+
+        def pre_flight(inputs: dict) -> dict:
+            return run_pre_flight_checks(
+                structured_data=inputs["extraction"],
+                document_type=db_document.document_type
+            )
+
+        def classify(inputs: dict) -> dict:
+            classification_result = propose_tariff_classification(structured_data=inputs["extraction"], db=db)
+            if "error" in classification_result:
+                error_details = classification_result.get("message", "No details provided.")
+                if classification_result.get("retryable"):
+                    raise TransientStageError(f"Classification Agent Error: {error_details}")
+                raise StageFailed(f"Classification Agent Error: {error_details}")
+            return classification_result
+
+        def supervise(inputs: dict) -> dict:
+            return review_final_output(structured_data=inputs["extraction"], classification_data=inputs["classification"])
+
+        stages = [
+            # La extracción depende del archivo (su huella) y de la versión del extractor.
+            Stage("extraction", extract, cost=10, key=f"{content_sha256}:{extractor_agent.version}"),
+            Stage("pre_flight", pre_flight, inputs=("extraction",), cost=1, gate=_pre_flight_gate),
+            Stage("classification", classify, inputs=("extraction",), cost=10),
+            Stage("supervisor", supervise, inputs=("extraction", "classification"), cost=1),
+        ]
+        save_output = {
+            "extraction": uow.set_structured_data,
+            "pre_flight": uow.set_pre_flight_check_results,
+            "classification": uow.set_classification_data,
+            "supervisor": uow.set_supervisor_verdict,
+        }
 
-        # 10. Determinar el estado final basado en el veredicto del supervisor
-        final_status = "completed"
-        if supervisor_verdict.get("validation_status") != "approved":
+        completed_stages = set()
+
+        def on_stage_done(name: str, output) -> None:
+            # Cada etapa terminada se guarda en su frontera (ver DocumentUnitOfWork).
+            completed_stages.add(name)
+            save_output[name](output)
+            uow.flush()
+            print(f"[+] Stage '{name}' saved for document {doc_id}")
+
+        try:
+            pipeline_run = run_pipeline(
+                stages,
+                on_stage_done=on_stage_done,
+                checkpoints=repository.StageCheckpointStore(db=db, document_id=doc_id)
+            )
+        except StageFailed as e:
+            print(f"[-] Error procesando documento {doc_id}: {e}")
+            # Sin extracción completada, el archivo hace falta para poder reprocesarlo.
+            keep_file = "extraction" not in completed_stages and not isinstance(e.__cause__, DocumentTooLargeError)
+            uow.fail(str(e))
+            return
+        except Exception as e:
+            # Error transitorio: el documento queda en error hasta el reintento, que continuará
+            # desde la etapa que falló.
+            keep_file = True
+            print(f"[-] Error transitorio procesando documento {doc_id}; se reintentará: {e!r}")
+            if not db.is_active:
+                db.rollback()
+            uow.fail(f"Error transitorio (se reintentará): {e}")
+            raise
+        uow.set_pipeline_run(pipeline_run.as_dict())
+
+        # Determinar el estado final: revisión si hubo corte o el supervisor no aprueba.
+        if pipeline_run.short_circuit:
+            print(f"[-] Document {doc_id} failed pre-flight checks. Sending for human review.")
+            final_status = "needs_review"
+        elif pipeline_run.outputs["supervisor"].get("validation_status") != "approved":
             final_status = "needs_review"
-        
-        repository.update_document_status(db=db, document_id=doc_id, new_status=final_status)
+        else:
+            final_status = "completed"
+            if extraction_sources.get("extraction") == "llm":
+                # Extracción validada: se aprende el diseño del vendedor para no volver a necesitar el LLM.
+                extractor_agent.learn_template(
+                    file_path=file_path, validated_data=pipeline_run.outputs["extraction"], db=db
+                )
+
+        uow.set_status(final_status)
+        uow.flush()
         print(f"[+] Document {doc_id} status updated to '{final_status}'")
 
         print(f"[+] Finished processing for document {doc_id}")
 
+    except BaseException:
+        # Errores inesperados fuera de las etapas: la cola reintentará el trabajo.
+        keep_file = True
+        raise
     finally:
         db.close()
         print(f"[+] Database session closed for task {doc_id}")
-
-    # Limpiar el archivo temporal
-    try:
-        Path(file_path).unlink()
-        print(f"[+] Cleaned up temporary file: {file_path}")
-    except OSError as e:
-        print(f"[-] Error cleaning up file {file_path}: {e}")
\ No newline at end of file
+        if not keep_file:
+            # También en los `return` anticipados (documento fallido, tipo no soportado...).
+            _remove_temp_file(file_path)
@@ -0,0 +1,58 @@
+"""
+Extracción de un PDF por rangos de páginas en un pool de procesos, con el trabajo en vuelo acotado.
+
+La comparten la extracción de los documentos subidos (`processing.pdf_text`, PyMuPDF) y la
+construcción de la base de conocimiento (`knowledge.build_pipeline`, pypdf): cada una aporta la
+función que extrae un rango con su biblioteca.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List
+
+# Extrae el texto de las páginas [start, end) de un PDF. Debe poder serializarse (función de módulo).
+PageRangeExtractor = Callable[[str, int, int], List[str]]
+
+
+def iter_page_ranges(
+    file_path: str,
+    num_pages: int,
+    workers: int,
+    pages_per_task: int,
+    extract_range: PageRangeExtractor,
+) -> Iterator[str]:
+    """
+    Extrae las páginas de un PDF repartiendo rangos de `pages_per_task` páginas entre procesos.
+
+    Con `workers` <= 1 o un único rango se extrae en el proceso actual. Si no, hay como máximo
+    `2 * workers` rangos en vuelo, así que solo esa cantidad de páginas puede estar esperando
+    en memoria.
+
+    Args:
+        file_path: Ruta del PDF.
+        num_pages: Número de páginas del PDF.
+        workers: Número de procesos extractores.
+        pages_per_task: Páginas por tarea enviada al pool.
+        extract_range: Función que extrae el texto de un rango de páginas.
+
+    Yields:
+        El texto de cada página, en orden.
+    """
+    ranges = [(start, min(start + pages_per_task, num_pages)) for start in range(0, num_pages, pages_per_task)]
+    if workers <= 1 or len(ranges) <= 1:
+        for start, end in ranges:
+            yield from extract_range(file_path, start, end)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+        pending_ranges = iter(ranges)
+        in_flight: deque = deque()
+        for start, end in pending_ranges:
+            in_flight.append(executor.submit(extract_range, file_path, start, end))
+            if len(in_flight) >= 2 * workers:
+                break
+        while in_flight:
+            pages = in_flight.popleft().result()
+            next_range = next(pending_ranges, None)
+            if next_range is not None:
+                in_flight.append(executor.submit(extract_range, file_path, *next_range))
+            yield from pages
@@ -0,0 +1,80 @@
+"""
+Extracción del texto de los documentos subidos (PyMuPDF), página a página.
+
+Los PDFs grandes (packing lists, B/L de 50–200 páginas) se dividen en rangos de páginas que se
+extraen en un pool de procesos; las páginas se entregan en orden y como flujo, con un número
+acotado de rangos en vuelo. Antes de extraer nada se comprueban los límites de tamaño y de
+páginas, y durante la extracción el límite de caracteres.
+"""
+import os
+from typing import Iterator, List, Optional
+
+import fitz  # PyMuPDF
+
+from core.config import settings
+from processing.page_ranges import iter_page_ranges
+
+
+# Separador de páginas en el texto guardado de un documento (salto de página, como pdftotext).
+PAGE_SEPARATOR = "\f"
+
+
+class DocumentTooLargeError(ValueError):
+    """El documento supera los límites de tamaño, páginas o texto configurados."""
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extrae el texto de las páginas [start, end) (se ejecuta en un proceso del pool)."""
+    with fitz.open(file_path) as doc:
+        return [doc[page_number].get_text("text") for page_number in range(start, end)]
+
+
+def iter_pdf_pages(
+    file_path: str,
+    workers: Optional[int] = None,
+    pages_per_task: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    max_chars: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Extrae el texto de un PDF página a página.
+
+    Los documentos de hasta `pages_per_task` páginas (o con `workers` <= 1) se extraen en el
+    proceso actual; el resto se reparte por rangos entre procesos, con como máximo
+    `2 * workers` rangos en vuelo. Los límites que no se indican se leen de la configuración.
+
+    Args:
+        file_path: Ruta del PDF.
+        workers: Número de procesos extractores.
+        pages_per_task: Páginas por tarea enviada al pool.
+        max_pages: Máximo de páginas admitidas.
+        max_bytes: Tamaño máximo del archivo.
+        max_chars: Máximo de caracteres de texto; se comprueba a medida que se extraen las páginas.
+
+    Yields:
+        El texto de cada página, en orden.
+
+    Raises:
+        DocumentTooLargeError: Si el archivo supera `max_bytes`, `max_pages` o `max_chars`.
+    """
+    workers = settings.pdf_extraction_workers if workers is None else workers
+    pages_per_task = settings.pdf_pages_per_task if pages_per_task is None else pages_per_task
+    max_pages = settings.pdf_max_pages if max_pages is None else max_pages
+    max_bytes = settings.pdf_max_file_mb * 1024 * 1024 if max_bytes is None else max_bytes
+    max_chars = settings.pdf_max_text_chars if max_chars is None else max_chars
+
+    size = os.path.getsize(file_path)
+    if size > max_bytes:
+        raise DocumentTooLargeError(f"El archivo ocupa {size} bytes; el máximo admitido es {max_bytes}.")
+    with fitz.open(file_path) as doc:
+        num_pages = doc.page_count
+    if num_pages > max_pages:
+        raise DocumentTooLargeError(f"El documento tiene {num_pages} páginas; el máximo admitido es {max_pages}.")
+
+    total_chars = 0
+    for page_text in iter_page_ranges(file_path, num_pages, workers, pages_per_task, _extract_page_range):
+        total_chars += len(page_text)
+        if total_chars > max_chars:
+            raise DocumentTooLargeError(f"El texto del documento supera el máximo de {max_chars} caracteres.")
+        yield page_text
@@ -0,0 +1,217 @@
+"""
+Planificador de las etapas del procesamiento de un documento.
+
+El pipeline es un pequeño grafo (DAG) de etapas. Cada etapa declara las etapas cuyas salidas
+necesita (`inputs`) y un coste relativo (`cost`); las de tipo compuerta (`gate`) pueden cortar
+el procesamiento. El planificador:
+
+    1. ejecuta primero las compuertas listas, de la más barata a la más cara, para que un
+       documento que no las supera no pague las etapas caras (recuperación, LLM);
+    2. ejecuta en paralelo las demás etapas listas que no dependen entre sí;
+    3. registra qué etapas se ejecutaron, cuánto tardaron y, si hubo corte, en qué etapa, por
+       qué motivo y qué etapas se omitieron;
+    4. con un almacén de checkpoints, guarda la salida de cada etapa junto con la huella de sus
+       entradas y, al reprocesar, reutiliza las etapas ya completadas con las mismas entradas
+       en lugar de volver a ejecutarlas.
+
+Los errores de una etapa son permanentes (`StageFailed`: el documento no se puede procesar) o
+transitorios (cualquier otra excepción: LLM o base de conocimiento no disponibles, errores de
+red...), que se propagan para que la cola de trabajos reintente el documento más tarde.
+
+Las etapas que se ejecutan en paralelo corren en hilos distintos: no deben compartir la sesión
+de la base de datos. Una etapa sola se ejecuta en el hilo del llamador.
+"""
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+
+class StageFailed(Exception):
+    """Una etapa no pudo completarse y reintentarla no cambiaría el resultado."""
+
+
+class TransientStageError(RuntimeError):
+    """Una etapa falló por una causa transitoria; el documento puede reintentarse más tarde."""
+
+
+class Stage(NamedTuple):
+    name: str
+    # Función que recibe las salidas de sus `inputs` (por nombre de etapa) y devuelve la suya.
+    run: Callable[[Dict[str, object]], object]
+    inputs: Tuple[str, ...] = ()
+    # Coste relativo (p. ej. 1 para reglas locales, 10 para una llamada al LLM).
+    cost: int = 1
+    # Compuerta: recibe la salida de la etapa y devuelve el motivo del corte, o None para seguir.
+    gate: Optional[Callable[[object], Optional[str]]] = None
+    # Identidad adicional de la etapa para la huella de sus entradas (p. ej. la versión del
+    # extractor y la huella del archivo), cuando no se deduce de las salidas de sus `inputs`.
+    key: str = ""
+
+
+class CheckpointStore:
+    """
+    Interfaz del almacén de checkpoints por etapa (ver `repository.StageCheckpointStore`).
+    Sus métodos se llaman siempre desde el hilo del llamador de `run_pipeline`.
+    """
+    def load(self, stage: str, input_hash: str) -> Tuple[bool, object]:
+        """Devuelve (True, salida) si la etapa ya se completó con esas entradas."""
+        raise NotImplementedError
+
+    def start(self, stage: str, input_hash: str) -> None:
+        """Registra un intento de la etapa."""
+        raise NotImplementedError
+
+    def complete(self, stage: str, input_hash: str, output: object) -> None:
+        raise NotImplementedError
+
+    def fail(self, stage: str, input_hash: str, error: str, transient: bool) -> None:
+        raise NotImplementedError
+
+
+def input_hash(stage: Stage, inputs: Dict[str, object]) -> str:
+    """Huella SHA-256 de las entradas de una etapa (salidas de sus `inputs` y su `key`)."""
+    payload = json.dumps({"key": stage.key, "inputs": inputs}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PipelineRun(NamedTuple):
+    outputs: Dict[str, object]
+    # Etapas ejecutadas, en orden de finalización, con su duración.
+    trace: List[dict]
+    # {"stage", "reason", "skipped"} si una compuerta cortó el procesamiento, o None.
+    short_circuit: Optional[dict]
+
+    def as_dict(self) -> dict:
+        return {"stages": self.trace, "short_circuit": self.short_circuit}
+
+
+def _validate(stages: Sequence[Stage]) -> None:
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Nombres de etapa repetidos: {names}")
+    for stage in stages:
+        unknown = set(stage.inputs) - set(names)
+        if unknown:
+            raise ValueError(f"La etapa '{stage.name}' depende de etapas inexistentes: {sorted(unknown)}")
+
+
+def run_pipeline(
+    stages: Sequence[Stage],
+    on_stage_done: Optional[Callable[[str, object], None]] = None,
+    max_workers: int = 4,
+    checkpoints: Optional[CheckpointStore] = None,
+) -> PipelineRun:
+    """
+    Ejecuta las etapas respetando sus dependencias.
+
+    Args:
+        stages: Las etapas del pipeline.
+        on_stage_done: Se llama en el hilo del llamador con (nombre, salida) al terminar o
+            reutilizar cada etapa, p. ej. para guardar su salida.
+        max_workers: Máximo de etapas ejecutadas en paralelo.
+        checkpoints: Almacén de checkpoints; las etapas completadas antes con las mismas
+            entradas no se vuelven a ejecutar.
+
+    Returns:
+        Las salidas de las etapas ejecutadas o reutilizadas, su traza y el corte, si lo hubo.
+
+    Raises:
+        StageFailed: Si una etapa falla de forma permanente.
+        Exception: El error transitorio de una etapa, tal cual, para reintentar el documento.
+        ValueError: Si las dependencias no forman un grafo acíclico.
+    """
+    _validate(stages)
+    outputs: Dict[str, object] = {}
+    trace: List[dict] = []
+    pending = {stage.name: stage for stage in stages}
+
+    def stage_inputs(stage: Stage) -> Dict[str, object]:
+        return {name: outputs[name] for name in stage.inputs}
+
+    def execute(stage: Stage, inputs: Dict[str, object]) -> Tuple[object, float]:
+        start = time.perf_counter()
+        output = stage.run(inputs)
+        return output, time.perf_counter() - start
+
+    def finish(stage: Stage, output: object, elapsed: Optional[float], stage_hash: Optional[str]) -> Optional[str]:
+        outputs[stage.name] = output
+        del pending[stage.name]
+        if elapsed is None:
+            trace.append({"stage": stage.name, "cost": stage.cost, "reused": True})
+        else:
+            trace.append({"stage": stage.name, "cost": stage.cost, "seconds": round(elapsed, 3)})
+            if checkpoints:
+                checkpoints.complete(stage.name, stage_hash, output)
+        if on_stage_done:
+            on_stage_done(stage.name, output)
+        return stage.gate(output) if stage.gate else None
+
+    def stop_if_gated(stage: Stage, reason: Optional[str]) -> Optional[PipelineRun]:
+        if reason is None:
+            return None
+        short_circuit = {"stage": stage.name, "reason": reason, "skipped": sorted(pending)}
+        print(f"[-] (Pipeline) Corte en la etapa '{stage.name}': {reason}. Omitidas: {sorted(pending)}")
+        return PipelineRun(outputs, trace, short_circuit)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            ready = sorted(
+                (stage for stage in pending.values() if all(name in outputs for name in stage.inputs)),
+                key=lambda stage: (stage.gate is None, stage.cost),
+            )
+            if not ready:
+                raise ValueError(f"Dependencias circulares entre las etapas: {sorted(pending)}")
+
+            # Las etapas ya completadas con las mismas entradas se reutilizan sin ejecutarlas.
+            hashes = {}
+            if checkpoints:
+                reused = False
+                for stage in ready:
+                    hashes[stage.name] = input_hash(stage, stage_inputs(stage))
+                    found, output = checkpoints.load(stage.name, hashes[stage.name])
+                    if found:
+                        print(f"[+] (Pipeline) Etapa '{stage.name}' reutilizada del checkpoint.")
+                        stopped = stop_if_gated(stage, finish(stage, output, None, None))
+                        if stopped:
+                            return stopped
+                        reused = True
+                if reused:
+                    continue
+
+            gates = [stage for stage in ready if stage.gate is not None]
+            if gates:
+                # Las compuertas, de una en una y de la más barata a la más cara.
+                batch = gates[:1]
+            else:
+                batch = ready
+
+            if checkpoints:
+                for stage in batch:
+                    checkpoints.start(stage.name, hashes[stage.name])
+            futures = [
+                (stage, executor.submit(execute, stage, stage_inputs(stage)) if len(batch) > 1 else None)
+                for stage in batch
+            ]
+            # Se esperan todas las etapas del lote: las que terminaron se guardan aunque otra falle,
+            # para no repetirlas al reintentar.
+            results, error = [], None
+            for stage, future in futures:
+                try:
+                    output, elapsed = future.result() if future else execute(stage, stage_inputs(stage))
+                except Exception as e:
+                    if checkpoints:
+                        checkpoints.fail(stage.name, hashes[stage.name], repr(e), transient=not isinstance(e, StageFailed))
+                    error = error or e
+                    continue
+                results.append((stage, output, elapsed))
+
+            for stage, output, elapsed in results:
+                stopped = stop_if_gated(stage, finish(stage, output, elapsed, hashes.get(stage.name)))
+                if stopped and error is None:
+                    return stopped
+            if error is not None:
+                raise error
+
+    return PipelineRun(outputs, trace, None)
@@ -0,0 +1,131 @@
+"""
+Reprocesamiento de documentos desde su primera etapa incompleta.
+
+Encola de nuevo el procesamiento de un documento (fallido, en revisión o atascado). El
+orquestador reutiliza los checkpoints de las etapas ya completadas, así que no se repiten la
+extracción ni la clasificación si sus entradas no cambiaron; con `force` se borran los
+checkpoints y se procesa desde cero.
+
+Uso (desde el directorio `robodocai/`):
+    python -m processing.reprocess <document_id> [<document_id> ...] [--force] [--inline]
+"""
+import argparse
+import time
+import uuid
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db import models, repository
+
+UPLOAD_DIR = Path("temp_uploads")
+
+
+class ReprocessConflictError(RuntimeError):
+    """El documento ya tiene un trabajo en cola o en proceso."""
+
+
+def _upload_path(db: Session, document_id: uuid.UUID) -> str:
+    """Ruta del archivo subido: la del último trabajo del documento o la del directorio de subidas."""
+    latest_job = repository.get_latest_document_job(db, document_id)
+    if latest_job is not None:
+        return latest_job.payload["file_path"]
+    return str(next(UPLOAD_DIR.glob(f"{document_id}.*"), UPLOAD_DIR / str(document_id)))
+
+
+def sweep_orphaned_uploads(db: Session, max_age_seconds: float) -> int:
+    """
+    Borra los archivos subidos con más de `max_age_seconds` cuyo documento no tiene un trabajo
+    en cola o en proceso: documentos fallidos, o conservados para reprocesarlos y abandonados.
+
+    Args:
+        db: La sesión de la base de datos.
+        max_age_seconds: Antigüedad mínima (por fecha de modificación) de los archivos a borrar.
+
+    Returns:
+        El número de archivos borrados.
+    """
+    if not UPLOAD_DIR.is_dir():
+        return 0
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for path in UPLOAD_DIR.iterdir():
+        try:
+            if not path.is_file() or path.stat().st_mtime >= cutoff:
+                continue
+            document_id = uuid.UUID(path.stem)
+        except (OSError, ValueError):
+            continue
+        latest_job = repository.get_latest_document_job(db, document_id)
+        if latest_job is not None and latest_job.status in ("queued", "leased"):
+            continue
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
+
+
+def reprocess_document(db: Session, document_id: uuid.UUID, force: bool = False, priority: int = 0) -> models.Job:
+    """
+    Encola el reprocesamiento de un documento.
+
+    Args:
+        db: La sesión de la base de datos.
+        document_id: El UUID del documento.
+        force: Borrar los checkpoints y repetir todas las etapas.
+        priority: Prioridad del trabajo en la cola.
+
+    Returns:
+        El trabajo encolado.
+
+    Raises:
+        LookupError: Si el documento no existe.
+        ReprocessConflictError: Si el documento ya tiene un trabajo en cola o en proceso.
+    """
+    if repository.get_document_by_id(db, document_id) is None:
+        raise LookupError(f"Document {document_id} not found.")
+    latest_job = repository.get_latest_document_job(db, document_id)
+    if latest_job is not None and latest_job.status in ("queued", "leased"):
+        raise ReprocessConflictError(f"Document {document_id} already has job {latest_job.id} ({latest_job.status}).")
+    if force:
+        repository.clear_stage_checkpoints(db, document_id)
+    return repository.enqueue_job(
+        db=db,
+        kind="process_document",
+        payload={"document_id": str(document_id), "file_path": _upload_path(db, document_id)},
+        document_id=document_id,
+        priority=priority,
+        max_attempts=settings.job_max_attempts
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("document_ids", nargs="+", type=uuid.UUID, help="Documentos a reprocesar.")
+    parser.add_argument("--force", action="store_true", help="Repetir todas las etapas (borra los checkpoints).")
+    parser.add_argument("--priority", type=int, default=0, help="Prioridad de los trabajos en la cola.")
+    parser.add_argument("--inline", action="store_true", help="Procesar en este proceso en lugar de encolar.")
+    args = parser.parse_args()
+
+    from db.database import SessionLocal
+    from processing import orchestrator
+
+    db = SessionLocal()
+    try:
+        for document_id in args.document_ids:
+            if args.inline:
+                if args.force:
+                    repository.clear_stage_checkpoints(db, document_id)
+                orchestrator.process_document(doc_id=document_id, file_path=_upload_path(db, document_id))
+                continue
+            try:
+                job = reprocess_document(db, document_id, force=args.force, priority=args.priority)
+                print(f"[+] Document {document_id} queued for reprocessing (job {job.id}).")
+            except (LookupError, ReprocessConflictError) as e:
+                print(f"[-] {e}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
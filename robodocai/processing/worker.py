@@ -0,0 +1,257 @@
+"""
+Workers de procesamiento: toman los trabajos de la cola (tabla jobs) y los ejecutan.
+
+La API solo encola (ver `repository.enqueue_job`); el procesamiento corre en procesos aparte,
+en esta u otras máquinas con acceso a la base de datos y al directorio de subidas, de modo que
+la ingesta y el procesamiento escalan por separado y un reinicio no pierde trabajos.
+
+Cada proceso carga la base de conocimiento al arrancar y después repite:
+    1. devolver a la cola los trabajos con la concesión vencida (workers caídos);
+    2. tomar el siguiente trabajo con una concesión de `job_lease_seconds`, que un hilo renueva
+       mientras se procesa;
+    3. marcarlo como terminado, o registrar el fallo para reintentarlo con espera creciente.
+
+Cada `worker_metrics_publish_seconds` publica sus contadores para `/metrics` (ver `processing.metrics`).
+
+Uso (desde el directorio `robodocai/`):
+    python -m processing.worker --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+
+from core.config import settings
+
+# Cada cuántos segundos un worker busca concesiones vencidas.
+RECOVERY_INTERVAL_SECONDS = 30.0
+
+
+def _process_document(payload: dict) -> None:
+    from processing import orchestrator
+    orchestrator.process_document(doc_id=uuid.UUID(payload["document_id"]), file_path=payload["file_path"])
+
+
+def _build_knowledge_base(payload: dict) -> None:
+    # En un worker y no en la API: la extracción, los embeddings y el entrenamiento del índice
+    # son trabajo pesado de CPU y memoria.
+    from agents.knowledge_agent import build_knowledge_base
+    build_knowledge_base(force=payload.get("force", True))
+
+
+def _discard_upload(payload: dict) -> None:
+    Path(payload["file_path"]).unlink(missing_ok=True)
+
+
+# Tipo de trabajo -> función que lo ejecuta con su payload.
+JOB_HANDLERS = {
+    "process_document": _process_document,
+    "build_knowledge_base": _build_knowledge_base,
+}
+
+# Tipo de trabajo -> limpieza cuando se agotan sus intentos (el archivo subido ya no se usará).
+# Los archivos de los trabajos que fallan por concesión vencida los borra el barrido periódico.
+JOB_FINAL_FAILURE_HANDLERS = {
+    "process_document": _discard_upload,
+}
+
+
+def _renew_lease_until(stop: threading.Event, job_id: int, owner: str) -> None:
+    """Renueva la concesión de un trabajo cada tercio de su duración hasta que termina."""
+    from db import repository
+    from db.database import SessionLocal
+
+    while not stop.wait(settings.job_lease_seconds / 3):
+        db = SessionLocal()
+        try:
+            if not repository.renew_job_lease(db, job_id, owner, settings.job_lease_seconds):
+                print(f"[-] (Worker {owner}) Se perdió la concesión del trabajo {job_id}.")
+                return
+        except Exception as e:
+            print(f"[-] (Worker {owner}) No se pudo renovar la concesión del trabajo {job_id}: {e}")
+        finally:
+            db.close()
+
+
+def _warm_up(owner: str) -> None:
+    """
+    Carga la base de conocimiento antes de tomar trabajos, para que la primera clasificación no
+    pague el coste de inicialización, y elimina de la caché las clasificaciones obsoletas.
+    """
+    from agents.classification_agent import invalidate_stale_classifications
+    from agents.knowledge_agent import warm_up_knowledge_base
+    from db.database import SessionLocal
+    from knowledge.build_lock import KnowledgeBaseUnavailableError
+
+    try:
+        warm_up_knowledge_base()
+    except (FileNotFoundError, KnowledgeBaseUnavailableError) as e:
+        # Sin el PDF del arancel, o mientras otro proceso la construye, el worker sigue tomando
+        # trabajos; la base de conocimiento se cargará en la primera clasificación.
+        print(f"[-] (Worker {owner}) No se pudo precargar la base de conocimiento: {e}")
+        return
+
+    # Las clasificaciones en caché de una versión anterior del arancel o del prompt ya no se usarán.
+    db = SessionLocal()
+    try:
+        deleted = invalidate_stale_classifications(db)
+        if deleted:
+            print(f"[+] (Worker {owner}) {deleted} clasificaciones obsoletas eliminadas de la caché.")
+    except Exception as e:
+        print(f"[-] (Worker {owner}) No se pudo limpiar la caché de clasificaciones: {e}")
+    finally:
+        db.close()
+
+
+def _publish_metrics(owner: str) -> None:
+    """Publica los contadores de este proceso; un fallo solo se registra."""
+    from db.database import SessionLocal
+    from processing import metrics
+
+    db = SessionLocal()
+    try:
+        metrics.publish_process_metrics(db, owner)
+    except Exception as e:
+        print(f"[-] (Worker {owner}) No se pudieron publicar las métricas: {e}")
+    finally:
+        db.close()
+
+
+def run_worker(owner: str, stop: threading.Event) -> None:
+    """
+    Bucle de un worker: toma y ejecuta trabajos hasta que se activa `stop`.
+
+    Args:
+        owner: Identificador único del worker (se guarda como dueño de la concesión).
+        stop: Evento para terminar tras el trabajo en curso.
+    """
+    from db import repository
+    from db.database import SessionLocal
+    from processing import reprocess
+
+    print(f"[+] (Worker {owner}) Iniciado.")
+    _warm_up(owner)
+    last_recovery = last_publish = 0.0
+    while not stop.is_set():
+        if time.monotonic() - last_publish >= settings.worker_metrics_publish_seconds:
+            _publish_metrics(owner)
+            last_publish = time.monotonic()
+        db = SessionLocal()
+        try:
+            if time.monotonic() - last_recovery >= RECOVERY_INTERVAL_SECONDS:
+                recovered = repository.recover_expired_leases(db)
+                if recovered:
+                    print(f"[+] (Worker {owner}) {recovered} trabajos con la concesión vencida recuperados.")
+                swept = reprocess.sweep_orphaned_uploads(db, settings.job_upload_retention_hours * 3600)
+                if swept:
+                    print(f"[+] (Worker {owner}) {swept} archivos subidos sin trabajo activo eliminados.")
+                repository.delete_stale_worker_metrics(db, settings.worker_metrics_retention_hours * 3600)
+                last_recovery = time.monotonic()
+            job = repository.lease_next_job(db, owner, settings.job_lease_seconds)
+            if job is None:
+                db.close()
+                stop.wait(settings.job_poll_interval_seconds)
+                continue
+            job_id, kind, payload, attempt = job.id, job.kind, job.payload, job.attempts
+        except Exception as e:
+            print(f"[-] (Worker {owner}) Error consultando la cola: {e}")
+            db.close()
+            stop.wait(settings.job_poll_interval_seconds)
+            continue
+        db.close()
+
+        print(f"[+] (Worker {owner}) Trabajo {job_id} ({kind}), intento {attempt}.")
+        renewal_stop = threading.Event()
+        renewal = threading.Thread(target=_renew_lease_until, args=(renewal_stop, job_id, owner), daemon=True)
+        renewal.start()
+        error = None
+        try:
+            handler = JOB_HANDLERS.get(kind)
+            if handler is None:
+                raise ValueError(f"Tipo de trabajo desconocido '{kind}'.")
+            handler(payload)
+        except Exception as e:
+            error = f"{e!r}\n{traceback.format_exc()}"
+            print(f"[-] (Worker {owner}) El trabajo {job_id} falló: {e!r}")
+        finally:
+            renewal_stop.set()
+            renewal.join()
+
+        db = SessionLocal()
+        try:
+            if error is None:
+                repository.complete_job(db, job_id, owner)
+            else:
+                new_status = repository.fail_job(
+                    db, job_id, owner, error, retry_delay_seconds=settings.job_retry_backoff_seconds * attempt
+                )
+                print(f"[-] (Worker {owner}) Trabajo {job_id} -> {new_status}.")
+                cleanup = JOB_FINAL_FAILURE_HANDLERS.get(kind)
+                if new_status == "failed" and cleanup is not None:
+                    try:
+                        cleanup(payload)
+                    except Exception as e:
+                        print(f"[-] (Worker {owner}) No se pudo limpiar el trabajo fallido {job_id}: {e!r}")
+        finally:
+            db.close()
+    _publish_metrics(owner)
+    print(f"[+] (Worker {owner}) Detenido.")
+
+
+def _worker_process(index: int) -> None:
+    """Punto de entrada de cada proceso worker; termina limpiamente con SIGTERM o Ctrl+C."""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    run_worker(f"{socket.gethostname()}:{os.getpid()}:{index}", stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=settings.job_worker_processes, help="Número de procesos worker.")
+    args = parser.parse_args()
+
+    from db import database, migrations
+    migrations.upgrade(database.engine)
+
+    # "spawn": cada proceso abre sus propias conexiones a la base de datos y al LLM.
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = False
+
+    def stop_all(*_):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_all)
+    signal.signal(signal.SIGINT, stop_all)
+
+    print(f"[+] Iniciando {args.processes} procesos worker.")
+    while not stopping:
+        # Arranca los procesos que faltan (al inicio, o si alguno murió).
+        for index in range(args.processes):
+            process = processes.get(index)
+            if process is None or not process.is_alive():
+                if process is not None:
+                    print(f"[-] El worker {index} terminó (código {process.exitcode}); se reinicia.")
+                process = context.Process(target=_worker_process, args=(index,), name=f"worker-{index}")
+                process.start()
+                processes[index] = process
+        time.sleep(1.0)
+
+    for process in processes.values():
+        process.join()
+    print("[+] Workers detenidos.")
+
+
+if __name__ == "__main__":
+    main()